@@ -1,16 +1,20 @@
 # (c) 2018-2021 Andreas Motl <andreas.motl@panodata.org>
 # License: GNU Affero General Public License, Version 3
 import logging
-import time
 import typing as t
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
 
-from munch import Munch, munchify
+from munch import Munch
 
+from grafanimate.exposure import AdaptiveExposure
 from grafanimate.grafana import GrafanaWrapper
-from grafanimate.model import AnimationFrame, AnimationSequence
+from grafanimate.model import AnimationFrame, AnimationSequence, FrameRecord
 
 logger = logging.getLogger(__name__)
 
+SkipFunction = t.Callable[[AnimationFrame], bool]
+
 
 class SequentialAnimation:
     def __init__(
@@ -18,12 +22,18 @@ class SequentialAnimation:
         grafana: GrafanaWrapper,
         dashboard_uid: t.Optional[str] = None,
         options: t.Optional[Munch] = None,
+        exposure: t.Optional[AdaptiveExposure] = None,
     ):
         self.grafana = grafana
         self.dashboard_uid = dashboard_uid
         self.options = options or Munch()
+        self.exposure = exposure
         self.dry_run: bool = self.options.get("dry-run", False)
 
+        # Count round trips to the browser, see `log_rpc_stats`.
+        self.frames_captured = 0
+        self.rpcs_spent = 0
+
     def start(self):
         self.log("Opening dashboard")
         self.grafana.open_dashboard(self.dashboard_uid, options=self.options)
@@ -33,7 +43,11 @@ class SequentialAnimation:
         logger.info(message)
         self.grafana.console_info(message)
 
-    def run(self, sequence: AnimationSequence):
+    def run(self, sequence: AnimationSequence, skip: t.Optional[SkipFunction] = None):
+        """
+        Capture all frames of the sequence. Frames for which `skip` returns
+        true are not captured, but yielded as items flagged with `skipped`.
+        """
         if not isinstance(sequence, AnimationSequence):
             return
 
@@ -41,52 +55,168 @@ class SequentialAnimation:
 
         frame: AnimationFrame
         for frame in sequence.get_frames():
-            # logger.info("=" * 42)
-
-            # Render image.
-            image = self.render(frame)
-
-            # Build item model.
-            item = munchify(
-                {
-                    "meta": {
-                        "grafana": self.grafana,
-                        "scenario": self.options["scenario"],
-                        "dashboard": self.dashboard_uid,
-                        "every": frame.timerange.recurrence.every,
-                    },
-                    "data": {
-                        "start": frame.timerange.start,
-                        "stop": frame.timerange.stop,
-                        "image": image,
-                    },
-                    "frame": frame,
-                },
-            )
-
-            yield item
+            if skip is not None and skip(frame):
+                yield self.skipped(frame)
+            else:
+                yield self.capture(frame)
 
         self.log("Animation finished")
+        log_rpc_stats([self])
+
+    def capture(self, frame: AnimationFrame) -> FrameRecord:
+        # logger.info("=" * 42)
+
+        # Render image.
+        image = self.render(frame)
+
+        return self.make_record(frame, image)
+
+    def skipped(self, frame: AnimationFrame) -> FrameRecord:
+        logger.info(f"Skipping frame {frame.timerange.start} -> {frame.timerange.stop}")
+        return self.make_record(frame, None, skipped=True)
+
+    def make_record(
+        self, frame: AnimationFrame, image, skipped: bool = False
+    ) -> FrameRecord:
+        return FrameRecord(
+            frame=frame,
+            image=image,
+            format=self.grafana.capture_format,
+            dashboard=self.dashboard_uid,
+            grafana=self.grafana,
+            skipped=skipped,
+        )
 
     def render(self, frame: AnimationFrame):
-        logger.debug("Adjusting time range control")
-        self.grafana.timewarp(frame, self.dry_run)
+        if self.dry_run:
+            logger.debug("Adjusting time range control")
+            self.grafana.timewarp(frame, self.dry_run)
+            return None
+
+        rpc_count = self.grafana.rpc_count
+        self.prepare(frame)
 
         logger.debug("Rendering image")
-        if self.options["exposure-time"] > 0:
+        image = self.make_image()
+
+        self.frames_captured += 1
+        self.rpcs_spent += self.grafana.rpc_count - rpc_count
+        return image
+
+    def prepare(self, frame: AnimationFrame):
+        """
+        Adjust the time range control, wait for data and exposure time,
+        and update the panel label, all within a single round trip.
+        """
+        budget = None
+        exposure = self.options["exposure-time"]
+        if self.exposure is not None:
+            budget = self.exposure.budget()
+            exposure = 0
             logger.info(
-                "Waiting for %s seconds (exposure time)",
-                self.options["exposure-time"],
+                "Waiting for up to %.2f seconds (adaptive exposure time)", budget
             )
-            time.sleep(self.options["exposure-time"])
-
-        if self.options["panel-id"]:
-            logger.debug("Updating Panel Label")
-            self.grafana.update_tags()
-        if not self.dry_run:
-            return self.make_image()
+        elif exposure > 0:
+            logger.info("Waiting for %s seconds (exposure time)", exposure)
+
+        result = self.grafana.prepare_frame(
+            frame,
+            wait=self.grafana.use_panel_events or self.exposure is not None,
+            timeout=budget,
+            exposure=exposure,
+            improve_chrome=bool(self.options["panel-id"]),
+        )
+
+        if self.exposure is not None:
+            logger.debug(
+                "Frame settled=%s after %.3f seconds", result["ready"], result["waited"]
+            )
+            self.exposure.record(result["waited"], settled=result["ready"])
 
     def make_image(self):
         image = self.grafana.render_image()
         # logger.info('Image size: %s', len(image))
         return image
+
+
+class ParallelAnimation:
+    """
+    Capture frames using a pool of `SequentialAnimation` workers,
+    each one driving its own Firefox instance.
+
+    Frames are dealt to the workers round-robin, and yielded back
+    in their original order.
+    """
+
+    def __init__(
+        self,
+        grafanas: list[GrafanaWrapper],
+        dashboard_uid: t.Optional[str] = None,
+        options: t.Optional[Munch] = None,
+        exposure: t.Optional[AdaptiveExposure] = None,
+    ):
+        self.workers = [
+            SequentialAnimation(
+                grafana=grafana,
+                dashboard_uid=dashboard_uid,
+                options=options,
+                exposure=exposure,
+            )
+            for grafana in grafanas
+        ]
+        self.options = self.workers[0].options
+
+    def start(self):
+        with ThreadPoolExecutor(max_workers=len(self.workers)) as executor:
+            list(executor.map(lambda worker: worker.start(), self.workers))
+
+    def run(self, sequence: AnimationSequence, skip: t.Optional[SkipFunction] = None):
+        if not isinstance(sequence, AnimationSequence):
+            return
+
+        logger.info(f"Starting animation with {len(self.workers)} workers: {sequence}")
+
+        # One single-threaded executor per worker, so that each browser
+        # is only ever driven by a single thread. Only a limited number of
+        # frames is scheduled ahead, so backpressure from downstream
+        # consumers propagates to the browsers.
+        executors = [ThreadPoolExecutor(max_workers=1) for _ in self.workers]
+        lookahead = 2 * len(self.workers)
+        futures: deque[Future] = deque()
+        number = 0
+        try:
+            for frame in sequence.get_frames():
+                if skip is not None and skip(frame):
+                    skipped: Future = Future()
+                    skipped.set_result(self.workers[0].skipped(frame))
+                    futures.append(skipped)
+                else:
+                    slot = number % len(self.workers)
+                    number += 1
+                    futures.append(
+                        executors[slot].submit(self.workers[slot].capture, frame)
+                    )
+                if len(futures) >= lookahead:
+                    yield futures.popleft().result()
+
+            while futures:
+                yield futures.popleft().result()
+
+        finally:
+            for executor in executors:
+                executor.shutdown(wait=True, cancel_futures=True)
+
+        logger.info("Animation finished")
+        log_rpc_stats(self.workers)
+
+
+def log_rpc_stats(animations: list[SequentialAnimation]):
+    """
+    Report the average number of browser round trips per captured frame.
+    """
+    frames = sum(animation.frames_captured for animation in animations)
+    rpcs = sum(animation.rpcs_spent for animation in animations)
+    if frames:
+        logger.info(
+            f"Captured {frames} frames using {rpcs} RPCs, {rpcs / frames:.1f} RPCs per frame"
+        )
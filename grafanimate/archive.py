@@ -0,0 +1,299 @@
+# (c) 2018-2021 Andreas Motl <andreas.motl@panodata.org>
+# License: GNU Affero General Public License, Version 3
+"""
+Single-file, append-only archive format for captured frames.
+
+The archive starts with a file header, followed by one record per frame::
+
+    record marker (4 bytes), metadata length (uint32), data length (uint64),
+    metadata (JSON), data
+
+Metadata holds the frame name, and optionally its sequence index, start
+and stop timestamps, and image format. Deleting a frame appends a record
+without data, which marks the name as deleted.
+
+Next to the archive, an index file holds one JSON line per record, with
+the offset and length of its data. It is only needed for opening large
+archives quickly. When it is missing or outdated, for example after
+copying the archive file alone to another host, the index is rebuilt
+by scanning the record headers.
+
+The reader maps the archive into memory, and provides random access by
+frame number or timestamp, without copying image data.
+"""
+
+import bisect
+import dataclasses
+import json
+import logging
+import mmap
+import os
+import struct
+import threading
+import typing as t
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+FILE_HEADER = b"GRAFANIMATE-ARCHIVE\x00\x01\x00\x00\x00"
+RECORD_MARKER = b"FRME"
+RECORD_HEADER = struct.Struct("<4sIQ")
+
+
+class ArchiveError(Exception):
+    pass
+
+
+@dataclasses.dataclass
+class ArchiveEntry:
+    """
+    Location of a frame within the archive, and its metadata.
+    """
+
+    name: str
+    offset: int
+    length: int
+    metadata: dict[str, t.Any] = dataclasses.field(default_factory=dict)
+
+    @property
+    def end(self) -> int:
+        return self.offset + self.length
+
+    @property
+    def start(self) -> t.Optional[datetime]:
+        value = self.metadata.get("start")
+        return datetime.fromisoformat(value) if value else None
+
+
+class FrameArchive:
+    """
+    Append frames to an archive file, and read them back by name,
+    frame number, or timestamp.
+    """
+
+    def __init__(self, path: str, writable: bool = True):
+        self.path = str(path)
+        self.index_path = self.path + ".index"
+        self.writable = writable
+        self.lock = threading.Lock()
+        # Entries by name, in the order of their frame numbers.
+        self.names: dict[str, ArchiveEntry] = {}
+        # Frame numbers, built on demand after replacing or deleting frames.
+        self.numbered: t.Optional[list[ArchiveEntry]] = []
+        self.numbers: dict[str, int] = {}
+        # Start timestamps of the frames in ascending order, and their names.
+        self.starts: list[datetime] = []
+        self.start_names: list[str] = []
+        self.untimed: set[str] = set()
+        self.size = 0
+        self.mapping: t.Optional[mmap.mmap] = None
+        self.mapped_size = 0
+
+        if writable and not os.path.exists(self.path):
+            with open(self.path, "wb") as f:
+                f.write(FILE_HEADER)
+            self.reset_index()
+        # The file stays open for appending and mapping, until `close`.
+        self.file = open(self.path, "r+b" if writable else "rb")
+        if self.file.read(len(FILE_HEADER)) != FILE_HEADER:
+            self.file.close()
+            raise ArchiveError(f"Not a frame archive: {self.path}")
+        self.size = os.fstat(self.file.fileno()).st_size
+        self.load_index()
+
+    def load_index(self):
+        """
+        Load index file, or rebuild it from the record headers.
+        """
+        records: list[tuple[ArchiveEntry, bool]] = []
+        try:
+            with open(self.index_path) as f:
+                for line in f:
+                    data = json.loads(line)
+                    records.append(
+                        (
+                            ArchiveEntry(
+                                name=data["name"],
+                                offset=data["offset"],
+                                length=data["length"],
+                                metadata=data.get("metadata", {}),
+                            ),
+                            data.get("deleted", False),
+                        )
+                    )
+            end = records[-1][0].end if records else len(FILE_HEADER)
+            if end != self.size:
+                raise ValueError("Index is outdated")
+        except (OSError, ValueError, KeyError):
+            logger.info(f"Rebuilding index of frame archive {self.path}")
+            records = list(self.scan())
+            if self.writable:
+                self.reset_index()
+                for entry, deleted in records:
+                    self.write_index(entry, deleted)
+
+        for entry, deleted in records:
+            self.register(entry, deleted)
+
+    def scan(self) -> t.Generator[tuple[ArchiveEntry, bool], None, None]:
+        """
+        Read record headers sequentially. A truncated last record, for
+        example after a crash, is ignored.
+        """
+        position = len(FILE_HEADER)
+        while position + RECORD_HEADER.size <= self.size:
+            self.file.seek(position)
+            marker, metadata_length, data_length = RECORD_HEADER.unpack(
+                self.file.read(RECORD_HEADER.size)
+            )
+            offset = position + RECORD_HEADER.size + metadata_length
+            if marker != RECORD_MARKER or offset + data_length > self.size:
+                logger.warning(f"Ignoring truncated record at offset {position}")
+                break
+            metadata = json.loads(self.file.read(metadata_length))
+            name = metadata.pop("name")
+            deleted = metadata.pop("deleted", False)
+            yield ArchiveEntry(name, offset, data_length, metadata), deleted
+            position = offset + data_length
+        if self.writable and position != self.size:
+            self.file.truncate(position)
+            self.size = position
+
+    def register(self, entry: ArchiveEntry, deleted: bool = False):
+        previous = self.names.pop(entry.name, None)
+        if previous is not None:
+            self.unindex(previous)
+            # Subsequent frames move up, numbers are assigned again when needed.
+            self.numbered = None
+        if deleted:
+            return
+        self.names[entry.name] = entry
+        if self.numbered is not None:
+            self.numbers[entry.name] = len(self.numbered)
+            self.numbered.append(entry)
+        start = entry.start
+        if start is None:
+            self.untimed.add(entry.name)
+        else:
+            # Frames starting at the same time are ordered by their frame numbers.
+            position = bisect.bisect_right(self.starts, start)
+            self.starts.insert(position, start)
+            self.start_names.insert(position, entry.name)
+
+    def unindex(self, entry: ArchiveEntry):
+        start = entry.start
+        if start is None:
+            self.untimed.discard(entry.name)
+            return
+        position = bisect.bisect_left(self.starts, start)
+        while self.start_names[position] != entry.name:
+            position += 1
+        del self.starts[position]
+        del self.start_names[position]
+
+    def renumber(self) -> list[ArchiveEntry]:
+        if self.numbered is None:
+            self.numbered = list(self.names.values())
+            self.numbers = {
+                entry.name: number for number, entry in enumerate(self.numbered)
+            }
+        return self.numbered
+
+    @property
+    def entries(self) -> list[ArchiveEntry]:
+        return self.renumber()
+
+    def reset_index(self):
+        with open(self.index_path, "w"):
+            pass
+
+    def write_index(self, entry: ArchiveEntry, deleted: bool = False):
+        record: dict[str, t.Any] = dataclasses.asdict(entry)
+        if deleted:
+            record["deleted"] = True
+        with open(self.index_path, "a") as f:
+            f.write(json.dumps(record) + "\n")
+
+    def append(
+        self,
+        name: str,
+        data: bytes,
+        metadata: t.Optional[dict[str, t.Any]] = None,
+        deleted: bool = False,
+    ) -> ArchiveEntry:
+        """
+        Append frame to archive. Frames with the same name replace earlier ones.
+        """
+        if not self.writable:
+            raise ArchiveError(f"Archive is read-only: {self.path}")
+        header_metadata = dict(metadata or {}, name=name)
+        if deleted:
+            header_metadata["deleted"] = True
+        encoded = json.dumps(header_metadata).encode()
+        with self.lock:
+            self.file.seek(self.size)
+            self.file.write(RECORD_HEADER.pack(RECORD_MARKER, len(encoded), len(data)))
+            self.file.write(encoded)
+            self.file.write(data)
+            self.file.flush()
+            offset = self.size + RECORD_HEADER.size + len(encoded)
+            entry = ArchiveEntry(name, offset, len(data), dict(metadata or {}))
+            self.size = offset + len(data)
+            self.write_index(entry, deleted)
+            self.register(entry, deleted)
+        return entry
+
+    def delete(self, name: str):
+        if name in self.names:
+            self.append(name, b"", deleted=True)
+
+    def view(self, entry: ArchiveEntry) -> memoryview:
+        """
+        Access frame data through the memory mapping, without copying it.
+        """
+        with self.lock:
+            if self.mapping is None or self.mapped_size < entry.end:
+                # The archive has grown. Views into the previous mapping may
+                # still be in use, so it is left to garbage collection.
+                self.mapping = mmap.mmap(
+                    self.file.fileno(), self.size, access=mmap.ACCESS_READ
+                )
+                self.mapped_size = self.size
+            return memoryview(self.mapping)[entry.offset : entry.end]
+
+    def read(self, name: str) -> memoryview:
+        return self.view(self.names[name])
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def __getitem__(self, number: int) -> memoryview:
+        return self.view(self.entries[number])
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.names
+
+    def find(self, timestamp: datetime) -> int:
+        """
+        Find number of the latest frame starting at or before the given timestamp.
+        """
+        if self.untimed:
+            raise ArchiveError(
+                f"Archive entry has no timestamp: {next(iter(self.untimed))}"
+            )
+        position = bisect.bisect_right(self.starts, timestamp)
+        if position == 0:
+            raise KeyError(f"No frame at {timestamp.isoformat()}")
+        self.renumber()
+        return self.numbers[self.start_names[position - 1]]
+
+    def close(self):
+        with self.lock:
+            if self.mapping is not None:
+                try:
+                    self.mapping.close()
+                except BufferError:
+                    # Views handed out are still in use, defer to garbage collection.
+                    pass
+                self.mapping = None
+            self.file.close()
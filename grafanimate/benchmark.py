@@ -0,0 +1,154 @@
+# (c) 2018-2021 Andreas Motl <andreas.motl@panodata.org>
+# License: GNU Affero General Public License, Version 3
+import dataclasses
+import logging
+import os
+import time
+import typing as t
+
+from grafanimate.encoder import EncoderError, EncoderJobManager
+from grafanimate.grafana import GrafanaWrapper
+from grafanimate.imaging import IMAGE_EXTENSIONS
+from grafanimate.marionette import FirefoxMarionetteBase
+from grafanimate.model import EncoderProfile, RenderingOptions
+from grafanimate.postprocessing import MediaOutput, MediaProducer
+
+logger = logging.getLogger(__name__)
+
+
+def benchmark_capture(
+    grafana: GrafanaWrapper,
+    frames: int = 10,
+    quality: float = 0.92,
+) -> list[dict[str, t.Any]]:
+    """
+    Compare frame capture methods by bytes and milliseconds per frame.
+    """
+    rect = grafana.get_panel_rect() if grafana.capture_panel_id else None
+    element = grafana.get_panel_element() if grafana.capture_panel_id else None
+    methods: dict[str, t.Callable[[], bytes]] = {
+        "screenshot-png": lambda: FirefoxMarionetteBase.render_image(
+            grafana, element=element
+        ),
+        "canvas-png": lambda: grafana.render_canvas("png", rect=rect),
+        "canvas-jpeg": lambda: grafana.render_canvas("jpeg", quality, rect=rect),
+        "canvas-webp": lambda: grafana.render_canvas("webp", quality, rect=rect),
+    }
+
+    results = []
+    for name, method in methods.items():
+        logger.info(f"Benchmarking capture method {name}")
+
+        # Warm up.
+        method()
+
+        size = 0
+        started = time.perf_counter()
+        for _ in range(frames):
+            size += len(method())
+        duration = time.perf_counter() - started
+
+        results.append(
+            {
+                "method": name,
+                "frames": frames,
+                "bytes_per_frame": size // frames,
+                "ms_per_frame": round(duration / frames * 1000, 1),
+            }
+        )
+    return results
+
+
+def sample_frames(path: str, count: int = 10) -> list[str]:
+    """
+    Select `count` frames evenly spread over the frames in the spool directory.
+    """
+    extensions = tuple("." + extension for extension in set(IMAGE_EXTENSIONS.values()))
+    files = sorted(
+        os.path.join(path, name)
+        for name in os.listdir(path)
+        if name.endswith(extensions)
+    )
+    stride = max(len(files) // max(count, 1), 1)
+    return files[::stride][:count]
+
+
+def benchmark_encode(
+    files: list[str],
+    profiles: list[EncoderProfile],
+    workdir: str,
+    options: t.Optional[RenderingOptions] = None,
+    manager: t.Optional[EncoderJobManager] = None,
+) -> list[dict[str, t.Any]]:
+    """
+    Compare encoder profiles by encoded frames per second and output bytes.
+    """
+    options = options or RenderingOptions()
+    results = []
+    for profile in profiles:
+        logger.info(f"Benchmarking encoder profile {profile.name}")
+        producer = MediaProducer(
+            dataclasses.replace(options, profile=profile, chunk_seconds=None),
+            manager=manager,
+        )
+        concat = producer.write_steps(
+            [(file, 1) for file in files], os.path.join(workdir, "frames.ffconcat")
+        )
+        target = os.path.join(workdir, f"{profile.name}.{profile.extension}")
+        output = MediaOutput(
+            target, producer.video_filter(), producer.video_arguments()
+        )
+
+        result: dict[str, t.Any] = {
+            "profile": profile.name,
+            "codec": profile.codec,
+            "frames": "-",
+            "seconds": "-",
+            "fps": "-",
+            "bytes": "-",
+        }
+        started = time.perf_counter()
+        try:
+            job = producer.run_ffmpeg(
+                [
+                    "-f",
+                    "concat",
+                    "-safe",
+                    "0",
+                    "-i",
+                    concat,
+                    *producer.output_arguments([output], threads=producer.threads),
+                ],
+                name=target,
+            )
+        except EncoderError as ex:
+            logger.warning(f"Encoder profile {profile.name} failed: {ex}")
+        else:
+            duration = time.perf_counter() - started
+            result.update(
+                frames=job.progress.frame,
+                seconds=round(duration, 2),
+                fps=round(job.progress.frame / duration, 1) if duration else 0.0,
+                bytes=os.path.getsize(target),
+            )
+        results.append(result)
+    return results
+
+
+def format_results(results: list[dict[str, t.Any]]) -> str:
+    """
+    Format benchmark results as plain text table.
+    """
+    if not results:
+        return ""
+    columns = list(results[0].keys())
+    widths = [
+        max(len(column), *(len(str(result[column])) for result in results))
+        for column in columns
+    ]
+    rows = [columns, ["-" * width for width in widths]]
+    rows += [[str(result[column]) for column in columns] for result in results]
+    return "\n".join(
+        "  ".join(cell.ljust(width) for cell, width in zip(row, widths)).rstrip()
+        for row in rows
+    )
@@ -1,23 +1,57 @@
 # (c) 2018-2021 Andreas Motl <andreas.motl@panodata.org>
 # License: GNU Affero General Public License, Version 3
+import atexit
+import dataclasses
 import json
 import logging
 import os
-import typing as t
+import tempfile
 from ast import literal_eval
 from pathlib import Path
 
 from docopt import DocoptExit, docopt
+from munch import Munch
 
 from grafanimate import __appname__, __version__
-from grafanimate.core import get_scenario, make_grafana, run_animation_scenario
-from grafanimate.media import produce_artifacts
-from grafanimate.model import RenderingOptions
-from grafanimate.util import asbool, normalize_options, setup_logging
-
-if t.TYPE_CHECKING:
-    from grafanimate.spool import TemporaryStorage
-
+from grafanimate.benchmark import (
+    benchmark_capture,
+    benchmark_encode,
+    format_results,
+    sample_frames,
+)
+from grafanimate.core import (
+    APPEARANCE_SETTINGS,
+    frame_cache_settings,
+    get_scenario,
+    make_grafana,
+    make_grafana_pool,
+    make_query_cache_proxy,
+    run_animation_scenario,
+)
+from grafanimate.daemon import BrowserDaemon
+from grafanimate.encoder import get_job_manager
+from grafanimate.framecache import palette_file
+from grafanimate.imaging import IMAGE_EXTENSIONS, read_region
+from grafanimate.incremental import AppendState
+from grafanimate.media import output_filename, produce_artifacts
+from grafanimate.model import (
+    ENCODER_PROFILES,
+    GIF_ENCODERS,
+    AnimationScenario,
+    RenderingOptions,
+    Rendition,
+)
+from grafanimate.postprocessing import MediaProducer, StreamingEncoder
+from grafanimate.spool import TemporaryStorage, settings_digest
+from grafanimate.spoolbackend import SPOOL_BACKENDS
+from grafanimate.util import (
+    asbool,
+    ensure_directory,
+    filter_dict,
+    normalize_options,
+    read_list,
+    setup_logging,
+)
 
 log = logging.getLogger(__name__)
 
@@ -26,6 +60,9 @@ def run():
     """
     Usage:
       grafanimate [options] [--target=<target>]...
+      grafanimate serve-browser [options]
+      grafanimate bench-capture [options]
+      grafanimate bench-encode [options]
       grafanimate --version
       grafanimate (-h | --help)
 
@@ -57,6 +94,8 @@ def run():
                                     Caveat: Does not work for "d-solo" panels
 
       --panel-id=<id>               Render single panel only by navigating to "panelId=<id>&fullscreen".
+      --capture-panel               Take screenshots of the panel element designated by --panel-id only,
+                                    instead of the whole viewport. [default: false]
       --dashboard-view=<mode>       Use Grafana's "d-solo" view for rendering single panels without header.
                                     "d-solo" is incompatible with the "use-panel-events" option
 
@@ -91,8 +130,57 @@ def run():
     Capturing options:
       --exposure-time=<seconds>     How long to wait for each frame to complete rendering. [default: 0.5]
                                     Caveat: Is ignored when use-panel-events is set
+      --adaptive-exposure           Instead of waiting for a fixed exposure time, wait for each frame's data
+                                    to arrive, bounded by a budget learned from the settle times previously
+                                    observed for the same dashboard and panel. [default: false]
+      --exposure-stats=<path>       Where to keep settle time statistics between runs.
+                                    Default: ~/.cache/grafanimate/exposure.json
+      --capture-format=<format>     Image format for capturing frames. [default: png]
+
+                                    - png:                  Use Marionette's lossless PNG screenshots
+                                    - webp, jpeg:           Draw and encode frames within the browser,
+                                                            which is cheaper to encode and to transfer
+      --capture-quality=<quality>   Quality for lossy capture formats, between 0 and 1. [default: 0.92]
+      --dedup                       Collapse runs of identical consecutive frames into a single image, which
+                                    will be displayed for a correspondingly longer duration. [default: false]
+      --dedup-mask=<x,y,w,h>        Region to ignore when comparing frames, e.g. the datetime label.
+                                    Requires Pillow, see `pip install 'grafanimate[imaging]'`.
+      --spool=<path>                Keep captured frames in this directory, instead of a temporary one which
+                                    is removed after rendering. Completed frames are recorded into the file
+                                    `manifest.jsonl` within that directory.
+      --spool-backend=<backend>     Where to keep captured frames until encoding them. [default: disk]
+
+                                    - disk:                 Temporary directory on the default filesystem
+                                    - tmpfs:                Temporary directory within `/dev/shm`
+                                    - memory:               Keep frames in memory, bounded by --spool-size
+                                    - archive:              Single append-only archive file `frames.archive`,
+                                                            with an index, within a temporary directory
+                                                            or the --spool directory
+      --spool-size=<mb>             Maximum size of the memory spool, in megabytes. [default: 512]
+      --resume                      Resume an interrupted run from the frames recorded in the --spool directory,
+                                    only capturing the missing ones. Without this option, frames of a previous
+                                    run are discarded. [default: false]
+      --append                      Incremental mode for scenarios relative to "now". Only capture the frames
+                                    ending after the last frame of the previous run's video, and append them to
+                                    it using stream copy, instead of re-encoding the whole video. The state is
+                                    kept next to the video, in `<output>.mp4.state.json`. Only supports
+                                    scenarios with a single sequence. [default: false]
+      --optimize-png                Losslessly recompress captured PNG frames before spooling them, converting
+                                    them to palette images when they use 256 colors or less. Runs in a pool of
+                                    processes, in parallel to capturing. Requires Pillow. [default: false]
+      --optimize-workers=<count>    Number of processes for optimizing frames. Default: Number of CPUs.
+      --workers=<count>             Number of Firefox instances capturing frames in parallel. Each instance
+                                    uses its own Marionette port, counting upwards from 2828. [default: 1]
 
     Rendering options:
+      --stream                      Stream captured frames into FFmpeg while capturing, instead of writing them
+                                    to the spool, and encoding the video afterwards. Can not be combined with
+                                    --spool, --resume, --append, or --dedup. [default: false]
+      --hls                         Stream captured frames into an HTTP Live Streaming playlist `<output>.m3u8`
+                                    and its segments while capturing, so the animation can be watched, or served
+                                    by a static web server, before rendering has finished. Can not be combined
+                                    with --append. [default: false]
+      --hls-seconds=<seconds>       Duration of HLS segments. [default: 2]
       --video-framerate=<rate>      Framerate to apply when recording the video. This value will get propagated
                                     to FFmpeg's `-framerate` parameter. [default: 2]
       --video-fps=<fps>             Frames per second to apply when recording the video. This value will get
@@ -100,6 +188,68 @@ def run():
       --gif-fps=<fps>               Frames per second to apply when recording the animated gif, propagated into
                                     FFmpeg's `-filter_complex` options. [default: 10]
       --gif-width=<pixel>           Width of the gif in pixels. [default: 480]
+      --gif-palette-stride=<count>  Generate the palette of the gif from every n-th frame only. With --frame-cache,
+                                    the palette is stored next to the cached frames, and reused by subsequent
+                                    renders of the same dashboard. [default: 10]
+      --gif-encoder=<name>          Encoder for GIFs. Can not be combined with --stream or --append. [default: ffmpeg]
+
+                                    - ffmpeg:               FFmpeg's `palettegen` and `paletteuse` filters
+                                    - delta:                Only write the region of each frame which changed
+                                                            since the previous one. Requires NumPy and Pillow.
+      --apng                        Also produce an animated PNG using the delta encoder, with the width of
+                                    the GIF. Can not be combined with --stream or --append. [default: false]
+      --renditions=<list>           Additional renditions, produced in the same pass as the video and the GIF.
+                                    Use `<height>p` for videos, and `<width>px` for GIFs, separated by comma,
+                                    like `1080p,720p,320px`.
+      --chunk-seconds=<seconds>     Split the video into chunks of this many seconds, aligned to keyframes,
+                                    encode them in parallel, and join them without re-encoding.
+                                    Default: Encode the video in a single pass.
+      --encoder-profile=<name>      Codec settings for encoding videos. [default: default]
+
+                                    - default:              H.264 using FFmpeg's defaults
+                                    - fast-preview:         H.264 using the `ultrafast` preset, for previews
+                                    - archive:              H.265 using the `slow` preset, for small files
+                                                            of high quality
+                                    - web-small:            VP9 within WebM, for small files on the web
+                                    - av1:                  AV1, for smallest files, encoding slowly
+      --cpu-budget=<count>          Number of CPUs shared by all FFmpeg processes. Jobs exceeding the budget
+                                    wait for running ones to finish. Default: Number of CPUs.
+      --encoder-threads=<count>     Number of threads per FFmpeg process. Default: The whole CPU budget.
+      --encoder-timeout=<seconds>   Abort FFmpeg processes running longer than this. Default: No timeout.
+
+    Query cache options:
+      --query-cache                 Start a local caching proxy in front of Grafana, and point Firefox to it.
+                                    Responses of datasource queries (`/api/ds/query`, `/api/datasources/proxy`)
+                                    are stored on disk, and replayed on subsequent renders. [default: false]
+      --query-cache-path=<path>     Where to store cached responses.
+                                    Default: ~/.cache/grafanimate/queries
+      --query-cache-size=<mb>       Maximum size of the query cache, in megabytes. [default: 512]
+      --query-cache-ttl=<seconds>   How long to reuse cached responses. Default: Forever.
+
+    Frame cache options:
+      --frame-cache                 Keep captured frames in a persistent cache shared across runs, keyed by
+                                    dashboard UID and version, time range, and layout and capture options.
+                                    Only frames whose time range ended before the run started are cached,
+                                    because their data is not expected to change anymore. [default: false]
+      --frame-cache-path=<path>     Where to store cached frames.
+                                    Default: ~/.cache/grafanimate/frames
+      --frame-cache-size=<mb>       Maximum size of the frame cache, in megabytes. Least recently used frames
+                                    are evicted first. [default: 1024]
+
+    Browser daemon options:
+      serve-browser                 Keep Firefox running with authenticated and pre-warmed Grafana sessions,
+                                    one tab per dashboard, to be reused by subsequent invocations using the
+                                    same --grafana-url, --dashboard-uid, and layout options. Multiple
+                                    dashboards can be given as comma-separated list to --dashboard-uid.
+                                    Use --workers to pre-warm a pool of Firefox instances.
+
+    Benchmark options:
+      bench-capture                 Compare frame capture methods by bytes and milliseconds per frame, using
+                                    the dashboard designated by --grafana-url, --dashboard-uid, and --panel-id.
+      bench-encode                  Compare encoder profiles by frames per second and bytes, encoding a sample
+                                    of the frames in the --spool directory using each profile.
+      --bench-frames=<count>        Number of frames to capture per method, or to encode per profile.
+                                    [default: 10]
 
       --dry-run                     Enable dry-run mode
       --debug                       Enable debug logging
@@ -119,6 +269,9 @@ def run():
       # Use more parameters to control the rendering process.
       grafanimate --grafana-url=http://localhost:3000/ --dashboard-uid=acUXbj_mz --scenario=ir_sensor_svg_pixmap --header-layout=studio --datetime-format=human-time --panel-id=6 --use-panel-events
 
+      # Keep pre-warmed browser sessions around, to be reused by subsequent invocations.
+      grafanimate serve-browser --grafana-url=http://localhost:3000/ --dashboard-uid=1aOmc1sik
+
     """
 
     # Parse command line arguments.
@@ -137,25 +290,59 @@ def run():
         log.info(f"Options: {json.dumps(options, indent=4)}")
 
     # Sanity checks.
-    if not options["scenario"]:
-        raise DocoptExit("Error: Parameter --scenario is mandatory")
-
-    output_path = options.output
-    if not output_path:
-        output_path = os.environ.get("GRAFANIMATE_OUTPUT")
-    if not output_path:
-        raise DocoptExit(
-            "Error: Parameter --output or environment variable GRAFANIMATE_OUTPUT is mandatory",
-        )
-
     if options["dashboard-view"] == "d-solo" and not options["panel-id"]:
         raise DocoptExit(
             "Error: Parameter --panel-id is mandatory for --dashboard-view=d-solo",
         )
 
     options["exposure-time"] = float(options["exposure-time"])
+    options["workers"] = int(options["workers"])
+    if options["workers"] < 1:
+        raise DocoptExit("Error: Parameter --workers must be a positive number")
     options["use-panel-events"] = asbool(options["use-panel-events"])
     options["headless"] = asbool(options["headless"])
+    options["adaptive-exposure"] = asbool(options["adaptive-exposure"])
+    options["capture-panel"] = asbool(options["capture-panel"])
+    options["dedup"] = asbool(options["dedup"])
+    if options["capture-format"] not in IMAGE_EXTENSIONS:
+        raise DocoptExit(
+            f"Error: Parameter --capture-format must be one of {', '.join(IMAGE_EXTENSIONS)}"
+        )
+    options["query-cache"] = asbool(options["query-cache"])
+    options["resume"] = asbool(options["resume"])
+    options["frame-cache"] = asbool(options["frame-cache"])
+    options["append"] = asbool(options["append"])
+    options["stream"] = asbool(options["stream"])
+    options["optimize-png"] = asbool(options["optimize-png"])
+    options["apng"] = asbool(options["apng"])
+    options["hls"] = asbool(options["hls"])
+    if options["hls"] and options["append"]:
+        raise DocoptExit("Error: Parameter --hls can not be combined with --append")
+    if options["optimize-workers"]:
+        options["optimize-workers"] = int(options["optimize-workers"])
+    if options["optimize-png"] and options["stream"]:
+        raise DocoptExit(
+            "Error: Parameter --optimize-png can not be combined with --stream"
+        )
+    if options["spool-backend"] not in SPOOL_BACKENDS:
+        raise DocoptExit(
+            f"Error: Parameter --spool-backend must be one of {', '.join(SPOOL_BACKENDS)}"
+        )
+    if options["spool-backend"] == "memory" and options["spool"]:
+        raise DocoptExit(
+            "Error: Parameter --spool can not be used with --spool-backend=memory"
+        )
+    if options["stream"] and any(
+        options[name] for name in ["spool", "resume", "append", "dedup"]
+    ):
+        raise DocoptExit(
+            "Error: Parameter --stream can not be combined with --spool, --resume, --append, or --dedup"
+        )
+    if options["resume"] and not options["spool"]:
+        raise DocoptExit("Error: Parameter --spool is mandatory for --resume")
+    options["dedup-mask"] = read_region(options["dedup-mask"])
+    if options["capture-panel"] and not options["panel-id"]:
+        raise DocoptExit("Error: Parameter --panel-id is mandatory for --capture-panel")
     if options["use-panel-events"]:
         options["exposure-time"] = 0
     if options["window-size"]:
@@ -164,15 +351,226 @@ def run():
         options["zoom-factor"] = float(options["zoom-factor"])
 
     # Prepare rendering options.
+    try:
+        renditions = [Rendition.parse(spec) for spec in read_list(options.renditions)]
+    except ValueError as ex:
+        raise DocoptExit(f"Error: Parameter --renditions: {ex}") from ex
+    if options["gif-encoder"] not in GIF_ENCODERS:
+        raise DocoptExit(
+            f"Error: Parameter --gif-encoder must be one of {', '.join(GIF_ENCODERS)}"
+        )
+    if (options["gif-encoder"] == "delta" or options["apng"]) and (
+        options["stream"] or options["append"]
+    ):
+        raise DocoptExit(
+            "Error: Parameters --gif-encoder=delta and --apng can not be combined with --stream or --append"
+        )
+    if options["encoder-profile"] not in ENCODER_PROFILES:
+        raise DocoptExit(
+            f"Error: Parameter --encoder-profile must be one of {', '.join(ENCODER_PROFILES)}"
+        )
     render_options = RenderingOptions(
         video_framerate=int(options.video_framerate),
         video_fps=int(options.video_fps),
         gif_fps=int(options.gif_fps),
         gif_width=int(options.gif_width),
+        palette_stride=int(options.gif_palette_stride),
+        gif_encoder=options["gif-encoder"],
+        apng=options["apng"],
+        renditions=renditions,
+        profile=ENCODER_PROFILES[options["encoder-profile"]],
+        chunk_seconds=options.chunk_seconds and int(options.chunk_seconds),
+        hls_seconds=int(options.hls_seconds),
+        encoder_threads=options.encoder_threads and int(options.encoder_threads),
+        encoder_timeout=options.encoder_timeout and float(options.encoder_timeout),
     )
+    get_job_manager(cpu_budget=options.cpu_budget and int(options.cpu_budget))
+
+    # Run browser daemon.
+    if options["serve-browser"]:
+        return serve_browser(options)
+
+    # Run capture benchmark.
+    if options["bench-capture"]:
+        return bench_capture(options)
+
+    # Run encoder benchmark.
+    if options["bench-encode"]:
+        return bench_encode(options, render_options)
+
+    if not options["scenario"]:
+        raise DocoptExit("Error: Parameter --scenario is mandatory")
+
+    output_path = options.output
+    if not output_path:
+        output_path = os.environ.get("GRAFANIMATE_OUTPUT")
+    if not output_path:
+        raise DocoptExit(
+            "Error: Parameter --output or environment variable GRAFANIMATE_OUTPUT is mandatory",
+        )
 
     # Load scene.
     scenario = get_scenario(options["scenario"])
+    resolve_target(scenario, options)
+    if options["append"]:
+        try:
+            AppendState.check(scenario)
+        except ValueError as ex:
+            raise DocoptExit(f"Error: Parameter --append: {ex}") from ex
+
+    # Optionally put a caching proxy in front of Grafana.
+    grafana_url = scenario.grafana_url
+    if options["query-cache"]:
+        proxy = make_query_cache_proxy(scenario.grafana_url, options)
+        atexit.register(proxy.stop)
+        grafana_url = proxy.url_for(scenario.grafana_url)
+
+    # Open a Grafana site in Firefox, using Marionette.
+    # With multiple workers, each one gets its own Firefox instance.
+    grafanas = make_grafana_pool(
+        grafana_url,
+        scenario.dashboard_uid,
+        options,
+        options["headless"],
+        workers=options["workers"],
+    )
+    grafana = grafanas[0]
+
+    # Define output filename pattern.
+    output = (
+        Path(output_path)
+        / f"{{scenario}}--{{title}}--{{uid}}.{render_options.profile.extension}"
+    )
+    scenario.dashboard_title = grafana.get_dashboard_title()
+
+    # In incremental mode, only capture frames not encoded into the video yet.
+    append_state = None
+    appending = False
+    if options["append"]:
+        target = output_filename(output, scenario)
+        fingerprint = append_fingerprint(scenario, options, render_options)
+        append_state = AppendState.load(target, fingerprint) or AppendState.create(
+            target, fingerprint
+        )
+        appending = bool(append_state.sequences)
+
+    # With the frame cache, the GIF palette is shared across renders of the same dashboard.
+    palette = None
+    if options["frame-cache"]:
+        version = grafana.get_dashboard_version()
+        if version is not None:
+            palette = gif_palette_file(scenario, options, render_options, version)
+
+    # Encoders running while capturing hold their threads until capturing has
+    # finished. When running two of them, share the CPU budget between them.
+    live_options = render_options
+    if options["stream"] and options["hls"]:
+        manager = get_job_manager()
+        live_options = dataclasses.replace(
+            render_options,
+            encoder_threads=min(
+                render_options.encoder_threads or manager.cpu_budget,
+                manager.threads(jobs=2),
+            ),
+        )
+
+    # Optionally encode the video while capturing.
+    encoder = None
+    if options["stream"]:
+        target = output_filename(output, scenario)
+        ensure_directory(target)
+        encoder = StreamingEncoder(
+            target=target,
+            options=live_options,
+            palette=palette if palette and os.path.exists(palette) else None,
+        )
+
+    # Optionally stream frames into a growing HLS playlist while capturing.
+    hls = None
+    if options["hls"]:
+        target = output_filename(output, scenario)
+        ensure_directory(target)
+        playlist = MediaProducer(options=live_options).hls_output(target)
+        hls = StreamingEncoder(
+            target=playlist.path, options=live_options, outputs=[playlist]
+        )
+
+    # Invoke pipeline: Run stop motion animation, producing single frames.
+    storage: TemporaryStorage = run_animation_scenario(
+        scenario=scenario,
+        grafana=grafanas,
+        options=options,
+        skip=append_state.is_covered if append_state and appending else None,
+        encoder=encoder,
+        hls=hls,
+    )
+
+    # Run rendering sequences, produce composite media artifacts.
+    if not options.dry_run:
+        if append_state is not None and not storage.timeline:
+            log.info("No new frames to append, skipping rendering")
+        else:
+            results = produce_artifacts(
+                input=storage.workdir,
+                output=output,
+                scenario=scenario,
+                options=render_options,
+                timeline=storage.timeline if storage.needs_timeline else None,
+                extension=storage.extension,
+                append=appending,
+                streamed=encoder is not None,
+                frames=None if storage.backend.files else storage.iter_images(),
+                palette=palette,
+            )
+            if hls is not None:
+                results.append(hls.target)
+            if append_state is not None:
+                append_state.update(scenario)
+                append_state.save()
+            log.info(
+                "Produced %s results\n%s", len(results), json.dumps(results, indent=2)
+            )
+        log.info(f"Spool ({storage.backend.name}): {storage.backend.stats.summary()}")
+
+
+def append_fingerprint(
+    scenario: AnimationScenario, options: Munch, render_options: RenderingOptions
+) -> str:
+    """
+    Fingerprint of settings which must not change between appending runs.
+    """
+    settings = filter_dict(options, APPEARANCE_SETTINGS)
+    settings["dashboard-uid"] = scenario.dashboard_uid
+    # Thread counts, timeouts, and HLS segments do not change the format of the video.
+    settings["rendering"] = {
+        name: value
+        for name, value in dataclasses.asdict(render_options).items()
+        if name not in ("encoder_threads", "encoder_timeout", "hls_seconds")
+    }
+    return settings_digest(settings)
+
+
+def gif_palette_file(
+    scenario: AnimationScenario,
+    options: Munch,
+    render_options: RenderingOptions,
+    version: int,
+) -> str:
+    """
+    Location of the cached GIF palette, see `palette_file`. It is scoped
+    like the frame cache, and to the width of the GIF.
+    """
+    settings = frame_cache_settings(scenario, options, version)
+    settings["gif-width"] = render_options.gif_width
+    return str(
+        palette_file(settings_digest(settings), path=options.get("frame-cache-path"))
+    )
+
+
+def resolve_target(scenario: AnimationScenario, options: Munch) -> tuple[str, str]:
+    """
+    Resolve Grafana URL and dashboard UID into scenario.
+    """
 
     # Resolve URL to Grafana, either from command line (precedence), or from scenario file.
     if options["grafana-url"]:
@@ -188,32 +586,71 @@ def run():
         raise KeyError(
             "Dashboard UID is mandatory, either supply it on the command line or via scenario file",
         )
+    return scenario.grafana_url, scenario.dashboard_uid
+
+
+def serve_browser(options: Munch):
+    """
+    Keep pre-warmed browser sessions around, see `BrowserDaemon`.
+    """
+    if options["scenario"]:
+        scenario = get_scenario(options["scenario"])
+    else:
+        scenario = AnimationScenario(sequences=[])
+    grafana_url, dashboard_uid = resolve_target(scenario, options)
+
+    daemon = BrowserDaemon(
+        grafana_url=grafana_url,
+        dashboard_uids=read_list(dashboard_uid),
+        options=options,
+        headless=options["headless"],
+        workers=options["workers"],
+    )
+    daemon.start()
+    daemon.serve_forever()
+
+
+def bench_capture(options: Munch):
+    """
+    Compare frame capture methods, see `benchmark_capture`.
+    """
+    if options["scenario"]:
+        scenario = get_scenario(options["scenario"])
+    else:
+        scenario = AnimationScenario(sequences=[])
+    grafana_url, dashboard_uid = resolve_target(scenario, options)
 
-    # Open a Grafana site in Firefox, using Marionette.
     grafana = make_grafana(
-        scenario.grafana_url,
-        scenario.dashboard_uid,
+        grafana_url,
+        dashboard_uid,
         options,
         options["headless"],
     )
-
-    # Invoke pipeline: Run stop motion animation, producing single frames.
-    storage: TemporaryStorage = run_animation_scenario(
-        scenario=scenario,
-        grafana=grafana,
-        options=options,
+    grafana.open_dashboard(
+        dashboard_uid,
+        options=filter_dict(
+            options, ["panel-id", "dashboard-view", "header-layout", "datetime-format"]
+        ),
+    )
+    results = benchmark_capture(
+        grafana,
+        frames=int(options["bench-frames"]),
+        quality=float(options["capture-quality"]),
     )
+    print(format_results(results))  # noqa: T201
 
-    # Define output filename pattern.
-    output = Path(output_path) / "{scenario}--{title}--{uid}.mp4"
 
-    # Run rendering sequences, produce composite media artifacts.
-    scenario.dashboard_title = grafana.get_dashboard_title()
-    if not options.dry_run:
-        results = produce_artifacts(
-            input=storage.workdir,
-            output=output,
-            scenario=scenario,
-            options=render_options,
+def bench_encode(options: Munch, render_options: RenderingOptions):
+    """
+    Compare encoder profiles, see `benchmark_encode`.
+    """
+    if not options["spool"]:
+        raise DocoptExit("Error: Parameter --spool is mandatory for bench-encode")
+    files = sample_frames(options["spool"], int(options["bench-frames"]))
+    if not files:
+        raise DocoptExit(f"Error: No frames found in {options['spool']}")
+    with tempfile.TemporaryDirectory() as workdir:
+        results = benchmark_encode(
+            files, list(ENCODER_PROFILES.values()), workdir, render_options
         )
-        log.info("Produced %s results\n%s", len(results), json.dumps(results, indent=2))
+    print(format_results(results))  # noqa: T201
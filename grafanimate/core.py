@@ -2,32 +2,100 @@
 # License: GNU Affero General Public License, Version 3
 import importlib
 import logging
+import typing as t
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
 from furl import furl
 from munch import Munch
 
-from grafanimate.animations import SequentialAnimation
+from grafanimate.animations import (
+    ParallelAnimation,
+    SequentialAnimation,
+    SkipFunction,
+)
+from grafanimate.exposure import AdaptiveExposure
+from grafanimate.framecache import FrameCache
 from grafanimate.grafana import GrafanaWrapper
-from grafanimate.model import AnimationScenario, AnimationSequence
+from grafanimate.model import AnimationFrame, AnimationScenario, AnimationSequence
+from grafanimate.optimizer import PngOptimizer
+from grafanimate.pipeline import FramePipeline, Stage
+from grafanimate.postprocessing import StreamingEncoder
+from grafanimate.proxy import CachingProxy, QueryCache
 from grafanimate.spool import TemporaryStorage
+from grafanimate.spoolbackend import MEGABYTE, make_spool_backend
 from grafanimate.util import as_list, filter_dict, import_module
 
 log = logging.getLogger(__name__)
 
+# Options which influence the appearance of captured frames.
+APPEARANCE_SETTINGS = [
+    "panel-id",
+    "dashboard-view",
+    "header-layout",
+    "datetime-format",
+    "window-size",
+    "zoom-factor",
+    "capture-panel",
+    "capture-format",
+    "capture-quality",
+]
+
+# Options which influence the frames recorded into the spool.
+CAPTURE_SETTINGS = [*APPEARANCE_SETTINGS, "dedup", "dedup-mask"]
+
 
 def make_grafana(
     url: str,
     dashboard_uid: str,
     options: dict,
     headless=False,
+    firefox_port: int = 2828,
 ) -> GrafanaWrapper:
-    do_login = False
+    url, credentials = get_dashboard_url(url, dashboard_uid, options)
+    log.info(f"URL: {url}")
+
+    grafana = GrafanaWrapper(
+        baseurl=str(url),
+        use_panel_events=options["use-panel-events"],
+        window_size=options["window-size"],
+        zoom_factor=options["zoom-factor"],
+        firefox_port=firefox_port,
+        capture_panel_id=options["panel-id"] if options.get("capture-panel") else None,
+        capture_format=options.get("capture-format") or "png",
+        capture_quality=float(options.get("capture-quality") or 0.92),
+        header_layout=options.get("header-layout"),
+    )
+    grafana.boot_firefox(headless=headless)
+    open_grafana(grafana, credentials)
+
+    return grafana
+
+
+def open_grafana(
+    grafana: GrafanaWrapper,
+    credentials: t.Optional[tuple[str, str]] = None,
+):
+    """
+    Navigate to Grafana and log in, unless a warm session could be reused.
+    """
+    grafana.boot_grafana()
+    if credentials and not grafana.warm:
+        grafana.login(*credentials)
+
+
+def get_dashboard_url(
+    url: str,
+    dashboard_uid: str,
+    options: dict,
+) -> tuple[str, t.Optional[tuple[str, str]]]:
+    """
+    Compute dashboard URL, and split off credentials.
+    """
+    credentials = None
     url_object = furl(url)
     if url_object.username:
-        do_login = True
-        username = url_object.username
-        password = url_object.password
+        credentials = (url_object.username, url_object.password)
         url_object.username = None
         url_object.password = None
     url = str(url_object)
@@ -50,21 +118,89 @@ def make_grafana(
     if url[-1] != "/":
         url += "/"
     url += view + "/" + dashboard_uid + "/" + slug + query
-    log.info(f"URL: {url}")
+    return url, credentials
 
-    grafana = GrafanaWrapper(
-        baseurl=str(url),
-        use_panel_events=options["use-panel-events"],
-        window_size=options["window-size"],
-        zoom_factor=options["zoom-factor"],
+
+def normalize_grafana_url(url: str) -> str:
+    """
+    Reduce Grafana URL to scheme, host, port, and path, for identifying the instance.
+    """
+    url_object = furl(url)
+    return str(
+        furl(
+            scheme=url_object.scheme,
+            host=(url_object.host or "").lower(),
+            port=url_object.port,
+            path=str(url_object.path).rstrip("/"),
+        )
     )
-    grafana.boot_firefox(headless=headless)
-    grafana.boot_grafana()
 
-    if do_login:
-        grafana.login(username, password)
 
-    return grafana
+def frame_cache_settings(
+    scenario: AnimationScenario, options: dict, version: int
+) -> dict[str, t.Any]:
+    """
+    Settings scoping the frame cache. Frames are shared across runs rendering
+    the same version of a dashboard on the same Grafana instance, using the
+    same appearance settings.
+    """
+    settings = filter_dict(options, APPEARANCE_SETTINGS)
+    settings["grafana-url"] = normalize_grafana_url(scenario.grafana_url or "")
+    settings["dashboard-uid"] = scenario.dashboard_uid
+    settings["dashboard-version"] = version
+    return settings
+
+
+def make_grafana_pool(
+    url: str,
+    dashboard_uid: str,
+    options: dict,
+    headless=False,
+    workers: int = 1,
+    firefox_port: int = 2828,
+) -> list[GrafanaWrapper]:
+    """
+    Start multiple Firefox instances in parallel, each one on its own
+    Marionette port and with its own temporary profile.
+    """
+    ports = [firefox_port + number for number in range(workers)]
+    log.info(f"Starting {workers} Firefox instance(s) on ports {ports}")
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(
+            executor.map(
+                lambda port: make_grafana(
+                    url,
+                    dashboard_uid,
+                    options,
+                    headless=headless,
+                    firefox_port=port,
+                ),
+                ports,
+            )
+        )
+
+
+def make_query_cache_proxy(url: str, options: dict) -> CachingProxy:
+    """
+    Start local caching proxy in front of Grafana.
+    """
+    ttl = options.get("query-cache-ttl")
+    cache = QueryCache(
+        path=options.get("query-cache-path"),
+        max_bytes=int(float(options.get("query-cache-size") or 512) * 1024 * 1024),
+        ttl=ttl and float(ttl),
+    )
+    return CachingProxy(upstream=url, cache=cache).start()
+
+
+def make_frame_cache(options: dict) -> FrameCache:
+    """
+    Open persistent cache for captured frames.
+    """
+    return FrameCache(
+        path=options.get("frame-cache-path"),
+        max_bytes=int(float(options.get("frame-cache-size") or 1024) * 1024 * 1024),
+    )
 
 
 def get_scenario(source: str) -> AnimationScenario:
@@ -113,15 +249,26 @@ def resolve_reference(module, symbol):
 
 def run_animation_scenario(
     scenario: AnimationScenario,
-    grafana: GrafanaWrapper,
+    grafana: t.Union[GrafanaWrapper, list[GrafanaWrapper]],
     options: Munch,
+    skip: t.Optional[SkipFunction] = None,
+    encoder: t.Optional[StreamingEncoder] = None,
+    hls: t.Optional[StreamingEncoder] = None,
 ) -> TemporaryStorage:
+    """
+    Run animation scenario, capturing frames into the spool.
+    Frames for which `skip` returns true will not be captured.
+
+    When `encoder` is given, frames are streamed into it,
+    instead of writing them to the spool.
+
+    When `hls` is given, frames are additionally streamed into it, for
+    watching the animation while it is being captured.
+    """
     log.info(
         f"Running animation scenario at {scenario.grafana_url}, with dashboard UID {scenario.dashboard_uid}",
     )
 
-    storage = TemporaryStorage()
-
     # Define options to be propagated to the Javascript client domain.
     animation_options = filter_dict(
         options,
@@ -136,20 +283,115 @@ def run_animation_scenario(
         ],
     )
 
+    # Optionally learn exposure times per dashboard and panel.
+    exposure = None
+    if options.get("adaptive-exposure"):
+        exposure = AdaptiveExposure.load(
+            key=f"{scenario.dashboard_uid}/{options['panel-id'] or '*'}",
+            path=options.get("exposure-stats"),
+            initial=options["exposure-time"] or 0.5,
+        )
+
     # Start the engines.
-    animation = SequentialAnimation(
-        grafana=grafana,
-        dashboard_uid=scenario.dashboard_uid,
-        options=animation_options,
-    )
+    grafanas = as_list(grafana)
+    animation: t.Union[SequentialAnimation, ParallelAnimation]
+    if len(grafanas) > 1:
+        animation = ParallelAnimation(
+            grafanas=grafanas,
+            dashboard_uid=scenario.dashboard_uid,
+            options=animation_options,
+            exposure=exposure,
+        )
+    else:
+        animation = SequentialAnimation(
+            grafana=grafanas[0],
+            dashboard_uid=scenario.dashboard_uid,
+            options=animation_options,
+            exposure=exposure,
+        )
     animation.start()
 
+    # Frames of a previous run are only reused when captured using the same settings.
+    settings = filter_dict(options, CAPTURE_SETTINGS)
+    settings["dashboard-uid"] = scenario.dashboard_uid
+
+    # Historical frames are shared across runs, as long as the dashboard is unchanged.
+    cache = None
+    cache_settings = None
+    if options.get("frame-cache"):
+        version = grafanas[0].get_dashboard_version()
+        if version is None:
+            log.warning("Unable to determine dashboard version, not using frame cache")
+        else:
+            cache = make_frame_cache(options)
+            cache_settings = frame_cache_settings(scenario, options, version)
+
+    storage = TemporaryStorage(
+        dedup=options.get("dedup", False),
+        dedup_mask=options.get("dedup-mask"),
+        workdir=options.get("spool"),
+        settings=settings,
+        resume=options.get("resume", False),
+        cache=cache,
+        cache_settings=cache_settings,
+        backend=make_spool_backend(
+            options.get("spool-backend") or "disk",
+            path=options.get("spool"),
+            max_bytes=int(float(options.get("spool-size") or 512) * MEGABYTE),
+        ),
+    )
+
+    def skip_frame(frame: AnimationFrame) -> bool:
+        return (skip is not None and skip(frame)) or storage.has_frame(frame)
+
     # Run animation scenario.
-    for index, sequence in enumerate(scenario.sequences):
-        sequence.index = index  # type: ignore[assignment]  # TODO: Review.
-        results = list(animation.run(sequence))
-        if not options.dry_run:
-            storage.save_items(results)
+    # Captured frames are written to the spool by a background stage, while
+    # the browser already moves on to the next frame.
+    stages: list[Stage] = [storage.save_item]
+    maxsize = 4
+    if encoder is not None:
+        stages = [storage.pass_item, encoder.write_item]
+    elif hls is not None:
+        stages = [storage.spool_item]
+    if hls is not None:
+        stages.append(hls.write_item)
+    encoders = [live for live in (encoder, hls) if live is not None]
+    if encoders:
+        encoders[-1].release = True
+    if not options.dry_run:
+        for live in encoders:
+            live.start()
+
+    # Optionally recompress PNG frames in parallel, before spooling them.
+    optimizer = None
+    if options.get("optimize-png") and not options.dry_run:
+        optimizer = PngOptimizer(workers=options.get("optimize-workers")).start()
+        stages = optimizer.stages + stages
+        maxsize = max(maxsize, 2 * optimizer.workers)
+
+    try:
+        with FramePipeline(stages=stages, maxsize=maxsize, collect=False) as pipeline:
+            for index, sequence in enumerate(scenario.sequences):
+                sequence.index = index  # type: ignore[assignment]  # TODO: Review.
+                for item in animation.run(sequence, skip=skip_frame):
+                    if not options.dry_run:
+                        pipeline.submit(item)
+    except BaseException:
+        for live in encoders:
+            live.abort()
+        raise
+    finally:
+        if optimizer is not None:
+            optimizer.stop()
+            log.info(f"PNG optimizer: {optimizer.summary()}")
+    if not options.dry_run:
+        for live in encoders:
+            live.close()
+
+    if exposure is not None:
+        exposure.save()
+    if cache is not None:
+        log.info(f"Frame cache: {cache.hits} hits, {cache.misses} misses")
 
     return storage
 
@@ -0,0 +1,104 @@
+# (c) 2018-2021 Andreas Motl <andreas.motl@panodata.org>
+# License: GNU Affero General Public License, Version 3
+import logging
+import signal
+import sys
+import time
+
+from grafanimate.core import get_dashboard_url, make_grafana, open_grafana
+from grafanimate.grafana import GrafanaWrapper
+from grafanimate.util import check_socket
+
+log = logging.getLogger(__name__)
+
+
+class BrowserDaemon:
+    """
+    Keep Firefox instances around, with authenticated and pre-warmed
+    Grafana sessions, one browser tab per dashboard.
+
+    Subsequent `grafanimate` invocations with the same Grafana URL,
+    dashboard, and layout options will attach to the running Firefox
+    instances, and reuse those tabs, skipping navigation, script
+    injection, and login, see `GrafanaWrapper.warm_key`.
+    """
+
+    def __init__(
+        self,
+        grafana_url: str,
+        dashboard_uids: list[str],
+        options: dict,
+        headless: bool = False,
+        workers: int = 1,
+        firefox_port: int = 2828,
+        interval: float = 30.0,
+    ):
+        self.grafana_url = grafana_url
+        self.dashboard_uids = dashboard_uids
+        self.options = options
+        self.headless = headless
+        self.workers = workers
+        self.firefox_port = firefox_port
+        self.interval = interval
+        self.instances: list[GrafanaWrapper] = []
+
+    def start(self):
+        for number in range(self.workers):
+            self.instances.append(self.warm_instance(self.firefox_port + number))
+
+    def warm_instance(self, port: int) -> GrafanaWrapper:
+        """
+        Start a Firefox instance, and prepare one tab per dashboard.
+        """
+        first, *others = self.dashboard_uids
+        grafana = make_grafana(
+            self.grafana_url,
+            first,
+            self.options,
+            headless=self.headless,
+            firefox_port=port,
+        )
+
+        # Don't shut down Firefox on exit, see `stop`.
+        grafana.enable_shutdown(False)
+
+        for dashboard_uid in others:
+            url, credentials = get_dashboard_url(
+                self.grafana_url, dashboard_uid, self.options
+            )
+            log.info(f"URL: {url}")
+            grafana.baseurl = url
+            grafana.open_tab()
+            open_grafana(grafana, credentials)
+
+        # Release the Marionette session, so clients can connect.
+        if grafana.marionette is not None:
+            grafana.marionette.delete_session()
+        log.info(f"Warm browser session ready on port {port}")
+        return grafana
+
+    def serve_forever(self):
+        # Make sure to shut down Firefox also when being terminated.
+        signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+
+        log.info(
+            f"Serving {len(self.instances)} warm browser(s) for "
+            f"{len(self.dashboard_uids)} dashboard(s). Press CTRL+C to stop."
+        )
+        try:
+            while True:
+                time.sleep(self.interval)
+                for grafana in self.instances:
+                    if not check_socket(grafana.firefox_host, grafana.firefox_port):
+                        log.warning(f"Firefox on port {grafana.firefox_port} went away")
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.stop()
+
+    def stop(self):
+        for grafana in self.instances:
+            instance = grafana.marionette and grafana.marionette.instance
+            if instance is not None:
+                log.info(f"Shutting down Firefox on port {grafana.firefox_port}")
+                instance.close()
@@ -0,0 +1,346 @@
+# (c) 2018-2021 Andreas Motl <andreas.motl@panodata.org>
+# License: GNU Affero General Public License, Version 3
+"""
+Encode animated GIF and APNG images, writing only the region of each
+frame which changed since the previous one.
+
+Between consecutive frames of a dashboard, usually only the plot area and
+the datetime label change. Frames are mapped to a shared palette, and
+compared as NumPy arrays of palette indices. Each frame is written as the
+bounding box of changed pixels, with unchanged pixels within that box set
+to the transparent color, so they compress well. Frames without changes
+extend the duration of the previous one.
+
+https://www.w3.org/Graphics/GIF/spec-gif89a.txt
+https://wiki.mozilla.org/APNG_Specification
+"""
+
+import io
+import logging
+import os
+import struct
+import typing as t
+import zlib
+
+from grafanimate.imaging import import_numpy, import_pillow
+
+logger = logging.getLogger(__name__)
+
+# Palette index of the transparent color, the remaining 255 colors are used by the image.
+TRANSPARENT = 255
+
+# Image file, or image data.
+ImageSource = t.Union[str, bytes, memoryview]
+
+
+class DeltaFrame(t.NamedTuple):
+    """
+    Region of palette indices to be drawn at the given offset, for `duration` milliseconds.
+    """
+
+    x: int
+    y: int
+    indices: t.Any
+    duration: int
+    transparent: bool
+
+
+class GifWriter:
+    """
+    Write animated GIF, looping forever. Frames are drawn on top of each other.
+
+    The LZW compression of frame data is delegated to Pillow, by saving each
+    region as single-frame GIF, and extracting its image data.
+    """
+
+    def __init__(self, fp: t.BinaryIO, width: int, height: int, palette: bytes):
+        self.fp = fp
+        self.palette = palette
+        fp.write(b"GIF89a")
+        # Logical screen descriptor, with global color table of 256 colors.
+        fp.write(struct.pack("<HHBBB", width, height, 0xF7, 0, 0))
+        fp.write(palette)
+        # Netscape application extension, looping forever.
+        fp.write(b"\x21\xff\x0bNETSCAPE2.0\x03\x01\x00\x00\x00")
+
+    def write(self, frame: DeltaFrame):
+        # Graphic control extension: Keep frame in place, delay in centiseconds.
+        packed = 1 << 2 | (1 if frame.transparent else 0)
+        self.fp.write(
+            struct.pack(
+                "<BBBBHBB",
+                0x21,
+                0xF9,
+                4,
+                packed,
+                round(frame.duration / 10),
+                TRANSPARENT,
+                0,
+            )
+        )
+        height, width = frame.indices.shape
+        self.fp.write(struct.pack("<BHHHHB", 0x2C, frame.x, frame.y, width, height, 0))
+        self.fp.write(self.compress(frame.indices))
+
+    def compress(self, indices) -> bytes:
+        """
+        LZW-compress palette indices into GIF image data sub-blocks.
+        """
+        Image, _ = import_pillow()
+        height, width = indices.shape
+        image = Image.frombytes("P", (width, height), indices.tobytes())
+        image.putpalette(self.palette)
+        buffer = io.BytesIO()
+        image.save(buffer, format="GIF", optimize=False, interlace=False)
+        return extract_gif_image_data(buffer.getvalue())
+
+    def close(self):
+        self.fp.write(b"\x3b")
+
+
+def extract_gif_image_data(data: bytes) -> bytes:
+    """
+    Extract LZW code size and data sub-blocks of the first image of a GIF file.
+    """
+    flags = data[10]
+    position = 13
+    if flags & 0x80:
+        position += 3 << ((flags & 0x07) + 1)
+    while data[position] == 0x21:
+        # Skip extension, consisting of label and data sub-blocks.
+        position += 2
+        while data[position]:
+            position += data[position] + 1
+        position += 1
+    if data[position] != 0x2C:
+        raise ValueError("Unable to find image data within GIF")
+    flags = data[position + 9]
+    position += 10
+    if flags & 0x80:
+        position += 3 << ((flags & 0x07) + 1)
+    end = position + 1
+    while data[end]:
+        end += data[end] + 1
+    return data[position : end + 1]
+
+
+class ApngWriter:
+    """
+    Write animated PNG, looping forever. Frames are blended over the previous ones.
+    """
+
+    def __init__(self, fp: t.BinaryIO, width: int, height: int, palette: bytes):
+        self.fp = fp
+        self.sequence = 0
+        self.frames = 0
+        fp.write(b"\x89PNG\r\n\x1a\n")
+        self.chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 3, 0, 0, 0))
+        self.chunk(b"PLTE", palette)
+        self.chunk(b"tRNS", b"\xff" * TRANSPARENT + b"\x00")
+        # The number of frames is filled in when closing.
+        self.actl = fp.tell()
+        self.chunk(b"acTL", struct.pack(">II", 0, 0))
+
+    def chunk(self, kind: bytes, data: bytes):
+        self.fp.write(struct.pack(">I", len(data)))
+        self.fp.write(kind + data)
+        self.fp.write(struct.pack(">I", zlib.crc32(kind + data)))
+
+    def write(self, frame: DeltaFrame):
+        numpy = import_numpy()
+        height, width = frame.indices.shape
+        # Blend over previous frame, except for the first one.
+        blend = 1 if self.frames else 0
+        self.chunk(
+            b"fcTL",
+            struct.pack(
+                ">IIIIIHHBB",
+                self.sequence,
+                width,
+                height,
+                frame.x,
+                frame.y,
+                frame.duration,
+                1000,
+                0,
+                blend,
+            ),
+        )
+        self.sequence += 1
+
+        # Scanlines using filter type `None`.
+        rows = numpy.zeros((height, width + 1), dtype=numpy.uint8)
+        rows[:, 1:] = frame.indices
+        data = zlib.compress(rows.tobytes())
+        if self.frames == 0:
+            self.chunk(b"IDAT", data)
+        else:
+            self.chunk(b"fdAT", struct.pack(">I", self.sequence) + data)
+            self.sequence += 1
+        self.frames += 1
+
+    def close(self):
+        self.chunk(b"IEND", b"")
+        self.fp.seek(self.actl)
+        self.chunk(b"acTL", struct.pack(">II", self.frames, 0))
+        self.fp.seek(0, os.SEEK_END)
+
+
+WRITERS: dict[str, t.Callable[..., t.Union[GifWriter, ApngWriter]]] = {
+    "gif": GifWriter,
+    "apng": ApngWriter,
+}
+
+
+class DeltaEncoder:
+    """
+    Encode frames into an animated GIF or APNG, see module documentation.
+
+    Frames are given as pairs of image and the number of steps it is
+    displayed for, lasting `1 / framerate` seconds each. When `width` is
+    given, frames are scaled to that width.
+    """
+
+    def __init__(
+        self,
+        target: str,
+        format: str = "gif",
+        width: t.Optional[int] = None,
+        framerate: float = 2,
+    ):
+        if format not in WRITERS:
+            raise ValueError(
+                f"Unknown format: {format}, use one of {', '.join(WRITERS)}"
+            )
+        self.target = target
+        self.format = format
+        self.width = width
+        self.framerate = framerate
+        self.palette: t.Optional[t.Any] = None
+        self.frames = 0
+
+    def load(self, source: ImageSource):
+        """
+        Load image, scaled to the configured width, as RGB image.
+        """
+        Image, _ = import_pillow()
+        if isinstance(source, str):
+            image = Image.open(source)
+        else:
+            image = Image.open(io.BytesIO(source))
+        image = image.convert("RGB")
+        if self.width and image.width != self.width:
+            height = max(round(image.height * self.width / image.width), 1)
+            image = image.resize((self.width, height), Image.Resampling.LANCZOS)
+        return image
+
+    def make_palette(self, sources: list[ImageSource]):
+        """
+        Compute palette of 255 colors from the given sample of frames.
+        """
+        Image, _ = import_pillow()
+        images = [self.load(source) for source in sources]
+        montage = Image.new(
+            "RGB",
+            (
+                max(image.width for image in images),
+                sum(image.height for image in images),
+            ),
+        )
+        offset = 0
+        for image in images:
+            montage.paste(image, (0, offset))
+            offset += image.height
+        quantized = montage.quantize(
+            colors=TRANSPARENT, method=Image.Quantize.MEDIANCUT
+        )
+        self.set_palette(bytes(quantized.getpalette()[: 3 * TRANSPARENT]))
+
+    def load_palette(self, path: str):
+        """
+        Use palette generated by FFmpeg's `palettegen` filter, which holds one
+        color per pixel, and reserves the last one for transparency.
+        """
+        numpy = import_numpy()
+        Image, _ = import_pillow()
+        colors = numpy.asarray(Image.open(path).convert("RGB")).reshape(-1, 3)
+        self.set_palette(colors[:TRANSPARENT].tobytes())
+
+    def set_palette(self, colors: bytes):
+        Image, _ = import_pillow()
+        self.palette = Image.new("P", (1, 1))
+        self.palette.putpalette(colors)
+
+    def quantize(self, source: ImageSource):
+        """
+        Map image to the palette, returning an array of palette indices.
+        """
+        numpy = import_numpy()
+        Image, _ = import_pillow()
+        image = self.load(source).quantize(
+            palette=self.palette, dither=Image.Dither.NONE
+        )
+        return numpy.asarray(image)
+
+    def encode(
+        self, steps: t.Sequence[tuple[ImageSource, int]], palette_stride: int = 10
+    ) -> str:
+        """
+        Encode frames, displaying each image for the given number of steps.
+        Unless a palette has been loaded, it is computed from every n-th frame.
+        """
+        numpy = import_numpy()
+        if not steps:
+            raise ValueError("Unable to encode animation without frames")
+        if self.palette is None:
+            self.make_palette(
+                [source for source, _ in steps[:: max(palette_stride, 1)]]
+            )
+        colors = bytes(self.palette.getpalette()[: 3 * TRANSPARENT]).ljust(768, b"\0")  # type: ignore[union-attr]
+
+        partfile = self.target + ".part"
+        with open(partfile, "wb") as fp:
+            writer = None
+            previous = None
+            pending: t.Optional[DeltaFrame] = None
+            # Milliseconds since start, to avoid accumulating rounding errors.
+            elapsed = 0.0
+            written = 0
+            for source, count in steps:
+                indices = self.quantize(source)
+                elapsed += count / self.framerate * 1000
+                if writer is None:
+                    height, width = indices.shape
+                    writer = WRITERS[self.format](fp, width, height, colors)
+                    frame = DeltaFrame(0, 0, indices, 0, transparent=False)
+                else:
+                    changed = indices != previous
+                    if not changed.any():
+                        # Extend duration of previous frame.
+                        continue
+                    rows = numpy.flatnonzero(changed.any(axis=1))
+                    columns = numpy.flatnonzero(changed.any(axis=0))
+                    top, bottom = rows[0], rows[-1] + 1
+                    left, right = columns[0], columns[-1] + 1
+                    region = indices[top:bottom, left:right].copy()
+                    region[~changed[top:bottom, left:right]] = TRANSPARENT
+                    frame = DeltaFrame(int(left), int(top), region, 0, transparent=True)
+
+                if pending is not None:
+                    duration = round(elapsed - count / self.framerate * 1000) - written
+                    writer.write(pending._replace(duration=duration))
+                    written += duration
+                    self.frames += 1
+                pending = frame
+                previous = indices
+
+            if writer is not None and pending is not None:
+                writer.write(pending._replace(duration=round(elapsed) - written))
+                self.frames += 1
+                writer.close()
+        os.replace(partfile, self.target)
+        logger.info(
+            f"Delta-encoded {self.frames} frames into {self.target} "
+            f"({os.path.getsize(self.target)} bytes)"
+        )
+        return self.target
@@ -0,0 +1,257 @@
+# (c) 2018-2021 Andreas Motl <andreas.motl@panodata.org>
+# License: GNU Affero General Public License, Version 3
+import dataclasses
+import logging
+import os
+import subprocess
+import tempfile
+import threading
+import time
+import typing as t
+from concurrent.futures import FIRST_EXCEPTION, ThreadPoolExecutor, wait
+
+logger = logging.getLogger(__name__)
+
+# Arguments making FFmpeg report its progress as `key=value` lines on stdout.
+PROGRESS_ARGUMENTS = ["-nostats", "-progress", "pipe:1"]
+
+
+class EncoderError(RuntimeError):
+    pass
+
+
+@dataclasses.dataclass
+class EncoderProgress:
+    """
+    Progress of an encoder job, as reported by FFmpeg's `-progress` option.
+
+    https://ffmpeg.org/ffmpeg.html#Advanced-options
+    """
+
+    frame: int = 0
+    fps: float = 0.0
+    time: float = 0.0
+    speed: float = 0.0
+    duration: t.Optional[float] = None
+    done: bool = False
+
+    def update(self, key: str, value: str):
+        try:
+            if key == "frame":
+                self.frame = int(value)
+            elif key == "fps":
+                self.fps = float(value)
+            elif key in ("out_time_us", "out_time_ms"):
+                # Both are in microseconds, for historical reasons.
+                self.time = int(value) / 1_000_000
+            elif key == "speed":
+                self.speed = float(value.rstrip("x"))
+            elif key == "progress":
+                self.done = value == "end"
+        except ValueError:
+            # Values are `N/A` until the first frame has been encoded.
+            pass
+
+    @property
+    def eta(self) -> t.Optional[float]:
+        """
+        Estimated seconds until completion, when the duration of the output is known.
+        """
+        if self.duration is None or self.speed <= 0:
+            return None
+        return max(self.duration - self.time, 0.0) / self.speed
+
+    def summary(self) -> str:
+        text = f"frame={self.frame}, fps={self.fps:.1f}, time={self.time:.1f}s"
+        eta = self.eta
+        if eta is not None:
+            text += f", eta={eta:.0f}s"
+        return text
+
+
+class EncoderJob:
+    """
+    Run an FFmpeg command as subprocess, using `threads` CPUs of the budget.
+
+    Progress reported on stdout is parsed into `progress`. FFmpeg is
+    chatty, so its stderr is written to a file instead of a pipe, which
+    would block the process when not being drained.
+    """
+
+    def __init__(
+        self,
+        command: list[str],
+        name: t.Optional[str] = None,
+        threads: int = 1,
+        duration: t.Optional[float] = None,
+        stdin: bool = False,
+    ):
+        self.command = command
+        self.name = name or command[-1]
+        self.threads = threads
+        self.stdin = stdin
+        self.progress = EncoderProgress(duration=duration)
+        self.process: t.Optional[subprocess.Popen] = None
+        self.stderr: t.Optional[t.IO[bytes]] = None
+        self.reader: t.Optional[threading.Thread] = None
+        self.started = 0.0
+        self.aborted = False
+
+    def start(self):
+        if self.aborted:
+            raise EncoderError(f"Encoder has been aborted: {self.name}")
+        logger.debug(" ".join(self.command))
+        self.stderr = tempfile.TemporaryFile()
+        self.process = subprocess.Popen(  # noqa: S603
+            self.command,
+            stdin=subprocess.PIPE if self.stdin else subprocess.DEVNULL,
+            stdout=subprocess.PIPE,
+            stderr=self.stderr,
+        )
+        self.started = time.monotonic()
+        self.reader = threading.Thread(
+            target=self.read_progress,
+            name=f"encoder-progress-{self.process.pid}",
+            daemon=True,
+        )
+        self.reader.start()
+        return self
+
+    def read_progress(self, interval: float = 5.0):
+        assert self.process is not None and self.process.stdout is not None  # noqa: S101
+        reported = time.monotonic()
+        for line in self.process.stdout:
+            key, _, value = line.decode(errors="replace").strip().partition("=")
+            self.progress.update(key, value)
+            if key == "progress" and time.monotonic() - reported >= interval:
+                reported = time.monotonic()
+                logger.info(f"Encoding {self.name}: {self.progress.summary()}")
+
+    def wait(self, timeout: t.Optional[float] = None):
+        """
+        Wait for the encoder to finish, raising `EncoderError` when it fails.
+        """
+        assert self.process is not None  # noqa: S101
+        try:
+            returncode = self.process.wait(timeout=timeout)
+        except subprocess.TimeoutExpired as ex:
+            self.abort()
+            raise EncoderError(
+                f"Encoder timed out after {timeout} seconds: {self.name}\n{self.error_output()}"
+            ) from ex
+        if self.reader is not None:
+            self.reader.join()
+        if returncode != 0:
+            raise EncoderError(
+                f"Encoder failed with exit code {returncode}: {self.name}\n{self.error_output()}"
+            )
+        logger.info(
+            f"Encoded {self.name} in {time.monotonic() - self.started:.1f}s: {self.progress.summary()}"
+        )
+
+    def abort(self):
+        self.aborted = True
+        if self.process is not None and self.process.poll() is None:
+            self.process.kill()
+            self.process.wait()
+
+    def error_output(self, lines: int = 20) -> str:
+        if self.stderr is None:
+            return ""
+        self.stderr.seek(0)
+        output = self.stderr.read().decode(errors="replace")
+        return "\n".join(output.splitlines()[-lines:])
+
+
+class EncoderJobManager:
+    """
+    Run encoder jobs within a budget of CPUs.
+
+    Each job holds as many CPUs of the budget as it uses threads, so
+    concurrent jobs keep all cores busy without oversubscribing them.
+    Jobs exceeding the budget wait for running jobs to finish.
+    """
+
+    def __init__(self, cpu_budget: t.Optional[int] = None):
+        self.cpu_budget = max(cpu_budget or os.cpu_count() or 1, 1)
+        self.available = self.cpu_budget
+        self.condition = threading.Condition()
+
+    def threads(self, jobs: int = 1) -> int:
+        """
+        Number of threads per job, when sharing the budget between `jobs` jobs.
+        """
+        return max(self.cpu_budget // max(jobs, 1), 1)
+
+    def acquire(self, threads: int) -> int:
+        threads = min(threads, self.cpu_budget)
+        with self.condition:
+            self.condition.wait_for(lambda: self.available >= threads)
+            self.available -= threads
+        return threads
+
+    def release(self, threads: int):
+        with self.condition:
+            self.available += threads
+            self.condition.notify_all()
+
+    def start(self, job: EncoderJob) -> EncoderJob:
+        """
+        Start job once enough CPUs are available. Release them using `finish`.
+        """
+        job.threads = self.acquire(job.threads)
+        try:
+            return job.start()
+        except BaseException:
+            self.release(job.threads)
+            raise
+
+    def finish(self, job: EncoderJob, timeout: t.Optional[float] = None):
+        try:
+            job.wait(timeout=timeout)
+        finally:
+            self.release(job.threads)
+
+    def run(self, job: EncoderJob, timeout: t.Optional[float] = None) -> EncoderJob:
+        self.start(job)
+        self.finish(job, timeout=timeout)
+        return job
+
+    def run_all(
+        self, jobs: list[EncoderJob], timeout: t.Optional[float] = None
+    ) -> list[EncoderJob]:
+        """
+        Run independent jobs concurrently. When one of them fails,
+        the others are aborted, and its error is raised.
+        """
+        # Each job uses at least one CPU, so more workers would only be waiting.
+        workers = max(min(len(jobs), self.cpu_budget), 1)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(self.run, job, timeout) for job in jobs]
+            done, pending = wait(futures, return_when=FIRST_EXCEPTION)
+            errors = [future.exception() for future in done if future.exception()]
+            if errors:
+                for future in pending:
+                    future.cancel()
+                for job in jobs:
+                    job.abort()
+                raise errors[0]  # type: ignore[misc]
+        return jobs
+
+
+_manager: t.Optional[EncoderJobManager] = None
+_manager_lock = threading.Lock()
+
+
+def get_job_manager(cpu_budget: t.Optional[int] = None) -> EncoderJobManager:
+    """
+    Process-wide job manager, sharing one CPU budget between all encoders.
+    Passing `cpu_budget` replaces the budget for subsequent jobs.
+    """
+    global _manager
+    with _manager_lock:
+        if _manager is None or (
+            cpu_budget is not None and cpu_budget != _manager.cpu_budget
+        ):
+            _manager = EncoderJobManager(cpu_budget=cpu_budget)
+        return _manager
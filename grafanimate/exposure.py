@@ -0,0 +1,130 @@
+# (c) 2018-2021 Andreas Motl <andreas.motl@panodata.org>
+# License: GNU Affero General Public License, Version 3
+import json
+import logging
+import math
+import os
+import tempfile
+import threading
+import typing as t
+from collections import deque
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+
+def default_stats_path() -> Path:
+    cache_home = os.environ.get("XDG_CACHE_HOME") or Path.home() / ".cache"
+    return Path(cache_home) / "grafanimate" / "exposure.json"
+
+
+def percentile(values: t.Iterable[float], rank: float) -> float:
+    """
+    Compute the percentile of the given values, using the nearest-rank method.
+    """
+    ordered = sorted(values)
+    if not ordered:
+        raise ValueError("Unable to compute percentile of empty sequence")
+    index = max(0, math.ceil(rank / 100.0 * len(ordered)) - 1)
+    return ordered[index]
+
+
+class AdaptiveExposure:
+    """
+    Learn how long frames of a dashboard/panel need to settle, and derive
+    a waiting budget from a percentile of the observed settle times.
+
+    Frames are captured as soon as their data has arrived. The budget
+    only bounds how long to wait for that, so it shrinks when frames
+    settle fast, and grows when they don't.
+
+    Statistics are persisted between runs, keyed by dashboard and panel.
+    """
+
+    def __init__(
+        self,
+        key: str,
+        initial: float = 0.5,
+        rank: float = 95.0,
+        headroom: float = 1.5,
+        minimum: float = 0.1,
+        maximum: float = 20.0,
+        window: int = 250,
+        path: t.Optional[Path] = None,
+    ):
+        self.key = key
+        self.initial = initial
+        self.rank = rank
+        self.headroom = headroom
+        self.minimum = minimum
+        self.maximum = maximum
+        self.window = window
+        self.path = path
+        self.stats: dict[str, list[float]] = {}
+        self.samples: deque[float] = deque(maxlen=window)
+        self.lock = threading.Lock()
+
+    @classmethod
+    def load(
+        cls, key: str, path: t.Optional[Path] = None, **kwargs
+    ) -> "AdaptiveExposure":
+        path = Path(path or default_stats_path())
+        exposure = cls(key=key, path=path, **kwargs)
+        exposure.stats = exposure.read_stats()
+        exposure.samples.extend(exposure.stats.get(key, []))
+        logger.info(f"Loaded {len(exposure.samples)} settle time samples for {key}")
+        return exposure
+
+    def budget(self) -> float:
+        """
+        How long to wait for the next frame to settle, in seconds.
+        """
+        with self.lock:
+            if not self.samples:
+                return self.initial
+            value = percentile(self.samples, self.rank) * self.headroom
+        return min(max(value, self.minimum), self.maximum)
+
+    def record(self, duration: float, settled: bool = True):
+        """
+        Record the settle time of a frame. When the frame did not settle
+        within its budget, the sample is scaled up, so the budget grows.
+        """
+        if not settled:
+            duration = min(duration * 2, self.maximum)
+        with self.lock:
+            self.samples.append(duration)
+
+    def read_stats(self) -> dict[str, list[float]]:
+        if self.path is None or not self.path.exists():
+            return {}
+        try:
+            return json.loads(self.path.read_text())
+        except ValueError:
+            logger.warning(
+                f"Unable to read exposure statistics from {self.path}, starting afresh"
+            )
+            return {}
+
+    def save(self):
+        """
+        Save statistics, retaining the ones of other dashboards saved meanwhile.
+        The file is replaced atomically, so concurrent runs never see a partial one.
+        """
+        if self.path is None:
+            return
+        with self.lock:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self.stats = self.read_stats()
+            self.stats[self.key] = list(self.samples)
+            fd, partfile = tempfile.mkstemp(
+                dir=self.path.parent, prefix=f".{self.path.name}.", suffix=".part"
+            )
+            try:
+                with os.fdopen(fd, "w") as f:
+                    f.write(json.dumps(self.stats, indent=2))
+                os.replace(partfile, self.path)
+            except BaseException:
+                os.unlink(partfile)
+                raise
+        logger.info(f"Saved settle time statistics to {self.path}")
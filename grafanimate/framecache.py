@@ -0,0 +1,128 @@
+# (c) 2018-2021 Andreas Motl <andreas.motl@panodata.org>
+# License: GNU Affero General Public License, Version 3
+import hashlib
+import logging
+import os
+import threading
+import typing as t
+from collections import OrderedDict
+from datetime import datetime, timezone
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+
+def default_cache_path() -> Path:
+    cache_home = os.environ.get("XDG_CACHE_HOME") or Path.home() / ".cache"
+    return Path(cache_home) / "grafanimate" / "frames"
+
+
+def palette_file(scope: str, path: t.Optional[Path] = None) -> Path:
+    """
+    Location of the cached GIF palette for the given fingerprint of dashboard
+    and appearance settings, next to the cached frames.
+    """
+    directory = Path(path or default_cache_path()) / "palettes"
+    directory.mkdir(parents=True, exist_ok=True)
+    return directory / f"{scope}.png"
+
+
+def frame_cache_key(scope: str, start: datetime, stop: datetime) -> str:
+    """
+    Compute cache key from the fingerprint of dashboard and capture settings,
+    and the time range of the frame.
+    """
+    digest = hashlib.sha256()
+    for part in [scope, start.isoformat(), stop.isoformat()]:
+        digest.update(part.encode())
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def is_historical(stop: datetime, now: t.Optional[datetime] = None) -> bool:
+    """
+    Whether the time range of a frame ended in the past, so its data will not change anymore.
+    """
+    if now is None:
+        now = datetime.now(tz=timezone.utc)
+    if stop.tzinfo is None:
+        now = now.astimezone(timezone.utc).replace(tzinfo=None)
+    return stop < now
+
+
+class FrameCache:
+    """
+    Size-bounded LRU cache for captured frames, content-addressed by dashboard,
+    capture settings, and time range, and persisted on disk, so it will be
+    shared across scenarios and invocations.
+    """
+
+    def __init__(
+        self,
+        path: t.Optional[Path] = None,
+        max_bytes: int = 1024 * 1024 * 1024,
+    ):
+        self.path = Path(path or default_cache_path())
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.entries: OrderedDict[str, int] = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.load()
+
+    def load(self):
+        """
+        Read inventory of cache directory, least recently used first.
+        """
+        self.path.mkdir(parents=True, exist_ok=True)
+        files = sorted(self.path.glob("*.frame"), key=lambda file: file.stat().st_mtime)
+        for file in files:
+            size = file.stat().st_size
+            self.entries[file.stem] = size
+            self.size += size
+        logger.info(
+            f"Frame cache at {self.path} holds {len(self.entries)} frames ({self.size} bytes)"
+        )
+
+    def file(self, key: str) -> Path:
+        return self.path / f"{key}.frame"
+
+    def get(self, key: str) -> t.Optional[bytes]:
+        with self.lock:
+            if key not in self.entries:
+                self.misses += 1
+                return None
+            file = self.file(key)
+            try:
+                image = file.read_bytes()
+            except OSError:
+                self.evict(key)
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            os.utime(file)
+            self.hits += 1
+        return image
+
+    def put(self, key: str, image: bytes):
+        if len(image) > self.max_bytes:
+            return
+        with self.lock:
+            if key in self.entries:
+                self.evict(key)
+            file = self.file(key)
+            partfile = file.with_suffix(".part")
+            partfile.write_bytes(image)
+            os.replace(partfile, file)
+            self.entries[key] = len(image)
+            self.size += len(image)
+            while self.size > self.max_bytes:
+                self.evict(next(iter(self.entries)))
+
+    def evict(self, key: str):
+        self.size -= self.entries.pop(key)
+        try:
+            self.file(key).unlink()
+        except FileNotFoundError:
+            pass
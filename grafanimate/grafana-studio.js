@@ -48,6 +48,140 @@ class GrafanaStudioSrv {
     );
   }
 
+  findQueryRunners() {
+    // Collect all Scenes query runners by walking the scene graph.
+    var runners = [];
+    var visit = function (sceneObject) {
+      if (typeof sceneObject.runQueries === "function") {
+        runners.push(sceneObject);
+      }
+      if (typeof sceneObject.forEachChild === "function") {
+        sceneObject.forEachChild(visit);
+      }
+    };
+    visit(__grafanaSceneContext);
+    return runners;
+  }
+
+  isQueryRunnerDone(runner) {
+    // Query runners of panels outside the viewport are not activated, and will not run.
+    if (!runner.isActive) {
+      return true;
+    }
+    var data = runner.state.data;
+    if (!data) {
+      return false;
+    }
+    return ["Done", "Error", "Streaming"].includes(data.state);
+  }
+
+  waitForData(timeout) {
+    // Return a promise which resolves to `true` when all query runners of the
+    // dashboard have reached a done state, or to `false` after `timeout` milliseconds.
+    var _this = this;
+    timeout = timeout || 20000;
+    return new Promise(function (resolve) {
+      var runners = _this.findQueryRunners();
+      var subscriptions = [];
+      var interval = null;
+      var timer = null;
+      var finished = false;
+
+      var isDone = function () {
+        if (runners.length === 0) {
+          return _this.hasAllData();
+        }
+        return runners.every(_this.isQueryRunnerDone);
+      };
+
+      var finish = function (value) {
+        if (finished) {
+          return;
+        }
+        finished = true;
+        clearTimeout(timer);
+        clearInterval(interval);
+        for (var subscription of subscriptions) {
+          subscription.unsubscribe();
+        }
+        resolve(value);
+      };
+
+      // Confirm the done state after two animation frames, to give
+      // freshly triggered queries a chance to enter the loading state,
+      // and panels a chance to paint.
+      var check = function () {
+        if (!finished && isDone()) {
+          requestAnimationFrame(function () {
+            requestAnimationFrame(function () {
+              if (isDone()) {
+                finish(true);
+              }
+            });
+          });
+        }
+      };
+
+      if (runners.length === 0) {
+        // No Scenes query runners found, fall back to in-browser polling.
+        interval = setInterval(check, 50);
+      } else {
+        for (var runner of runners) {
+          subscriptions.push(runner.subscribeToState(check));
+        }
+      }
+      timer = setTimeout(finish, timeout, false);
+      check();
+    });
+  }
+
+  findPanelElement(panelId) {
+    // Find the DOM element of a single panel, for element-scoped screenshots.
+    var selectors = [
+      '[data-viz-panel-key="panel-' + panelId + '"]',
+      '[data-panelid="' + panelId + '"]',
+      ".panel-solo",
+    ];
+    for (var selector of selectors) {
+      var element = document.querySelector(selector);
+      if (element) {
+        return element;
+      }
+    }
+    return null;
+  }
+
+  prepareFrame(from, to, options) {
+    // Fused per-frame command: Set the time range, wait for data, wait for the
+    // exposure time, and apply the chrome tweaks, all within a single round trip.
+    // Resolves to an object reporting whether all data arrived, and how long
+    // that took, in seconds.
+    options = options || {};
+    var _this = this;
+    if (options.message) {
+      console.log(options.message);
+    }
+    this.setTime(from, to);
+    var started = performance.now();
+    var waiting = options.wait
+      ? this.waitForData(options.timeout)
+      : Promise.resolve(true);
+    return waiting.then(function (ready) {
+      var waited = (performance.now() - started) / 1000;
+      return new Promise(function (resolve) {
+        setTimeout(
+          function () {
+            if (options.improveChrome) {
+              _this.improvePanelChrome();
+            }
+            resolve({ ready: ready, waited: waited });
+          },
+          (options.exposure || 0) * 1000,
+        );
+      });
+    });
+  }
+
   setTime(from, to) {
     __grafanaSceneContext.state.$timeRange.setState({ from: from, to: to });
     __grafanaSceneContext.state.$timeRange.onRefresh();
@@ -262,9 +396,26 @@ class GrafanaStudioSrv {
     return title;
   }
 
+  getDashboardVersion() {
+    // Saved version of the dashboard, changing on each modification.
+    var dashboard = __grafanaSceneContext._state;
+    if (dashboard.version != undefined) {
+      return dashboard.version;
+    }
+    if (dashboard.meta && dashboard.meta.version != undefined) {
+      return dashboard.meta.version;
+    }
+    return null;
+  }
+
   setKioskMode() {
     if (!document.querySelector('[title="Enable kiosk mode"]')) {
-      document.querySelector('[title="Toggle top search bar"]').click();
+      var toggle = document.querySelector('[title="Toggle top search bar"]');
+      if (!toggle) {
+        // Already in kiosk mode, e.g. when reusing a warm browser session.
+        return;
+      }
+      toggle.click();
     }
     document.querySelector('[title="Enable kiosk mode"]').click();
   }
@@ -6,8 +6,11 @@ import time
 import typing as t
 from importlib.resources import read_text
 
-from marionette_driver import Wait
-from marionette_driver.errors import TimeoutException
+from marionette_driver.errors import (
+    JavascriptException,
+    ScriptTimeoutException,
+    StaleElementException,
+)
 
 from grafanimate.marionette import FirefoxMarionetteBase
 from grafanimate.model import AnimationFrame
@@ -15,6 +18,9 @@ from grafanimate.timeutil import format_date_grafana
 
 log = logging.getLogger(__name__)
 
+# Cached outcome of looking up a panel element which does not exist.
+_PANEL_MISSING = object()
+
 
 class GrafanaWrapper(FirefoxMarionetteBase):
     """
@@ -28,20 +34,38 @@ class GrafanaWrapper(FirefoxMarionetteBase):
         window_size: t.Optional[tuple[int, int]] = None,
         zoom_factor: float = 1.0,
         dry_run: bool = False,
+        firefox_port: int = 2828,
+        capture_panel_id: t.Optional[str] = None,
+        capture_format: str = "png",
+        capture_quality: float = 0.92,
+        header_layout: t.Optional[list[str]] = None,
     ):
         self.baseurl = baseurl
         self.use_panel_events = use_panel_events
         self.window_size = window_size
         self.zoom_factor = zoom_factor
         self.dry_run = dry_run
+        self.data_timeout = 20.0
+        self.capture_panel_id = capture_panel_id
+        self.panel_element: t.Any = None
+        self.panel_rect = None
+        self.capture_format = capture_format
+        self.capture_quality = capture_quality
+        self.header_layout = header_layout or []
+        self.warm = False
         log.info("Starting GrafanaWrapper on %s", baseurl)
-        FirefoxMarionetteBase.__init__(self)
+        FirefoxMarionetteBase.__init__(self, firefox_port=firefox_port)
 
     def boot_grafana(self):
         """
         Navigate to Grafana application and inject Grafana Sidecar service.
         """
         log.info("Starting Grafana at %s", self.baseurl)
+        if self.firefox_already_started and self.attach_warm_window():
+            log.info("Reusing warm Grafana session at %s", self.baseurl)
+            self.warm = True
+            return
+
         if self.window_size:
             self.set_window_size(
                 int(self.window_size[0]),
@@ -71,6 +95,46 @@ class GrafanaWrapper(FirefoxMarionetteBase):
             javascript = read_text("grafanimate", jsfile)
             self.run_javascript(javascript)
 
+        # Tag the window, so it can be found again by `attach_warm_window`.
+        self.run_javascript(f"window.name = {json.dumps(self.warm_key)};", silent=True)
+
+    @property
+    def warm_key(self) -> str:
+        """
+        Tag of windows prepared for the Grafana URL. It includes the layout
+        options, because they are applied when preparing the window only.
+        """
+        layout = {
+            "window-size": self.window_size,
+            "zoom-factor": self.zoom_factor,
+            "header-layout": self.header_layout,
+        }
+        return f"grafanimate:{self.baseurl}:{json.dumps(layout, sort_keys=True)}"
+
+    def attach_warm_window(self) -> bool:
+        """
+        Find a window of an already running Firefox, which has been prepared
+        for the same Grafana URL and layout, for example by `grafanimate serve-browser`.
+        """
+        javascript = (
+            f"return window.name === {json.dumps(self.warm_key)}"
+            " && typeof window.grafanaStudio !== 'undefined';"
+        )
+        if self.marionette is None:
+            return False
+        for handle in self.marionette.window_handles:
+            self.marionette.switch_to_window(handle, focus=True)
+            if self.run_javascript(javascript, silent=True):
+                return True
+        return False
+
+    def open_tab(self):
+        """
+        Open a new browser tab, and switch to it.
+        """
+        handle = self.marionette.open(type="tab", focus=True)["handle"]
+        self.marionette.switch_to_window(handle, focus=True)
+
     def wait_for_grafana(self):
         """
         Wait for element <grafana-app> to appear.
@@ -103,21 +167,86 @@ class GrafanaWrapper(FirefoxMarionetteBase):
         if self.use_panel_events:
             return self.wait_all_data_received()
 
-    def wait_all_data_received(self):
+    def wait_all_data_received(self, timeout: t.Optional[float] = None) -> bool:
         """
         Wait for all data to arrive in the dashboard.
-        """
 
-        log.info('Waiting for "all-data-received" event')
-        waiter = Wait(self.marionette, timeout=20.0, interval=0.1)
+        Instead of polling from Python, this uses a single asynchronous
+        script invocation, which resolves as soon as all query runners
+        of the dashboard have finished.
 
-        def condition(marionette):  # noqa: ARG001
-            return self.calljs("grafanaStudio.hasAllData", silent=True)
+        Returns whether all data arrived within `timeout` seconds.
+        """
 
+        timeout = timeout or self.data_timeout
+        log.info('Waiting for "all-data-received" event')
         try:
-            waiter.until(condition)
-        except TimeoutException as ex:
+            ready = self.calljs_async(
+                "grafanaStudio.waitForData",
+                int(timeout * 1000),
+                timeout=timeout + 5.0,
+            )
+        except ScriptTimeoutException as ex:
             log.warning("Timed out waiting for data: %s. Continuing anyway.", ex)
+            return False
+        except JavascriptException as ex:
+            log.warning("Failed waiting for data: %s. Continuing anyway.", ex)
+            return False
+        if not ready:
+            log.warning("Timed out waiting for data. Continuing anyway.")
+        return bool(ready)
+
+    def get_panel_element(self):
+        """
+        Resolve the DOM element of the panel to capture, and cache it across frames.
+        """
+        if self.panel_element is None:
+            self.panel_element = self.calljs(
+                "grafanaStudio.findPanelElement", self.capture_panel_id
+            )
+            if self.panel_element is None:
+                log.warning(
+                    "Unable to find element of panel %s, capturing the whole viewport",
+                    self.capture_panel_id,
+                )
+                # Don't look it up again for each frame.
+                self.panel_element = _PANEL_MISSING
+        if self.panel_element is _PANEL_MISSING:
+            return None
+        return self.panel_element
+
+    def get_panel_rect(self):
+        """
+        Resolve the region of the panel to capture, and cache it across frames.
+        """
+        if self.panel_rect is None:
+            element = self.get_panel_element()
+            if element is not None:
+                rect = element.rect
+                self.panel_rect = [rect["x"], rect["y"], rect["width"], rect["height"]]
+        return self.panel_rect
+
+    def render_image(self, element=None):
+        """
+        Return screenshot from element. When capturing a single panel,
+        and no element is given, only the panel element will be captured.
+
+        Using other image formats than PNG, the image will be drawn
+        and encoded within the browser, see `render_canvas`.
+        """
+        if self.capture_format != "png":
+            rect = self.get_panel_rect() if self.capture_panel_id else None
+            return self.render_canvas(
+                self.capture_format, self.capture_quality, rect=rect
+            )
+        if element is not None or not self.capture_panel_id:
+            return super().render_image(element=element)
+        try:
+            return super().render_image(element=self.get_panel_element())
+        except StaleElementException:
+            log.info("Panel element went stale, resolving it again")
+            self.panel_element = None
+            return super().render_image(element=self.get_panel_element())
 
     def update_tags(self):
         return self.calljs("grafanaStudio.improvePanelChrome")
@@ -141,6 +270,47 @@ class GrafanaWrapper(FirefoxMarionetteBase):
             )
             self.wait_for_frame_finished()
 
+    def prepare_frame(
+        self,
+        frame: AnimationFrame,
+        wait: bool = False,
+        timeout: t.Optional[float] = None,
+        exposure: float = 0,
+        improve_chrome: bool = False,
+    ) -> dict:
+        """
+        Navigate the Dashboard to the designated point in time, optionally wait
+        for all data to arrive and for the exposure time, and apply the chrome
+        tweaks, all within a single round trip.
+
+        Returns a dictionary with `ready` and `waited` items, reporting whether
+        all data arrived, and how long that took.
+        """
+        message = f"Timewarp to {frame.timerange.start} -> {frame.timerange.stop}"
+        log.info(message)
+        timeout = timeout or self.data_timeout
+        try:
+            return self.calljs_async(
+                "grafanaStudio.prepareFrame",
+                format_date_grafana(frame.timerange.start, frame.timerange.recurrence),
+                format_date_grafana(frame.timerange.stop, frame.timerange.recurrence),
+                {
+                    "message": message,
+                    "wait": wait,
+                    "timeout": int(timeout * 1000),
+                    "exposure": exposure,
+                    "improveChrome": improve_chrome,
+                },
+                timeout=timeout + exposure + 5.0,
+                silent=True,
+            )
+        except ScriptTimeoutException as ex:
+            log.warning("Timed out preparing frame: %s. Continuing anyway.", ex)
+            return {"ready": False, "waited": timeout}
+        except JavascriptException as ex:
+            log.warning("Failed preparing frame: %s. Continuing anyway.", ex)
+            return {"ready": False, "waited": 0.0}
+
     def timerange_set(self, starttime, endtime):
         """
         Adjust Grafana time control. This is not synchronous.
@@ -176,12 +346,50 @@ class GrafanaWrapper(FirefoxMarionetteBase):
             new_sandbox=False,
         )
 
+    def run_javascript_async(self, sourcecode, timeout=None, silent=False):
+        """
+        Run the designated Javascript code, which may return a promise,
+        and wait for its outcome within a single round trip.
+
+        When the code throws, or the promise is rejected, the error is
+        reported right away, instead of waiting for the script timeout.
+
+        :code: Plain Javascript source code.
+        :timeout: Minimum script timeout in seconds, see `ensure_script_timeout`.
+        """
+        if timeout is not None:
+            self.ensure_script_timeout(timeout)
+        if not silent:
+            log.debug("Running asynchronous Javascript: %s", sourcecode)
+        wrapper = (
+            "const resolve = arguments[arguments.length - 1];"
+            f"new Promise(done => done((function() {{ {sourcecode} }})()))"
+            ".then(value => resolve({value: value}))"
+            ".catch(error => resolve({error: String(error)}));"
+        )
+        outcome = self.marionette.execute_async_script(
+            wrapper,
+            sandbox=None,
+            new_sandbox=False,
+        )
+        if "error" in outcome:
+            raise JavascriptException(outcome["error"])
+        return outcome.get("value")
+
     def calljs(self, name, *args, silent=False):
         return self.run_javascript(mkjscall(name, *args), silent=silent)
 
+    def calljs_async(self, name, *args, timeout=None, silent=False):
+        return self.run_javascript_async(
+            mkjscall(name, *args), timeout=timeout, silent=silent
+        )
+
     def get_dashboard_title(self):
         return self.calljs("grafanaStudio.getDashboardTitle")
 
+    def get_dashboard_version(self) -> t.Optional[int]:
+        return self.calljs("grafanaStudio.getDashboardVersion")
+
     def console_log(self, message):
         """
         Write a message to the Browser console (console.log).
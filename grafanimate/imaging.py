@@ -0,0 +1,100 @@
+# (c) 2018-2021 Andreas Motl <andreas.motl@panodata.org>
+# License: GNU Affero General Public License, Version 3
+import hashlib
+import io
+import typing as t
+
+Region = tuple[int, int, int, int]
+
+# Map image formats to file name extensions.
+IMAGE_EXTENSIONS = {
+    "png": "png",
+    "jpeg": "jpg",
+    "webp": "webp",
+}
+
+
+def image_digest(image: bytes, mask: t.Optional[Region] = None) -> str:
+    """
+    Compute digest of image. When `mask` is given as `(x, y, width, height)`,
+    pixels within that region are ignored.
+    """
+    if mask is None:
+        return hashlib.sha1(image).hexdigest()  # noqa: S324
+
+    Image, ImageDraw = import_pillow()
+    picture = Image.open(io.BytesIO(image)).convert("RGBA")
+    x, y, width, height = mask
+    ImageDraw.Draw(picture).rectangle(
+        (x, y, x + width - 1, y + height - 1), fill=(0, 0, 0, 0)
+    )
+    return hashlib.sha1(picture.tobytes()).hexdigest()  # noqa: S324
+
+
+def read_region(value: t.Optional[str]) -> t.Optional[Region]:
+    """
+    Read region from string like `x,y,width,height`.
+    """
+    if not value:
+        return None
+    try:
+        x, y, width, height = (int(item.strip()) for item in value.split(","))
+    except ValueError as ex:
+        raise ValueError(f"Region must be given as x,y,width,height: {value}") from ex
+    return x, y, width, height
+
+
+def import_pillow():
+    try:
+        from PIL import Image, ImageDraw
+    except ImportError as ex:
+        raise ImportError(
+            "This feature requires Pillow, please install it using `pip install 'grafanimate[imaging]'`"
+        ) from ex
+    return Image, ImageDraw
+
+
+def import_numpy():
+    try:
+        import numpy
+    except ImportError as ex:
+        raise ImportError(
+            "This feature requires NumPy, please install it using `pip install 'grafanimate[imaging]'`"
+        ) from ex
+    return numpy
+
+
+def optimize_png(image: bytes, palette: bool = True) -> bytes:
+    """
+    Losslessly recompress PNG image. When it uses 256 colors or less, and
+    `palette` is true, convert it to a palette image. Returns the original
+    image when nothing could be saved.
+    """
+    Image, _ = import_pillow()
+    picture = Image.open(io.BytesIO(image))
+    picture.load()
+
+    # Drop alpha channel when fully opaque.
+    if picture.mode == "RGBA" and picture.getextrema()[3] == (255, 255):
+        picture = picture.convert("RGB")
+
+    candidate = picture
+    if palette and picture.mode in ["RGB", "RGBA"]:
+        colors = picture.getcolors(maxcolors=256)
+        if colors is not None:
+            quantized = picture.quantize(
+                colors=len(colors),
+                method=Image.Quantize.FASTOCTREE
+                if picture.mode == "RGBA"
+                else Image.Quantize.MEDIANCUT,
+            )
+            # Only use the palette image when it is exact.
+            if quantized.convert(picture.mode).tobytes() == picture.tobytes():
+                candidate = quantized
+
+    buffer = io.BytesIO()
+    candidate.save(buffer, format="PNG", optimize=True)
+    optimized = buffer.getvalue()
+    if len(optimized) < len(image):
+        return optimized
+    return image
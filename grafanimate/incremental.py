@@ -0,0 +1,95 @@
+# (c) 2018-2021 Andreas Motl <andreas.motl@panodata.org>
+# License: GNU Affero General Public License, Version 3
+import dataclasses
+import json
+import logging
+import os
+import typing as t
+from collections import deque
+from datetime import datetime
+
+from grafanimate.model import AnimationFrame, AnimationScenario
+
+logger = logging.getLogger(__name__)
+
+
+@dataclasses.dataclass
+class AppendState:
+    """
+    Bookkeeping for appending frames to a previously rendered video.
+
+    Records the end of the last frame encoded per sequence, next to the
+    video file. Frames ending later make up the tail to be captured and
+    appended by the next run, as long as the fingerprint of capture and
+    rendering settings is unchanged.
+
+    The tail is appended to the end of the video, so only scenarios with a
+    single sequence are supported. With multiple sequences, the new frames
+    of earlier sequences would end up after the frames of later ones.
+    """
+
+    path: str
+    fingerprint: str
+    sequences: dict[str, str] = dataclasses.field(default_factory=dict)
+
+    @staticmethod
+    def state_path(target: str) -> str:
+        return target + ".state.json"
+
+    @classmethod
+    def load(cls, target: str, fingerprint: str) -> t.Optional["AppendState"]:
+        """
+        Load state of previous run, if its video can be appended to.
+        """
+        path = cls.state_path(target)
+        if not os.path.exists(target) or not os.path.exists(path):
+            logger.info(f"No previous video at {target}, rendering all frames")
+            return None
+        with open(path) as f:
+            data = json.load(f)
+        if data.get("fingerprint") != fingerprint:
+            logger.warning(
+                f"Settings changed since {target} has been rendered, rendering all frames"
+            )
+            return None
+        return cls(path=path, fingerprint=fingerprint, sequences=data["sequences"])
+
+    @staticmethod
+    def check(scenario: AnimationScenario):
+        """
+        Reject scenarios whose new frames can not be appended in order.
+        """
+        if len(scenario.sequences) > 1:
+            raise ValueError(
+                f"Appending to videos of scenarios with multiple sequences is not supported, "
+                f"scenario has {len(scenario.sequences)} sequences"
+            )
+
+    @classmethod
+    def create(cls, target: str, fingerprint: str) -> "AppendState":
+        return cls(path=cls.state_path(target), fingerprint=fingerprint)
+
+    def is_covered(self, frame: AnimationFrame) -> bool:
+        """
+        Whether the frame has been encoded into the video already.
+        """
+        last = self.sequences.get(str(frame.sequence.index))
+        return last is not None and frame.timerange.stop <= datetime.fromisoformat(last)
+
+    def update(self, scenario: AnimationScenario):
+        """
+        Record the end of the last frame of each sequence.
+        """
+        for sequence in scenario.sequences:
+            # Only keep the last frame, without collecting all of them.
+            last = deque(sequence.get_frames(), maxlen=1)
+            if last:
+                self.sequences[str(sequence.index)] = last[0].timerange.stop.isoformat()
+
+    def save(self):
+        with open(self.path, "w") as f:
+            json.dump(
+                {"fingerprint": self.fingerprint, "sequences": self.sequences},
+                f,
+                indent=2,
+            )
@@ -1,6 +1,7 @@
 # (c) 2018-2021 Andreas Motl <andreas.motl@panodata.org>
 # License: GNU Affero General Public License, Version 3
 import atexit
+import base64
 import json
 import logging
 import os
@@ -15,6 +16,33 @@ from grafanimate.util import check_socket, find_program_candidate
 
 logger = logging.getLogger(__name__)
 
+# Draw the viewport, or a region of it, onto a canvas, and encode it.
+# Needs to run with system privileges, in order to use `drawWindow`.
+CANVAS_CAPTURE_SCRIPT = """
+const [mime, quality, rect] = arguments;
+const [x, y, width, height] = rect || [window.scrollX, window.scrollY, window.innerWidth, window.innerHeight];
+const ratio = window.devicePixelRatio;
+const canvas = document.createElementNS("http://www.w3.org/1999/xhtml", "canvas");
+canvas.width = Math.round(width * ratio);
+canvas.height = Math.round(height * ratio);
+const context = canvas.getContext("2d");
+context.scale(ratio, ratio);
+context.drawWindow(window, x, y, width, height, "rgb(255,255,255)");
+return canvas.toDataURL(mime, quality).split(",", 2)[1];
+"""
+
+
+class CountingMarionette(Marionette):
+    """
+    Marionette client which counts its round trips to the Marionette server.
+    """
+
+    rpc_count = 0
+
+    def _send_message(self, name, params=None, key=None):
+        self.rpc_count += 1
+        return super()._send_message(name, params=params, key=key)
+
 
 class FirefoxMarionetteBase:
     """
@@ -25,13 +53,13 @@ class FirefoxMarionetteBase:
     - https://marionette-client.readthedocs.io/en/master/interactive.html
     """
 
-    def __init__(self):
+    def __init__(self, firefox_port: int = 2828):
         logger.info("Starting Marionette Gecko wrapper")
 
         # Configuration
         self.firefox_bin = self.find_firefox()
         self.firefox_host = "localhost"
-        self.firefox_port = 2828
+        self.firefox_port = firefox_port
         # TODO: Make configurable
         self.firefox_verbosity = 1
         # self.firefox_verbosity = 2
@@ -79,7 +107,7 @@ class FirefoxMarionetteBase:
             logger.info("Will launch new Marionette/Firefox instance")
 
         # Connect to / start Marionette Gecko engine
-        self.marionette = Marionette(
+        self.marionette = CountingMarionette(
             host=self.firefox_host,
             port=self.firefox_port,
             bin=self.firefox_bin,
@@ -87,7 +115,7 @@ class FirefoxMarionetteBase:
             startup_timeout=self.startup_timeout,
             headless=self.firefox_run_headless,
             verbose=self.firefox_verbosity,
-            app_args=["--remote-allow-system-access"]
+            app_args=["--remote-allow-system-access"],
         )
 
         self.marionette.DEFAULT_SHUTDOWN_TIMEOUT = self.shutdown_timeout
@@ -132,6 +160,13 @@ class FirefoxMarionetteBase:
     def log_status(self):
         logger.info(f"Marionette report: {json.dumps(self.get_status(), indent=4)}")
 
+    @property
+    def rpc_count(self) -> int:
+        """
+        Number of round trips to the Marionette server so far.
+        """
+        return getattr(self.marionette, "rpc_count", 0)
+
     def has_active_session(self):
         is_initialized = (
             self.marionette is not None and self.marionette.session_id is not None
@@ -192,6 +227,20 @@ class FirefoxMarionetteBase:
         element = waiter.until(lambda _: self.find_class(classname))
         return element
 
+    def ensure_script_timeout(self, timeout: float):
+        """
+        Raise the session's script timeout to at least `timeout` seconds.
+
+        Passing a timeout per script call makes Marionette get, set, and
+        restore the session's timeout around each call, costing three
+        additional round trips. So the timeout is only raised when needed,
+        and kept for subsequent calls.
+        """
+        assert self.marionette is not None  # noqa: S101
+        if timeout > self.script_timeout:
+            self.script_timeout = timeout
+            self.marionette.timeout.script = timeout
+
     def render_image(self, element=None):
         """
         Return screenshot from element.
@@ -199,6 +248,21 @@ class FirefoxMarionetteBase:
         image = self.marionette.screenshot(element=element, format="binary", full=False)
         return image
 
+    def render_canvas(self, format="webp", quality=0.92, rect=None):
+        """
+        Return image of viewport, or of the given `(x, y, width, height)` region,
+        drawn onto a canvas within the browser, and encoded using the designated
+        image format. With lossy formats, this is considerably cheaper than
+        Marionette's PNG screenshots, both for encoding, and for transfer.
+        """
+        data = self.marionette.execute_script(
+            CANVAS_CAPTURE_SCRIPT,
+            script_args=(f"image/{format}", quality, rect),
+            sandbox="system",
+            new_sandbox=False,
+        )
+        return base64.b64decode(data)
+
     def set_window_size(self, width, height):
         self.marionette.set_window_rect(width=width, height=height)
 
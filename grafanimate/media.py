@@ -1,16 +1,49 @@
 import os.path
+import typing as t
 
 from grafanimate.model import AnimationScenario, RenderingOptions
 from grafanimate.postprocessing import MediaProducer
 from grafanimate.util import ensure_directory, slug
 
+if t.TYPE_CHECKING:
+    from grafanimate.spool import SpooledFrame
+
 
 def produce_artifacts(
     input,
     output,
     scenario: AnimationScenario,
     options: RenderingOptions,
+    timeline: t.Optional[list["SpooledFrame"]] = None,
+    extension: str = "png",
+    append: bool = False,
+    streamed: bool = False,
+    frames: t.Optional[t.Iterable[bytes]] = None,
+    palette: t.Optional[str] = None,
 ):
+    # Compute input pattern and output file name.
+    if input is not None:
+        input = os.path.join(str(input), f"*.{extension}")
+    output = output_filename(output, scenario)
+
+    # Produce output artifacts.
+    ensure_directory(output)
+    producer = MediaProducer(options=options)
+    return producer.render(
+        source=input,
+        target=output,
+        timeline=timeline,
+        append=append,
+        streamed=streamed,
+        frames=frames,
+        palette=palette,
+    )
+
+
+def output_filename(output, scenario: AnimationScenario) -> str:
+    """
+    Compute output file name from template.
+    """
     # TODO: Can use dashboard title as output filename here?
     # TODO: Can put `start` into filename?
 
@@ -20,15 +53,8 @@ def produce_artifacts(
     else:
         scenario_slug = None
 
-    # Compute input pattern and output file name.
-    input = os.path.join(str(input), "*.png")
-    output = str(output).format(
+    return str(output).format(
         scenario=scenario_slug,
         title=title_slug,
         uid=scenario.dashboard_uid,
     )
-
-    # Produce output artifacts.
-    ensure_directory(output)
-    producer = MediaProducer(options=options)
-    return producer.render(source=input, target=output)
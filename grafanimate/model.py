@@ -5,7 +5,7 @@ import logging
 from collections.abc import Generator
 from datetime import datetime, timezone
 from enum import Enum
-from typing import Optional, Union
+from typing import Any, Optional, Union
 
 from dateutil.rrule import rrule
 
@@ -121,6 +121,63 @@ class AnimationSequence:
             yield item
 
 
+class FrameRecord:
+    """
+    A captured frame, handed over from capturing to storage and encoding.
+
+    The image is held as a `memoryview`, so it is passed along without
+    copying. Skipped frames have been captured by a previous run, and
+    don't carry an image.
+    """
+
+    __slots__ = ("dashboard", "format", "frame", "grafana", "image", "skipped")
+
+    def __init__(
+        self,
+        frame: AnimationFrame,
+        image: Optional[Union[bytes, memoryview]] = None,
+        format: str = "png",
+        dashboard: Optional[str] = None,
+        grafana: Any = None,
+        skipped: bool = False,
+    ):
+        self.frame = frame
+        self.image: Optional[memoryview] = None
+        self.set_image(image)
+        self.format = format
+        self.dashboard = dashboard
+        self.grafana = grafana
+        self.skipped = skipped
+
+    def set_image(self, image: Optional[Union[bytes, memoryview]]):
+        if image is not None and not isinstance(image, memoryview):
+            image = memoryview(image)
+        self.image = image
+
+    @property
+    def start(self) -> datetime:
+        return self.frame.timerange.start
+
+    @property
+    def stop(self) -> datetime:
+        return self.frame.timerange.stop
+
+    @property
+    def sequence_index(self) -> int:
+        return self.frame.sequence.index or 0
+
+    @property
+    def size(self) -> int:
+        return self.image.nbytes if self.image is not None else 0
+
+    def __repr__(self):
+        return (
+            f"FrameRecord(dashboard={self.dashboard!r}, sequence={self.sequence_index}, "
+            f"start={self.start.isoformat()}, stop={self.stop.isoformat()}, "
+            f"format={self.format!r}, size={self.size}, skipped={self.skipped})"
+        )
+
+
 @dataclasses.dataclass
 class AnimationScenario:
     sequences: list[AnimationSequence]
@@ -130,9 +187,131 @@ class AnimationScenario:
     source: Optional[str] = None
 
 
+@dataclasses.dataclass
+class Rendition:
+    """
+    Additional output, either a video scaled to the given height,
+    or a GIF scaled to the given width.
+    """
+
+    format: str
+    size: int
+
+    @classmethod
+    def parse(cls, spec: str) -> "Rendition":
+        """
+        Parse rendition from specification like `720p` for a video,
+        or `320px` for a GIF.
+        """
+        spec = spec.strip().lower()
+        try:
+            if spec.endswith("px"):
+                return cls(format="gif", size=int(spec[:-2]))
+            if spec.endswith("p"):
+                return cls(format="mp4", size=int(spec[:-1]))
+        except ValueError:
+            pass
+        raise ValueError(
+            f"Invalid rendition: {spec}, use e.g. `720p` for videos, or `320px` for GIFs"
+        )
+
+    @property
+    def label(self) -> str:
+        return f"{self.size}px" if self.format == "gif" else f"{self.size}p"
+
+    def filename(self, target: str, video_extension: Optional[str] = None) -> str:
+        """
+        Compute file name of rendition, next to the main video. Videos use
+        the container of the encoder profile, given by `video_extension`.
+        """
+        stem = target.rsplit(".", 1)[0]
+        extension = self.format
+        if self.format != "gif" and video_extension:
+            extension = video_extension
+        return f"{stem}.{self.label}.{extension}"
+
+
+@dataclasses.dataclass
+class EncoderProfile:
+    """
+    Codec settings for encoding videos, trading encoding speed for size.
+    """
+
+    name: str
+    codec: str = "libx264"
+    preset: Optional[str] = None
+    crf: Optional[int] = None
+    threads: Optional[int] = None
+    extension: str = "mp4"
+    options: list[str] = dataclasses.field(default_factory=list)
+
+    def arguments(self) -> list[str]:
+        arguments = ["-c:v", self.codec]
+        if self.preset is not None:
+            arguments += ["-preset", self.preset]
+        if self.crf is not None:
+            arguments += ["-crf", str(self.crf)]
+        return arguments + self.options
+
+
+ENCODER_PROFILES = {
+    profile.name: profile
+    for profile in [
+        # FFmpeg's defaults for H.264.
+        EncoderProfile(name="default"),
+        EncoderProfile(name="fast-preview", preset="ultrafast", crf=28),
+        # H.265 within MP4, tagged for playback on Apple devices.
+        EncoderProfile(
+            name="archive",
+            codec="libx265",
+            preset="slow",
+            crf=20,
+            options=["-tag:v", "hvc1"],
+        ),
+        # VP9 within WebM, using constant quality mode.
+        EncoderProfile(
+            name="web-small",
+            codec="libvpx-vp9",
+            crf=40,
+            extension="webm",
+            options=[
+                "-b:v",
+                "0",
+                "-deadline",
+                "good",
+                "-cpu-used",
+                "4",
+                "-row-mt",
+                "1",
+            ],
+        ),
+        EncoderProfile(
+            name="av1",
+            codec="libaom-av1",
+            crf=34,
+            options=["-b:v", "0", "-cpu-used", "6", "-row-mt", "1"],
+        ),
+    ]
+}
+
+# Encoders producing GIFs: FFmpeg's `paletteuse` filter, or `grafanimate.delta`.
+GIF_ENCODERS = ["ffmpeg", "delta"]
+
+
 @dataclasses.dataclass
 class RenderingOptions:
     video_framerate: int = 2
     video_fps: int = 25
     gif_fps: int = 10
     gif_width: int = 480
+    palette_stride: int = 10
+    gif_encoder: str = "ffmpeg"
+    apng: bool = False
+    renditions: list[Rendition] = dataclasses.field(default_factory=list)
+    profile: EncoderProfile = dataclasses.field(
+        default_factory=lambda: ENCODER_PROFILES["default"]
+    )
+    chunk_seconds: Optional[int] = None
+    hls_seconds: int = 2
+    encoder_threads: Optional[int] = None
+    encoder_timeout: Optional[float] = None
@@ -0,0 +1,76 @@
+# (c) 2018-2021 Andreas Motl <andreas.motl@panodata.org>
+# License: GNU Affero General Public License, Version 3
+import logging
+import os
+import typing as t
+from concurrent.futures import Future, ProcessPoolExecutor
+
+from grafanimate.imaging import import_pillow, optimize_png
+from grafanimate.model import FrameRecord
+
+logger = logging.getLogger(__name__)
+
+
+class PngOptimizer:
+    """
+    Losslessly recompress captured PNG frames within a pool of processes.
+
+    Consists of two pipeline stages. `submit` hands over a frame to the
+    pool, and `collect` waits for the outcome, so frames keep their order,
+    while multiple frames are optimized in parallel, overlapping with
+    capturing the next ones.
+    """
+
+    def __init__(self, workers: t.Optional[int] = None, palette: bool = True):
+        # Fail early when Pillow is not installed.
+        import_pillow()
+        self.workers = workers or os.cpu_count() or 1
+        self.palette = palette
+        self.executor: t.Optional[ProcessPoolExecutor] = None
+        self.frames = 0
+        self.bytes_before = 0
+        self.bytes_after = 0
+
+    def start(self):
+        self.executor = ProcessPoolExecutor(max_workers=self.workers)
+        return self
+
+    def stop(self):
+        if self.executor is not None:
+            self.executor.shutdown(cancel_futures=True)
+            self.executor = None
+
+    @property
+    def stages(self):
+        return [self.submit, self.collect]
+
+    def submit(self, item: FrameRecord) -> tuple[FrameRecord, t.Optional[Future]]:
+        if item.image is None or item.format != "png":
+            return item, None
+        assert self.executor is not None  # noqa: S101
+        return item, self.executor.submit(
+            optimize_png, item.image.tobytes(), palette=self.palette
+        )
+
+    def collect(self, task: tuple[FrameRecord, t.Optional[Future]]) -> FrameRecord:
+        item, future = task
+        if future is None:
+            return item
+        optimized = future.result()
+        before, after = item.size, len(optimized)
+        self.frames += 1
+        self.bytes_before += before
+        self.bytes_after += after
+        logger.info(
+            f"Optimized frame {item.start}: {before} -> {after} bytes, saved {before - after} bytes"
+        )
+        item.set_image(optimized)
+        return item
+
+    def summary(self) -> str:
+        saved = self.bytes_before - self.bytes_after
+        ratio = saved / self.bytes_before * 100 if self.bytes_before else 0.0
+        return (
+            f"optimized {self.frames} frames, saved {saved} of {self.bytes_before} bytes "
+            f"({ratio:.1f}%)"
+        )
@@ -0,0 +1,106 @@
+# (c) 2018-2021 Andreas Motl <andreas.motl@panodata.org>
+# License: GNU Affero General Public License, Version 3
+import logging
+import queue
+import threading
+import typing as t
+
+logger = logging.getLogger(__name__)
+
+Stage = t.Callable[[t.Any], t.Any]
+
+# Marker object for signalling the end of the stream of items.
+_SENTINEL = object()
+
+
+class FramePipeline:
+    """
+    Process captured frames through a chain of stages, each running
+    in its own background thread.
+
+    Stages are connected through bounded queues. When a stage falls
+    behind, `submit` blocks, so memory usage stays flat, while the
+    browser can already work on the next frame.
+
+    Each stage is a callable receiving an item, and returning the item
+    to be handed over to the next stage. The return values of the last
+    stage are collected into `results`, unless `collect` is false. When
+    frames are only passed along, collecting them would keep all images
+    in memory until the pipeline is discarded.
+    """
+
+    def __init__(self, stages: list[Stage], maxsize: int = 4, collect: bool = True):
+        self.stages = stages
+        self.maxsize = maxsize
+        self.collect = collect
+        self.queues: list[queue.Queue] = [queue.Queue(maxsize=maxsize) for _ in stages]
+        self.threads: list[threading.Thread] = []
+        self.results: list[t.Any] = []
+        self.error: t.Optional[BaseException] = None
+
+    def start(self):
+        for number, stage in enumerate(self.stages):
+            thread = threading.Thread(
+                target=self.worker,
+                args=(number, stage),
+                name=f"pipeline-stage-{number}",
+                daemon=True,
+            )
+            thread.start()
+            self.threads.append(thread)
+        return self
+
+    def worker(self, number: int, stage: Stage):
+        inbox = self.queues[number]
+        outbox = self.queues[number + 1] if number + 1 < len(self.queues) else None
+        while True:
+            item = inbox.get()
+            if item is _SENTINEL:
+                if outbox is not None:
+                    outbox.put(_SENTINEL)
+                return
+
+            # After an error, just drain the queue, so producers don't block.
+            if self.error is not None:
+                continue
+
+            try:
+                result = stage(item)
+            except Exception as ex:
+                logger.exception(f"Pipeline stage {number} failed")
+                self.error = ex
+                continue
+
+            if outbox is not None:
+                outbox.put(result)
+            elif self.collect:
+                self.results.append(result)
+
+    def submit(self, item):
+        """
+        Hand over an item to the first stage. Blocks when the pipeline is full.
+        """
+        if self.error is not None:
+            raise self.error
+        self.queues[0].put(item)
+
+    def close(self):
+        """
+        Wait for all items to pass through the pipeline, and propagate errors.
+        """
+        self.queues[0].put(_SENTINEL)
+        for thread in self.threads:
+            thread.join()
+        if self.error is not None:
+            raise self.error
+        return self.results
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            # Don't mask the original exception.
+            self.queues[0].put(_SENTINEL)
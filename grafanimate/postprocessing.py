@@ -1,35 +1,640 @@
 # (c) 2018-2021 Andreas Motl <andreas@hiveeyes.org>
 # License: GNU Affero General Public License, Version 3
+import dataclasses
+import glob
 import logging
 import os
+import shutil
+import tempfile
+import typing as t
 
-from grafanimate.model import RenderingOptions
+from grafanimate.delta import DeltaEncoder, ImageSource
+from grafanimate.encoder import (
+    PROGRESS_ARGUMENTS,
+    EncoderError,
+    EncoderJob,
+    EncoderJobManager,
+    get_job_manager,
+)
+from grafanimate.model import ENCODER_PROFILES, FrameRecord, RenderingOptions
+
+if t.TYPE_CHECKING:
+    from grafanimate.spool import SpooledFrame
 
 logger = logging.getLogger(__name__)
 
 
 class MediaProducer:
-    def __init__(self, options: RenderingOptions):
+    def __init__(
+        self,
+        options: RenderingOptions,
+        manager: t.Optional[EncoderJobManager] = None,
+        palette: t.Optional[str] = None,
+    ):
         self.options = options
+        self.manager = manager or get_job_manager()
+        # Palette image for GIF outputs. Without it, the palette is generated
+        # from all frames within the filter graph.
+        self.palette = palette
+
+    @property
+    def threads(self) -> int:
+        """
+        Number of threads per encoder, by default the whole CPU budget.
+        """
+        return (
+            self.options.encoder_threads
+            or self.options.profile.threads
+            or self.manager.threads()
+        )
+
+    def write_concat(self, timeline: list["SpooledFrame"], target: str) -> str:
+        """
+        Write input file for FFmpeg's concat demuxer, displaying each
+        image for as many steps as it has been captured.
+
+        https://ffmpeg.org/ffmpeg-formats.html#concat-1
+        """
+        return self.write_steps(
+            [(frame.file, frame.count) for frame in timeline], target
+        )
+
+    def write_steps(self, steps: list[tuple[str, int]], target: str) -> str:
+        """
+        Write input file for FFmpeg's concat demuxer from pairs of image file and step count.
+        """
+        lines = ["ffconcat version 1.0"]
+        for file, count in steps:
+            lines.append(f"file '{os.path.abspath(file)}'")
+            lines.append(f"duration {count / self.options.video_framerate}")
+        # The duration of the last entry is only respected when it is followed by another entry.
+        if steps:
+            lines.append(f"file '{os.path.abspath(steps[-1][0])}'")
+        with open(target, "w") as f:
+            f.write("\n".join(lines) + "\n")
+        return target
+
+    def video_filter(self, height: t.Optional[int] = None) -> str:
+        # Use the `pad` filter to avoid FFmpeg errors like 'height not divisible by 2'.
+        scale = f"scale=-2:{height}:flags=lanczos," if height else ""
+        return f"{scale}pad=ceil(iw/2)*2:ceil(ih/2)*2,fps={self.options.video_fps},format=yuv420p"
+
+    def video_arguments(self) -> list[str]:
+        """
+        Encoder options of the video. When encoding in chunks, keyframes are
+        placed at fixed intervals of one second, so each chunk starts with a
+        keyframe, and chunks can be joined without re-encoding them.
+        """
+        arguments = self.options.profile.arguments()
+        if not self.options.chunk_seconds:
+            return arguments
+        gop = str(self.options.video_fps)
+        return [
+            *arguments,
+            "-g",
+            gop,
+            "-keyint_min",
+            gop,
+            "-sc_threshold",
+            "0",
+            "-flags",
+            "+cgop",
+        ]
 
-    def to_video(self, source, target):
+    def gif_filter(self, width: int, label: str = "gif") -> str:
+        """
+        Scale frames, and convert them into a GIF. When no palette file is
+        given, the palette is generated from the same frames, within the
+        filter graph. See `to_gif`.
+        """
+        scale = f"fps={self.options.gif_fps},scale={width}:-1:flags=lanczos"
+        if self.palette:
+            return f"{scale}[{label}s];[{label}s][{label}p]paletteuse"
+        return (
+            f"{scale},split[{label}a][{label}b];[{label}a]palettegen[{label}p];"
+            f"[{label}b][{label}p]paletteuse"
+        )
+
+    def gif_output(self, path: str, width: int, label: str = "gif") -> "MediaOutput":
+        if self.options.gif_encoder == "delta":
+            return MediaOutput(path, "", encoder="delta", width=width)
+        return MediaOutput(
+            path,
+            self.gif_filter(width, label=label),
+            palette=f"{label}p" if self.palette else None,
+        )
+
+    def outputs(self, target: str) -> list["MediaOutput"]:
+        """
+        All outputs produced from the frames: the video, the GIF, the
+        APNG, and additional renditions configured in `RenderingOptions`.
+        """
+        stem = target.rsplit(".", 1)[0]
+        outputs = [
+            MediaOutput(target, self.video_filter(), self.video_arguments()),
+            self.gif_output(stem + ".gif", self.options.gif_width),
+        ]
+        if self.options.apng:
+            outputs.append(
+                MediaOutput(
+                    stem + ".apng", "", encoder="delta", width=self.options.gif_width
+                )
+            )
+        for rendition in self.options.renditions:
+            path = rendition.filename(
+                target, video_extension=self.options.profile.extension
+            )
+            if any(output.path == path for output in outputs):
+                continue
+            if rendition.format == "gif":
+                output = self.gif_output(
+                    path, rendition.size, label=f"gif{rendition.size}"
+                )
+            else:
+                output = MediaOutput(
+                    path,
+                    self.video_filter(height=rendition.size),
+                    self.options.profile.arguments(),
+                )
+            outputs.append(output)
+        return outputs
+
+    def hls_output(self, target: str) -> "MediaOutput":
+        """
+        HTTP Live Streaming output: A playlist next to the video, referencing
+        segments of `hls_seconds` each, starting with a keyframe. FFmpeg
+        updates the playlist with each completed segment, so it can be
+        played, or served by a static web server, while frames are still
+        being captured.
+
+        HLS players support H.264 universally, so other codecs fall back to it.
+
+        https://ffmpeg.org/ffmpeg-formats.html#hls-2
+        """
+        stem = target.rsplit(".", 1)[0]
+        profile = self.options.profile
+        if profile.codec != "libx264":
+            profile = ENCODER_PROFILES["default"]
+        gop = str(self.options.hls_seconds * self.options.video_fps)
+        return MediaOutput(
+            stem + ".m3u8",
+            self.video_filter(),
+            [
+                *profile.arguments(),
+                "-g",
+                gop,
+                "-keyint_min",
+                gop,
+                "-sc_threshold",
+                "0",
+                "-f",
+                "hls",
+                "-hls_time",
+                str(self.options.hls_seconds),
+                "-hls_playlist_type",
+                "event",
+                # Write segments to temporary files, so clients never see partial ones.
+                "-hls_flags",
+                "independent_segments+temp_file",
+                "-hls_segment_filename",
+                stem + "-%05d.ts",
+            ],
+        )
+
+    @staticmethod
+    def filter_graph(outputs: list["MediaOutput"]) -> str:
+        """
+        Compose filter graph, decoding the input once, and feeding it into
+        one branch per output, using the `split` filter.
+
+        https://ffmpeg.org/ffmpeg-filters.html#split_002c-asplit
+
+        A palette file, given as second input, is split up the same way,
+        to be used by all GIF outputs.
+        """
+        chains = []
+        palettes = [output.palette for output in outputs if output.palette]
+        if palettes:
+            labels = "".join(f"[{label}]" for label in palettes)
+            chains.append(f"[1:v]split={len(palettes)}{labels}")
+        if len(outputs) == 1:
+            chains.append(f"[0:v]{outputs[0].filter}[out0]")
+            return ";".join(chains)
+        branches = "".join(f"[in{number}]" for number in range(len(outputs)))
+        chains.append(f"[0:v]split={len(outputs)}{branches}")
+        for number, output in enumerate(outputs):
+            chains.append(f"[in{number}]{output.filter}[out{number}]")
+        return ";".join(chains)
+
+    def palette_arguments(self, outputs: list["MediaOutput"]) -> list[str]:
+        """
+        Input arguments for the palette file, when used by any of the outputs.
+        """
+        if self.palette and any(output.palette for output in outputs):
+            return ["-i", self.palette]
+        return []
+
+    def output_arguments(
+        self, outputs: list["MediaOutput"], threads: t.Optional[int] = None
+    ) -> list[str]:
+        arguments = ["-filter_complex", self.filter_graph(outputs)]
+        for number, output in enumerate(outputs):
+            arguments += ["-map", f"[out{number}]", *output.arguments]
+            if threads:
+                arguments += ["-threads", str(threads)]
+            arguments.append(output.path)
+        arguments.append("-y")
+        return arguments
+
+    def input_arguments(
+        self, source, timeline: t.Optional[list["SpooledFrame"]] = None
+    ) -> list[str]:
         """
         http://hamelot.io/visualization/using-ffmpeg-to-convert-a-set-of-images-into-a-video/
         https://stackoverflow.com/questions/24961127/how-to-create-a-video-from-images-with-ffmpeg
+        """
+        if timeline:
+            # Variable frame durations, after collapsing duplicate frames.
+            concat = self.write_concat(
+                timeline, os.path.join(os.path.dirname(source), "frames.ffconcat")
+            )
+            return ["-f", "concat", "-safe", "0", "-i", concat]
+        return [
+            "-framerate",
+            str(self.options.video_framerate),
+            "-pattern_type",
+            "glob",
+            "-i",
+            source,
+        ]
+
+    def duration(
+        self, source, timeline: t.Optional[list["SpooledFrame"]] = None
+    ) -> t.Optional[float]:
+        """
+        Duration of the video in seconds, for estimating the remaining encoding time.
+        """
+        if timeline:
+            count = sum(frame.count for frame in timeline)
+        elif source is not None:
+            count = len(glob.glob(source))
+        else:
+            return None
+        return count / self.options.video_framerate
+
+    def run_ffmpeg(
+        self, arguments: list[str], name: str, duration: t.Optional[float] = None
+    ) -> EncoderJob:
+        """
+        Run FFmpeg as a job within the CPU budget, raising `EncoderError` when it fails.
+        """
+        job = EncoderJob(
+            ["ffmpeg", *PROGRESS_ARGUMENTS, *arguments],
+            name=name,
+            threads=self.threads,
+            duration=duration,
+        )
+        return self.manager.run(job, timeout=self.options.encoder_timeout)
+
+    def encode(
+        self,
+        source,
+        outputs: list["MediaOutput"],
+        timeline: t.Optional[list["SpooledFrame"]] = None,
+        frames: t.Optional[t.Iterable[bytes]] = None,
+    ):
+        """
+        Encode frames into all outputs in a single pass. Frames are read
+        from files matching the `source` pattern, or following the `timeline`,
+        or piped into the encoder.
 
         https://stackoverflow.com/questions/38726370/ffmpeg-text-watermark-bottom-left/38728172#38728172
         https://superuser.com/questions/939357/ffmpeg-watermark-on-bottom-right-corner/939386#939386
         """
-        # command = "ffmpeg -framerate 4 -pattern_type glob -i '{}' -c:v libx264 -r 30 -pix_fmt yuv420p '{}' -y".format(source, target)
         # -vf "fps=25,format=yuv420p,drawtext=fontfile=OpenSans-Regular.ttf:text='Title of this Video':fontcolor=white:fontsize=24:x=(w-tw)/2:y=(h/PHI)+th
-        # command = "ffmpeg -framerate 4 -pattern_type glob -i '{}' -c:v libx264 -vf 'fps=25,format=yuv420p,drawtext=text=Produced with Grafana and grafanimate:fontsize=11:x=w-tw-30:y=h-th-10:fontcolor=lightgrey:fontfile=/Library/Fonts/Arial.ttf' '{}' -y".format(source, target)
+        logger.info(f"Rendering {', '.join(output.path for output in outputs)}")
+        if frames is None and self.options.chunk_seconds:
+            self.encode_chunked(source, outputs, timeline)
+            return
+        if frames is None:
+            self.run_ffmpeg(
+                [
+                    *self.input_arguments(source, timeline),
+                    *self.palette_arguments(outputs),
+                    *self.output_arguments(outputs, threads=self.threads),
+                ],
+                name=outputs[0].path,
+                duration=self.duration(source, timeline),
+            )
+            return
+        encoder = StreamingEncoder(
+            target=outputs[0].path,
+            options=self.options,
+            outputs=outputs,
+            manager=self.manager,
+            palette=self.palette,
+        ).start()
+        try:
+            for image in frames:
+                encoder.write_image(image)
+        except BaseException:
+            encoder.abort()
+            raise
+        encoder.close()
 
-        # TODO: Expose `-framerate` and `fps` values.
-        # use the `pad` option to avoid ffmpeg errors like 'height not divisible by 2'
-        command = f"ffmpeg -framerate {self.options.video_framerate} -pattern_type glob -i '{source}' -c:v libx264 -vf 'pad=ceil(iw/2)*2:ceil(ih/2)*2,fps={self.options.video_fps},format=yuv420p' '{target}' -y"
-        logger.info(f"Rendering video: {target}")
-        logger.debug(command)
-        os.system(command)  # noqa: S605
+    def transcode(self, source, outputs: list["MediaOutput"]):
+        """
+        Derive outputs from an existing video, decoding it once.
+        """
+        logger.info(f"Rendering {', '.join(output.path for output in outputs)}")
+        self.run_ffmpeg(
+            [
+                "-i",
+                source,
+                *self.palette_arguments(outputs),
+                *self.output_arguments(outputs, threads=self.threads),
+            ],
+            name=outputs[0].path,
+        )
+
+    def to_video(
+        self, source, target, timeline: t.Optional[list["SpooledFrame"]] = None
+    ):
+        self.encode(
+            source,
+            [MediaOutput(target, self.video_filter(), self.video_arguments())],
+            timeline,
+        )
+
+    def split_steps(
+        self, source, timeline: t.Optional[list["SpooledFrame"]] = None
+    ) -> list[list[tuple[str, int]]]:
+        """
+        Split frames into chunks spanning `chunk_seconds` each. Frames
+        displayed across the boundary of two chunks are split up, so all
+        chunks but the last one have the same duration.
+        """
+        if timeline:
+            steps = [(frame.file, frame.count) for frame in timeline]
+        else:
+            steps = [(file, 1) for file in sorted(glob.glob(source))]
+        size = (self.options.chunk_seconds or 1) * self.options.video_framerate
+        chunks: list[list[tuple[str, int]]] = [[]]
+        filled = 0
+        for file, count in steps:
+            remaining = count
+            while remaining > 0:
+                take = min(remaining, size - filled)
+                chunks[-1].append((file, take))
+                filled += take
+                remaining -= take
+                if filled == size:
+                    chunks.append([])
+                    filled = 0
+        if not chunks[-1]:
+            chunks.pop()
+        return chunks
+
+    def encode_chunked(
+        self,
+        source,
+        outputs: list["MediaOutput"],
+        timeline: t.Optional[list["SpooledFrame"]] = None,
+    ):
+        """
+        Encode the video in chunks aligned to its keyframe interval, using
+        parallel encoder jobs, and join them without re-encoding. The other
+        outputs span the whole video, they are encoded by another job,
+        running concurrently.
+        """
+        video, others = outputs[0], outputs[1:]
+        chunks = self.split_steps(source, timeline)
+        workdir = tempfile.mkdtemp(
+            prefix=".chunks-", dir=os.path.dirname(os.path.abspath(video.path))
+        )
+        jobs = len(chunks) + (1 if others else 0)
+        threads = self.options.encoder_threads or self.manager.threads(jobs=jobs)
+        logger.info(
+            f"Encoding {video.path} in {len(chunks)} chunks of {self.options.chunk_seconds} seconds"
+        )
+        try:
+            parts = []
+            encoders = []
+            extension = video.path.rsplit(".", 1)[-1]
+            for number, steps in enumerate(chunks):
+                concat = self.write_steps(
+                    steps, os.path.join(workdir, f"chunk-{number:05d}.ffconcat")
+                )
+                duration = (
+                    sum(count for _, count in steps) / self.options.video_framerate
+                )
+                part = dataclasses.replace(
+                    video, path=os.path.join(workdir, f"chunk-{number:05d}.{extension}")
+                )
+                if number < len(chunks) - 1:
+                    # Cut off the repeated last image, see `write_steps`, which
+                    # would add a frame at each boundary between chunks.
+                    part.arguments = [*part.arguments, "-t", f"{duration:g}"]
+                arguments = ["-f", "concat", "-safe", "0", "-i", concat]
+                arguments += self.output_arguments([part], threads=threads)
+                encoders.append(
+                    EncoderJob(
+                        ["ffmpeg", *PROGRESS_ARGUMENTS, *arguments],
+                        name=part.path,
+                        threads=threads,
+                        duration=duration,
+                    )
+                )
+                parts.append(part.path)
+            if others:
+                arguments = self.input_arguments(source, timeline)
+                arguments += self.palette_arguments(others)
+                arguments += self.output_arguments(others, threads=threads)
+                encoders.append(
+                    EncoderJob(
+                        ["ffmpeg", *PROGRESS_ARGUMENTS, *arguments],
+                        name=others[0].path,
+                        threads=threads,
+                        duration=self.duration(source, timeline),
+                    )
+                )
+            self.manager.run_all(encoders, timeout=self.options.encoder_timeout)
+            self.concat_videos(parts, video.path)
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    def concat_videos(self, sources: list[str], target: str):
+        """
+        Join videos using FFmpeg's concat demuxer with stream copy, without
+        re-encoding. All videos must have been encoded using the same settings.
+
+        https://trac.ffmpeg.org/wiki/Concatenate#demuxer
+        """
+        concat = target + ".ffconcat"
+        # Move the index to the front of MP4 files, for playback while downloading.
+        muxer = []
+        if target.rsplit(".", 1)[-1].lower() in ("mp4", "mov"):
+            muxer = ["-movflags", "+faststart"]
+        with open(concat, "w") as f:
+            f.write("ffconcat version 1.0\n")
+            for file in sources:
+                f.write(f"file '{os.path.abspath(file)}'\n")
+        try:
+            self.run_ffmpeg(
+                [
+                    "-f",
+                    "concat",
+                    "-safe",
+                    "0",
+                    "-i",
+                    concat,
+                    "-c",
+                    "copy",
+                    *muxer,
+                    target,
+                    "-y",
+                ],
+                name=target,
+            )
+        finally:
+            os.unlink(concat)
+
+    def append_video(self, source, target):
+        """
+        Append video to existing one, without re-encoding, see `concat_videos`.
+        """
+        stem, suffix = target.rsplit(".", 1)
+        joined = f"{stem}.joined.{suffix}"
+        logger.info(f"Appending video {source} to {target}")
+        self.concat_videos([target, source], joined)
+        os.replace(joined, target)
+        os.unlink(source)
+
+    def frame_steps(
+        self,
+        source,
+        timeline: t.Optional[list["SpooledFrame"]] = None,
+        frames: t.Optional[t.Sequence[ImageSource]] = None,
+    ) -> list[tuple[ImageSource, int]]:
+        """
+        Pairs of image and the number of steps it is displayed for. When the
+        spool does not live on a filesystem, images are taken from `frames`,
+        which repeat each image of the `timeline` as often as it has been captured.
+        """
+        if frames is not None:
+            if not timeline:
+                return [(image, 1) for image in frames]
+            steps = []
+            position = 0
+            for frame in timeline:
+                steps.append((frames[position], frame.count))
+                position += frame.count
+            return steps
+        if timeline:
+            return [(frame.file, frame.count) for frame in timeline]
+        if source is not None:
+            return [(file, 1) for file in sorted(glob.glob(source))]
+        return []
+
+    def prepare_palette(
+        self,
+        source,
+        timeline: t.Optional[list["SpooledFrame"]],
+        palette: str,
+        frames: t.Optional[t.Sequence[ImageSource]] = None,
+    ):
+        """
+        Use palette file for GIF outputs, generating it when it does not exist yet.
+        Without any frames, the palette is generated within the filter graph instead.
+        """
+        if os.path.exists(palette):
+            logger.info(f"Using GIF palette {palette}")
+            self.palette = palette
+            return
+        images = [image for image, _ in self.frame_steps(source, timeline, frames)]
+        if images:
+            self.make_palette(images, palette)
+            self.palette = palette
+
+    def make_palette(self, images: list[ImageSource], target: str):
+        """
+        Generate GIF palette from every n-th frame only. Dashboards use a small,
+        stable set of colors, so a sample is sufficient, while analyzing all
+        frames is slow, and needs lots of memory.
+
+        Frames not stored as files are written to a temporary directory first.
+
+        https://ffmpeg.org/ffmpeg-filters.html#palettegen-1
+        """
+        sample = images[:: max(self.options.palette_stride, 1)]
+        logger.info(
+            f"Generating GIF palette from {len(sample)} of {len(images)} frames"
+        )
+        directory = os.path.dirname(os.path.abspath(target))
+        os.makedirs(directory, exist_ok=True)
+        # Generate palette within the target directory, and move it into place
+        # when complete, so concurrent renders will not read a partial file.
+        with tempfile.TemporaryDirectory(dir=directory) as workdir:
+            files = []
+            for number, image in enumerate(sample):
+                if isinstance(image, str):
+                    files.append(image)
+                    continue
+                # Without file extension, FFmpeg detects the image format from its content.
+                file = os.path.join(workdir, f"sample-{number:05d}")
+                with open(file, "wb") as f:
+                    f.write(image)
+                files.append(file)
+            concat = self.write_steps(
+                [(file, 1) for file in files], os.path.join(workdir, "sample.ffconcat")
+            )
+            partfile = os.path.join(workdir, "palette.png")
+            self.run_ffmpeg(
+                [
+                    "-f",
+                    "concat",
+                    "-safe",
+                    "0",
+                    "-i",
+                    concat,
+                    "-vf",
+                    f"scale={self.options.gif_width}:-1:flags=lanczos,palettegen=stats_mode=full",
+                    "-update",
+                    "1",
+                    partfile,
+                    "-y",
+                ],
+                name=target,
+            )
+            os.replace(partfile, target)
+
+    def encode_delta(
+        self,
+        source,
+        outputs: list["MediaOutput"],
+        timeline: t.Optional[list["SpooledFrame"]] = None,
+        frames: t.Optional[t.Iterable[bytes]] = None,
+    ):
+        """
+        Encode GIF and APNG outputs using `DeltaEncoder`, only writing the
+        changed regions of each frame. The palette file is used when
+        available, otherwise it is computed from every n-th frame. Piped
+        frames are displayed for as many steps as the `timeline` says.
+        """
+        steps = self.frame_steps(
+            source, timeline, list(frames) if frames is not None else None
+        )
+        for output in outputs:
+            logger.info(f"Rendering {output.path}")
+            encoder = DeltaEncoder(
+                output.path,
+                format=output.path.rsplit(".", 1)[-1],
+                width=output.width,
+                framerate=self.options.video_framerate,
+            )
+            if self.palette:
+                encoder.load_palette(self.palette)
+            encoder.encode(steps, palette_stride=self.options.palette_stride)
 
     def to_gif(self, source, target):
         """
@@ -77,24 +682,215 @@ class MediaProducer:
         ffmpeg -i dwd-cdc-2018-08.mov -filter_complex 'fps=10,scale=480:-1:flags=lanczos,split [o1] [o2];[o1] palettegen [p]; [o2] fifo [o3];[o3] [p] paletteuse' dwd-cdc-2018-08-v2.gif -y
         """
 
-        # TODO: Expose `fps` and `scale` values.
-        command = f"ffmpeg -i '{source}' -filter_complex 'fps={self.options.gif_fps},scale={self.options.gif_width}:-1:flags=lanczos,split [o1] [o2];[o1] palettegen [p]; [o2] [p] paletteuse' '{target}' -y"
-        logger.info("Rendering GIF: %s", target)
-        logger.debug(command)
-        os.system(command)  # noqa: S605
+        self.transcode(
+            source, [MediaOutput(target, self.gif_filter(self.options.gif_width))]
+        )
 
     def upload_server(self, source):
         command = f"make --makefile=/Users/amo/dev/hiveeyes/sources/documentation/Makefile ptrace source={source}"
         os.system(command)  # noqa: S605
 
-    def render(self, source, target):
-        mp4 = target
-        suffix = "." + target.split(".")[-1]
-        gif = mp4.replace(suffix, ".gif")
-        self.to_video(source, mp4)
-        self.to_gif(mp4, gif)
-        results = [mp4, gif]
-        return results
+    def render(
+        self,
+        source,
+        target,
+        timeline: t.Optional[list["SpooledFrame"]] = None,
+        append: bool = False,
+        streamed: bool = False,
+        frames: t.Optional[t.Iterable[bytes]] = None,
+        palette: t.Optional[str] = None,
+    ):
+        """
+        Produce video, GIF, and additional renditions. Frames are read from
+        files matching the `source` pattern, or following the `timeline`.
+        When the spool does not live on a filesystem, `frames` are piped
+        into the encoder.
+
+        All outputs are produced from the frames in a single pass, instead
+        of deriving the GIF from the encoded video.
+
+        The GIF palette is read from the `palette` file. When it does not
+        exist yet, it is generated from a sample of the frames, and stored
+        there for reuse by subsequent renders.
+        """
+        with tempfile.TemporaryDirectory() as workdir:
+            # The delta encoder computes its own palette, unless one is cached.
+            if not streamed and (palette or self.options.gif_encoder == "ffmpeg"):
+                # Piped frames are consumed by both the palette and the encoder.
+                if frames is not None:
+                    frames = list(frames)
+                self.prepare_palette(
+                    source,
+                    timeline,
+                    palette or os.path.join(workdir, "palette.png"),
+                    frames=frames,
+                )
+            return self.render_outputs(
+                source,
+                target,
+                timeline=timeline,
+                append=append,
+                streamed=streamed,
+                frames=frames,
+            )
+
+    def render_outputs(
+        self,
+        source,
+        target,
+        timeline: t.Optional[list["SpooledFrame"]] = None,
+        append: bool = False,
+        streamed: bool = False,
+        frames: t.Optional[t.Iterable[bytes]] = None,
+    ) -> list[str]:
+        outputs = self.outputs(target)
+        mp4 = outputs[0]
+        deltas = [output for output in outputs if output.encoder == "delta"]
+        encoded = [output for output in outputs if output.encoder == "ffmpeg"]
+        if streamed:
+            # All outputs have been encoded while capturing, see `StreamingEncoder`.
+            pass
+        elif append and os.path.exists(mp4.path):
+            # Only encode the new frames, and append them to the existing video.
+            # Other outputs span the whole video, so they are derived from it.
+            stem, suffix = mp4.path.rsplit(".", 1)
+            tail = dataclasses.replace(mp4, path=f"{stem}.tail.{suffix}")
+            self.encode(source, [tail], timeline=timeline, frames=frames)
+            self.append_video(tail.path, mp4.path)
+            if deltas:
+                logger.warning(
+                    f"Skipping {', '.join(output.path for output in deltas)}, "
+                    f"delta encoding is not supported when appending"
+                )
+                outputs = encoded
+            if encoded[1:]:
+                self.transcode(mp4.path, encoded[1:])
+        else:
+            # Piped frames are consumed by both FFmpeg and the delta encoder.
+            if frames is not None and deltas:
+                frames = list(frames)
+            self.encode(source, encoded, timeline=timeline, frames=frames)
+            if deltas:
+                self.encode_delta(source, deltas, timeline=timeline, frames=frames)
+        return [output.path for output in outputs]
+
+
+@dataclasses.dataclass
+class MediaOutput:
+    """
+    Output file, with the filter chain and encoder options producing it.
+    """
+
+    path: str
+    filter: str
+    arguments: list[str] = dataclasses.field(default_factory=list)
+    # Label of the palette stream used by the filter chain.
+    palette: t.Optional[str] = None
+    # Produced by FFmpeg, or by `DeltaEncoder`, scaling frames to `width`.
+    encoder: str = "ffmpeg"
+    width: t.Optional[int] = None
+
+
+class StreamingEncoder:
+    """
+    Encode frames into a video while they are being captured, by piping
+    them into the standard input of a long-lived FFmpeg process, using
+    the `image2pipe` demuxer. No intermediate file per frame is needed.
+
+    https://ffmpeg.org/ffmpeg-formats.html#image2-1
+    """
+
+    def __init__(
+        self,
+        target: str,
+        options: RenderingOptions,
+        outputs: t.Optional[list[MediaOutput]] = None,
+        manager: t.Optional[EncoderJobManager] = None,
+        palette: t.Optional[str] = None,
+    ):
+        self.target = target
+        self.options = options
+        self.producer = MediaProducer(options, manager=manager, palette=palette)
+        self.outputs = outputs or [
+            output
+            for output in self.producer.outputs(target)
+            if output.encoder == "ffmpeg"
+        ]
+        self.job: t.Optional[EncoderJob] = None
+        self.frames = 0
+        # Drop images once they have been piped into FFmpeg, when this
+        # encoder is the last stage consuming them.
+        self.release = False
+
+    def command(self) -> list[str]:
+        return [
+            "ffmpeg",
+            "-f",
+            "image2pipe",
+            "-framerate",
+            str(self.options.video_framerate),
+            "-i",
+            "-",
+            *self.producer.palette_arguments(self.outputs),
+            *PROGRESS_ARGUMENTS,
+            *self.producer.output_arguments(
+                self.outputs, threads=self.producer.threads
+            ),
+        ]
+
+    def start(self):
+        logger.info(f"Streaming frames into video: {self.target}")
+        self.job = EncoderJob(
+            self.command(),
+            name=self.target,
+            threads=self.producer.threads,
+            stdin=True,
+        )
+        self.producer.manager.start(self.job)
+        return self
+
+    def write_item(self, item: FrameRecord) -> FrameRecord:
+        """
+        Pipeline stage feeding a captured frame into the encoder.
+        """
+        if item.image is not None:
+            self.write_image(item.image)
+            if self.release:
+                item.set_image(None)
+        return item
+
+    def write_image(self, image: bytes):
+        assert self.job is not None and self.job.process is not None  # noqa: S101
+        assert self.job.process.stdin is not None  # noqa: S101
+        try:
+            self.job.process.stdin.write(image)
+        except BrokenPipeError as ex:
+            raise EncoderError(
+                f"Encoder exited prematurely: {self.error_output()}"
+            ) from ex
+        self.frames += 1
+
+    def close(self):
+        """
+        Signal end of stream, and wait for the encoder to finish the video.
+        """
+        assert self.job is not None and self.job.process is not None  # noqa: S101
+        assert self.job.process.stdin is not None  # noqa: S101
+        try:
+            self.job.process.stdin.close()
+        except BrokenPipeError:
+            pass
+        self.producer.manager.finish(self.job, timeout=self.options.encoder_timeout)
+        logger.info(f"Streamed {self.frames} frames into video: {self.target}")
+
+    def abort(self):
+        if self.job is not None:
+            self.job.abort()
+
+    def error_output(self, lines: int = 20) -> str:
+        if self.job is None:
+            return ""
+        return self.job.error_output(lines)
 
 
 def run(source, target):
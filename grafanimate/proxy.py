@@ -0,0 +1,379 @@
+# (c) 2018-2021 Andreas Motl <andreas.motl@panodata.org>
+# License: GNU Affero General Public License, Version 3
+import hashlib
+import http.client
+import json
+import logging
+import os
+import threading
+import time
+import typing as t
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qsl, urlencode, urlsplit
+
+from furl import furl
+
+logger = logging.getLogger(__name__)
+
+# Grafana endpoints whose responses will be cached.
+CACHEABLE_PATHS = ["/api/ds/query", "/api/datasources/proxy/"]
+
+# Fields of query requests which change on each request, but don't change the outcome.
+VOLATILE_FIELDS = ["requestId"]
+
+# Request headers identifying the user and organization. Responses are cached
+# per combination of them, so they are never served to another user. Session
+# cookies are not part of it, Grafana issues new ones on each login, and
+# rotates them while rendering.
+IDENTITY_HEADERS = ["Authorization", "X-Grafana-Org-Id"]
+
+# Response headers not to be cached, so a cache hit never replays a session.
+SESSION_HEADERS = ["set-cookie", "set-cookie2"]
+
+# Headers not to be forwarded, see RFC 2616, section 13.5.1.
+HOP_BY_HOP_HEADERS = [
+    "connection",
+    "keep-alive",
+    "proxy-authenticate",
+    "proxy-authorization",
+    "te",
+    "trailers",
+    "transfer-encoding",
+    "upgrade",
+    "content-length",
+]
+
+
+def default_cache_path() -> Path:
+    cache_home = os.environ.get("XDG_CACHE_HOME") or Path.home() / ".cache"
+    return Path(cache_home) / "grafanimate" / "queries"
+
+
+def normalize_body(body: bytes) -> bytes:
+    """
+    Normalize JSON request body, sorting keys, and removing volatile fields.
+    """
+    try:
+        data = json.loads(body)
+    except ValueError:
+        return body
+
+    def strip(value):
+        if isinstance(value, dict):
+            return {
+                key: strip(item)
+                for key, item in value.items()
+                if key not in VOLATILE_FIELDS
+            }
+        if isinstance(value, list):
+            return [strip(item) for item in value]
+        return value
+
+    return json.dumps(strip(data), sort_keys=True).encode()
+
+
+def cache_key(
+    method: str,
+    path: str,
+    body: bytes,
+    headers: t.Optional[t.Mapping[str, str]] = None,
+) -> str:
+    """
+    Compute cache key from request method, path, normalized query string,
+    normalized body, and the headers identifying the user. Time range
+    parameters are part of the query string or body.
+    """
+    url = urlsplit(path)
+    query = urlencode(sorted(parse_qsl(url.query, keep_blank_values=True)))
+    identity = [
+        f"{name}: {(headers or {}).get(name) or ''}" for name in IDENTITY_HEADERS
+    ]
+    digest = hashlib.sha256()
+    for part in [
+        method.encode(),
+        url.path.encode(),
+        query.encode(),
+        normalize_body(body),
+        "\n".join(identity).encode(),
+    ]:
+        digest.update(part)
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+class CachedResponse(t.NamedTuple):
+    status: int
+    headers: list[tuple[str, str]]
+    body: bytes
+
+
+class QueryCache:
+    """
+    Size-bounded LRU cache for query responses, persisted on disk,
+    so it will be reused across invocations.
+    """
+
+    def __init__(
+        self,
+        path: t.Optional[Path] = None,
+        max_bytes: int = 512 * 1024 * 1024,
+        ttl: t.Optional[float] = None,
+    ):
+        self.path = Path(path or default_cache_path())
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.entries: OrderedDict[str, int] = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.load()
+
+    def load(self):
+        """
+        Read inventory of cache directory, least recently used first.
+        """
+        self.path.mkdir(parents=True, exist_ok=True)
+        files = sorted(self.path.glob("*.cache"), key=lambda file: file.stat().st_mtime)
+        for file in files:
+            size = file.stat().st_size
+            self.entries[file.stem] = size
+            self.size += size
+        logger.info(
+            f"Query cache at {self.path} holds {len(self.entries)} responses ({self.size} bytes)"
+        )
+
+    def file(self, key: str) -> Path:
+        return self.path / f"{key}.cache"
+
+    def get(self, key: str) -> t.Optional[CachedResponse]:
+        with self.lock:
+            if key not in self.entries:
+                self.misses += 1
+                return None
+            file = self.file(key)
+            try:
+                with open(file, "rb") as f:
+                    meta = json.loads(f.readline())
+                    body = f.read()
+            except (OSError, ValueError):
+                self.evict(key)
+                self.misses += 1
+                return None
+            if self.ttl is not None and time.time() - meta["created"] > self.ttl:
+                self.evict(key)
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            os.utime(file)
+            self.hits += 1
+        return CachedResponse(
+            status=meta["status"],
+            headers=[tuple(header) for header in meta["headers"]],
+            body=body,
+        )
+
+    def put(self, key: str, response: CachedResponse):
+        headers = [
+            (name, value)
+            for name, value in response.headers
+            if name.lower() not in SESSION_HEADERS
+        ]
+        meta = {
+            "status": response.status,
+            "headers": headers,
+            "created": time.time(),
+        }
+        payload = json.dumps(meta).encode() + b"\n" + response.body
+        if len(payload) > self.max_bytes:
+            return
+        with self.lock:
+            if key in self.entries:
+                self.evict(key)
+            with open(self.file(key), "wb") as f:
+                f.write(payload)
+            self.entries[key] = len(payload)
+            self.size += len(payload)
+            while self.size > self.max_bytes:
+                self.evict(next(iter(self.entries)))
+
+    def evict(self, key: str):
+        self.size -= self.entries.pop(key)
+        try:
+            self.file(key).unlink()
+        except FileNotFoundError:
+            pass
+
+
+class CachingProxy:
+    """
+    Local reverse proxy in front of Grafana, replaying cached responses of
+    datasource queries. Firefox is pointed at the proxy URL instead of Grafana.
+    """
+
+    def __init__(
+        self, upstream: str, cache: QueryCache, host: str = "localhost", port: int = 0
+    ):
+        upstream_url = furl(upstream)
+        self.upstream_scheme = upstream_url.scheme
+        self.upstream_host = upstream_url.host
+        self.upstream_port = upstream_url.port
+        self.upstream_origin = str(
+            furl(
+                scheme=upstream_url.scheme,
+                host=upstream_url.host,
+                port=upstream_url.port,
+            )
+        )
+        self.cache = cache
+        self.server = ThreadingHTTPServer((host, port), self.make_handler())
+        self.server.daemon_threads = True
+        self.host = host
+        self.port = self.server.server_address[1]
+        self.thread: t.Optional[threading.Thread] = None
+
+    def url_for(self, url: str) -> str:
+        """
+        Rewrite Grafana URL to point to the proxy, retaining path and credentials.
+        """
+        proxied = furl(url)
+        proxied.scheme = "http"
+        proxied.host = self.host
+        proxied.port = self.port
+        return str(proxied)
+
+    def start(self):
+        self.thread = threading.Thread(
+            target=self.server.serve_forever, name="query-cache-proxy", daemon=True
+        )
+        self.thread.start()
+        logger.info(
+            f"Query cache proxy listening on http://{self.host}:{self.port}/, forwarding to {self.upstream_origin}"
+        )
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+        logger.info(f"Query cache: {self.cache.hits} hits, {self.cache.misses} misses")
+
+    def is_cacheable(self, method: str, path: str) -> bool:
+        # Grafana may be served from a sub path, so match anywhere within the path.
+        url_path = urlsplit(path).path
+        return method in ["GET", "POST"] and any(
+            prefix in url_path for prefix in CACHEABLE_PATHS
+        )
+
+    def forward(
+        self, method: str, path: str, headers: list[tuple[str, str]], body: bytes
+    ) -> CachedResponse:
+        connection_class = (
+            http.client.HTTPSConnection
+            if self.upstream_scheme == "https"
+            else http.client.HTTPConnection
+        )
+        connection = connection_class(
+            self.upstream_host, self.upstream_port, timeout=60
+        )
+        try:
+            connection.putrequest(
+                method, path, skip_host=True, skip_accept_encoding=True
+            )
+            connection.putheader(
+                "Host",
+                self.upstream_host
+                if self.upstream_port in [80, 443]
+                else f"{self.upstream_host}:{self.upstream_port}",
+            )
+            for name, value in headers:
+                connection.putheader(name, value)
+            connection.putheader("Content-Length", str(len(body)))
+            connection.endheaders(body)
+            response = connection.getresponse()
+            return CachedResponse(
+                status=response.status,
+                headers=[
+                    (
+                        name,
+                        self.rewrite_location(value)
+                        if name.lower() == "location"
+                        else value,
+                    )
+                    for name, value in response.getheaders()
+                    if name.lower() not in HOP_BY_HOP_HEADERS
+                ],
+                body=response.read(),
+            )
+        finally:
+            connection.close()
+
+    def rewrite_location(self, value: str) -> str:
+        if value.startswith(self.upstream_origin):
+            return (
+                f"http://{self.host}:{self.port}" + value[len(self.upstream_origin) :]
+            )
+        return value
+
+    def request_headers(self, headers) -> list[tuple[str, str]]:
+        """
+        Compute headers to send upstream. Origin and Referer are rewritten,
+        to satisfy Grafana's CSRF protection.
+        """
+        proxy_origin = f"http://{self.host}:{self.port}"
+        result = []
+        for name, value in headers.items():
+            lower = name.lower()
+            if lower in HOP_BY_HOP_HEADERS or lower == "host":
+                continue
+            if lower in ["origin", "referer"]:
+                result.append((name, value.replace(proxy_origin, self.upstream_origin)))
+            else:
+                result.append((name, value))
+        return result
+
+    def make_handler(self):
+        proxy = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def handle_any(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                body = self.rfile.read(length) if length else b""
+
+                key = None
+                response = None
+                if proxy.is_cacheable(self.command, self.path):
+                    key = cache_key(self.command, self.path, body, self.headers)
+                    response = proxy.cache.get(key)
+
+                if response is None:
+                    response = proxy.forward(
+                        self.command,
+                        self.path,
+                        proxy.request_headers(self.headers),
+                        body,
+                    )
+                    if key is not None and response.status == 200:
+                        proxy.cache.put(key, response)
+                else:
+                    logger.debug("Query cache hit: %s", self.path)
+
+                self.send_response(response.status)
+                for name, value in response.headers:
+                    self.send_header(name, value)
+                self.send_header("Content-Length", str(len(response.body)))
+                self.end_headers()
+                if self.command != "HEAD":
+                    self.wfile.write(response.body)
+
+            do_GET = do_POST = do_PUT = do_PATCH = do_DELETE = do_HEAD = do_OPTIONS = (
+                handle_any
+            )
+
+            def log_message(self, format, *args):
+                logger.debug(format, *args)
+
+        return Handler
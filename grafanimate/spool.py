@@ -1,48 +1,376 @@
 # (c) 2018-2021 Andreas Motl <andreas.motl@panodata.org>
 # License: GNU Affero General Public License, Version 3
+import dataclasses
+import hashlib
+import json
 import logging
 import os.path
-import shutil
-from tempfile import mkdtemp
+import typing as t
+from datetime import datetime, timezone
 
+from grafanimate.framecache import FrameCache, frame_cache_key, is_historical
+from grafanimate.imaging import IMAGE_EXTENSIONS, Region, image_digest
+from grafanimate.model import FrameRecord
+from grafanimate.spoolbackend import DirectorySpool, SpoolBackend
 from grafanimate.timeutil import format_date_filename
 
 logger = logging.getLogger(__name__)
 
 
+@dataclasses.dataclass
+class SpooledFrame:
+    """
+    A frame image stored in the spool, displayed for `count` consecutive steps.
+    """
+
+    file: str
+    count: int = 1
+    digest: t.Optional[str] = None
+    # Size and checksum of the image file, for verifying it when resuming.
+    size: t.Optional[int] = None
+    checksum: t.Optional[str] = None
+
+
+FrameKey = tuple[int, str, str]
+
+
+def frame_key(sequence_index: int, start: datetime, stop: datetime) -> FrameKey:
+    return int(sequence_index or 0), start.isoformat(), stop.isoformat()
+
+
+def settings_digest(settings: dict[str, t.Any]) -> str:
+    """
+    Fingerprint of the capture settings. Frames captured using different
+    settings will not be reused when resuming.
+    """
+    payload = json.dumps(settings, sort_keys=True, default=str).encode()
+    return hashlib.sha1(payload).hexdigest()  # noqa: S324
+
+
+class FrameManifest:
+    """
+    Append-only record of completed frames within a spool directory,
+    one JSON document per line. A truncated last line, for example
+    after a crash, is ignored.
+    """
+
+    filename = "manifest.jsonl"
+
+    def __init__(self, workdir: str):
+        self.path = os.path.join(workdir, self.filename)
+
+    def read(self) -> list[dict[str, t.Any]]:
+        entries: list[dict[str, t.Any]] = []
+        if not os.path.exists(self.path):
+            return entries
+        with open(self.path) as f:
+            for line in f:
+                try:
+                    entries.append(json.loads(line))
+                except ValueError:
+                    logger.warning(f"Ignoring malformed manifest entry: {line!r}")
+        return entries
+
+    def append(self, entry: dict[str, t.Any]):
+        with open(self.path, "a") as f:
+            f.write(json.dumps(entry) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def reset(self):
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+
 class TemporaryStorage:
-    def __init__(self):
-        self.workdir = mkdtemp()
-        self.imagefile_template = "{uid}_{seq}_{start}_{stop}.png"
-
-    def save_items(self, results) -> list[str]:
-        files = []
-        for item in results:
-            # logger.info('item: %s', item)
-            printable = item.copy()
-            printable.data.image = printable.data.image[:23] + b"..."
-            logger.debug("Item: %s", printable)
-            files.append(self.save_item(item))
-        return files
-
-    def save_item(self, item) -> str:
+    def __init__(
+        self,
+        dedup: bool = False,
+        dedup_mask: t.Optional[Region] = None,
+        workdir: t.Optional[str] = None,
+        settings: t.Optional[dict[str, t.Any]] = None,
+        resume: bool = False,
+        cache: t.Optional[FrameCache] = None,
+        cache_settings: t.Optional[dict[str, t.Any]] = None,
+        backend: t.Optional[SpoolBackend] = None,
+    ):
+        # When a working directory is given, the spool is persistent,
+        # and records completed frames into a manifest file.
+        self.persistent = workdir is not None
+        if backend is None:
+            backend = DirectorySpool(path=workdir)
+        self.backend = backend
+        self.workdir = backend.path
+        self.imagefile_template = "{uid}_{seq}_{start}_{stop}.{extension}"
+        self.extension = "png"
+
+        # When deduplicating, runs of identical consecutive frames
+        # are collapsed into a single image.
+        self.dedup = dedup
+        self.dedup_mask = dedup_mask
+        self.timeline: list[SpooledFrame] = []
+
+        # Frames completed by a previous run, to be skipped when resuming.
+        self.settings = settings_digest(settings or {})
+        self.manifest: t.Optional[FrameManifest] = None
+        self.completed: dict[FrameKey, dict[str, t.Any]] = {}
+        if self.persistent and self.workdir is not None:
+            self.manifest = FrameManifest(self.workdir)
+            if resume:
+                self.load_manifest()
+            else:
+                self.reset_manifest()
+
+        # Historical frames are shared across runs using the frame cache.
+        # Its scope covers all settings influencing the appearance of frames.
+        self.cache = cache
+        self.cache_scope = settings_digest(cache_settings or {})
+        self.cached: dict[FrameKey, bytes] = {}
+        self.started = datetime.now(tz=timezone.utc)
+
+    def load_manifest(self):
+        assert self.manifest is not None  # noqa: S101
+        stale = 0
+        damaged = 0
+        verified: dict[str, bool] = {}
+        for entry in self.manifest.read():
+            if entry.get("settings") != self.settings:
+                stale += 1
+                continue
+            if not self.backend.exists(entry["file"]):
+                continue
+            # Deduplicated frames share their file, verify it only once.
+            if entry["file"] not in verified:
+                verified[entry["file"]] = self.verify_entry(entry)
+            if not verified[entry["file"]]:
+                damaged += 1
+                continue
+            key = entry["sequence"], entry["start"], entry["stop"]
+            self.completed[key] = entry
+        if stale:
+            logger.warning(
+                f"Ignoring {stale} frames captured with different settings, they will be captured again"
+            )
+        if damaged:
+            logger.warning(
+                f"Ignoring {damaged} frames with truncated or modified image files, they will be captured again"
+            )
+        logger.info(
+            f"Resuming from {self.manifest.path}, {len(self.completed)} frames already captured"
+        )
+
+    def verify_entry(self, entry: dict[str, t.Any]) -> bool:
+        """
+        Whether the image file of a manifest entry is unchanged since it has been written.
+        """
+        image = self.backend.read(entry["file"])
+        return (
+            len(image) == entry.get("size")
+            and hashlib.sha1(image).hexdigest() == entry.get("checksum")  # noqa: S324
+        )
+
+    def reset_manifest(self):
+        assert self.manifest is not None  # noqa: S101
+        entries = self.manifest.read()
+        if not entries:
+            return
+        logger.warning(
+            f"Discarding {len(entries)} frames of previous run in {self.workdir}, use --resume to continue it"
+        )
+        for entry in entries:
+            self.backend.delete(entry["file"])
+        self.manifest.reset()
+
+    def has_frame(self, frame) -> bool:
+        """
+        Whether the frame has been captured by a previous run already,
+        either recorded in the manifest, or available from the frame cache.
+        """
+        key = frame_key(
+            frame.sequence.index, frame.timerange.start, frame.timerange.stop
+        )
+        if key in self.completed:
+            return True
+        if self.cache is not None and is_historical(
+            frame.timerange.stop, now=self.started
+        ):
+            image = self.cache.get(
+                frame_cache_key(
+                    self.cache_scope, frame.timerange.start, frame.timerange.stop
+                )
+            )
+            if image is not None:
+                # Keep the image until the item arrives, it might get evicted meanwhile.
+                self.cached[key] = image
+                return True
+        return False
+
+    def save_items(self, results: t.Iterable[FrameRecord]) -> list[t.Optional[str]]:
+        return [self.save_item(item) for item in results]
+
+    def save_item(self, item: FrameRecord) -> t.Optional[str]:
+        logger.debug("Item: %s", item)
+
+        # Frames taken from the frame cache are spooled like fresh ones,
+        # frames captured by a previous run are in the spool already.
+        if not self.resolve_item(item):
+            if item.skipped:
+                return self.restore_item(item)
+            self.cache_item(item)
+
+        image = item.image
+        if image is None:
+            raise ValueError(f"Unable to spool frame without image: {item}")
+
+        # Skip frames identical to their predecessor.
+        digest = None
+        if self.dedup:
+            digest = image_digest(image, mask=self.dedup_mask)
+            if self.timeline and self.timeline[-1].digest == digest:
+                previous = self.timeline[-1]
+                previous.count += 1
+                logger.info(
+                    f"Skipped duplicate frame {item.start}, extending {previous.file} to {previous.count} steps"
+                )
+                self.record(item, previous)
+                return previous.file
+
         # Compute image sequence file name.
+        self.extension = IMAGE_EXTENSIONS[item.format]
         imagename = self.imagefile_template.format(
-            uid=item.meta.dashboard,
-            seq=str(item.frame.sequence.index).zfill(4),
-            start=format_date_filename(item.data.start),
-            stop=format_date_filename(item.data.stop),
+            uid=item.dashboard,
+            seq=str(item.sequence_index).zfill(4),
+            start=format_date_filename(item.start),
+            stop=format_date_filename(item.stop),
+            extension=self.extension,
         )
 
-        imagefile = os.path.join(self.workdir, imagename)
-
         # Store image.
-        with open(imagefile, "wb") as f:
-            f.write(item.data.image)
+        imagefile = self.backend.write(
+            imagename,
+            image,
+            metadata={
+                "dashboard": item.dashboard,
+                "sequence": item.sequence_index,
+                "start": item.start.isoformat(),
+                "stop": item.stop.isoformat(),
+                "format": item.format,
+            },
+        )
+
+        logger.info(f"Saved frame to {imagefile} (size={item.size})")
 
-        logger.info(f"Saved frame to {imagefile} (size={len(item.data.image)})")
+        spooled = SpooledFrame(file=imagefile, digest=digest)
+        if self.manifest is not None:
+            spooled.size = item.size
+            spooled.checksum = hashlib.sha1(image).hexdigest()  # noqa: S324
+        self.timeline.append(spooled)
+        self.record(item, spooled)
 
         return imagefile
 
+    def resolve_item(self, item: FrameRecord) -> bool:
+        """
+        Fill in the image of a skipped frame, when it has been taken from the frame cache.
+        """
+        if not item.skipped:
+            return False
+        key = frame_key(item.sequence_index, item.start, item.stop)
+        if key not in self.cached:
+            return False
+        item.set_image(self.cached.pop(key))
+        item.skipped = False
+        return True
+
+    def cache_item(self, item: FrameRecord):
+        """
+        Store historical frame into the frame cache.
+        """
+        if (
+            self.cache is not None
+            and item.image is not None
+            and is_historical(item.stop, now=self.started)
+        ):
+            self.cache.put(
+                frame_cache_key(self.cache_scope, item.start, item.stop),
+                item.image,
+            )
+
+    def pass_item(self, item: FrameRecord) -> FrameRecord:
+        """
+        Handle frame without spooling it, when streaming frames to the encoder.
+        """
+        if not self.resolve_item(item) and not item.skipped:
+            self.cache_item(item)
+        return item
+
+    def spool_item(self, item: FrameRecord) -> FrameRecord:
+        """
+        Spool frame, and hand it over to the next stage, like a live encoder.
+        Frames captured by a previous run are read back from the spool.
+        """
+        imagefile = self.save_item(item)
+        if item.image is None and imagefile is not None:
+            item.set_image(self.backend.read(imagefile))
+        return item
+
+    def record(self, item: FrameRecord, spooled: SpooledFrame):
+        """
+        Record completed frame into the manifest.
+        """
+        if self.manifest is None:
+            return
+        sequence, start, stop = frame_key(item.sequence_index, item.start, item.stop)
+        self.manifest.append(
+            {
+                "sequence": sequence,
+                "start": start,
+                "stop": stop,
+                "file": os.path.basename(spooled.file),
+                "digest": spooled.digest,
+                "size": spooled.size,
+                "checksum": spooled.checksum,
+                "settings": self.settings,
+            }
+        )
+
+    def restore_item(self, item: FrameRecord) -> t.Optional[str]:
+        """
+        Add frame captured by a previous run to the timeline.
+        """
+        key = frame_key(item.sequence_index, item.start, item.stop)
+        entry = self.completed.get(key)
+        if entry is None:
+            # Frame has been skipped for other reasons, e.g. when appending.
+            return None
+        imagefile = self.backend.location(entry["file"])
+        self.extension = os.path.splitext(imagefile)[1][1:]
+        if self.timeline and self.timeline[-1].file == imagefile:
+            self.timeline[-1].count += 1
+        else:
+            self.timeline.append(SpooledFrame(file=imagefile, digest=entry["digest"]))
+        return imagefile
+
+    @property
+    def has_duplicates(self) -> bool:
+        return any(frame.count > 1 for frame in self.timeline)
+
+    @property
+    def needs_timeline(self) -> bool:
+        """
+        Whether encoding must follow the timeline instead of globbing the
+        spool directory, which may hold frames not belonging to this run.
+        """
+        return self.has_duplicates or self.persistent
+
+    def iter_images(self) -> t.Generator[bytes, None, None]:
+        """
+        Read frames from the spool, repeating them as often as they have been captured.
+        """
+        for frame in self.timeline:
+            image = self.backend.read(frame.file)
+            for _ in range(frame.count):
+                yield image
+
     def __del__(self):
-        shutil.rmtree(self.workdir)
+        self.backend.close()
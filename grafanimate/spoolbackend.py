@@ -0,0 +1,296 @@
+# (c) 2018-2021 Andreas Motl <andreas.motl@panodata.org>
+# License: GNU Affero General Public License, Version 3
+import dataclasses
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+import typing as t
+
+from grafanimate.archive import FrameArchive
+
+logger = logging.getLogger(__name__)
+
+# Where to find a memory-backed filesystem.
+TMPFS_PATH = "/dev/shm"  # noqa: S108
+
+MEGABYTE = 1024 * 1024
+
+
+class SpoolFullError(Exception):
+    pass
+
+
+@dataclasses.dataclass
+class SpoolStats:
+    """
+    Throughput statistics of a spool backend.
+    """
+
+    writes: int = 0
+    bytes_written: int = 0
+    write_seconds: float = 0.0
+    reads: int = 0
+    bytes_read: int = 0
+    read_seconds: float = 0.0
+
+    @staticmethod
+    def throughput(size: int, seconds: float) -> float:
+        """
+        Throughput in megabytes per second.
+        """
+        return size / MEGABYTE / seconds if seconds > 0 else 0.0
+
+    def summary(self) -> str:
+        return (
+            f"wrote {self.writes} frames, {self.bytes_written / MEGABYTE:.1f} MB "
+            f"at {self.throughput(self.bytes_written, self.write_seconds):.1f} MB/s, "
+            f"read {self.reads} frames, {self.bytes_read / MEGABYTE:.1f} MB "
+            f"at {self.throughput(self.bytes_read, self.read_seconds):.1f} MB/s"
+        )
+
+
+class SpoolBackend:
+    """
+    Where captured frames are kept until encoding them.
+
+    `write` stores a frame under the given name, and returns its location,
+    which is used by `read` and `delete`. Persistent backends provide their
+    directory in `path`. When `files` is true, frames are stored as image
+    files within that directory, so encoders can read them directly.
+    """
+
+    name = "abstract"
+    path: t.Optional[str] = None
+    files = False
+
+    def __init__(self):
+        self.stats = SpoolStats()
+
+    def write(
+        self, name: str, data: bytes, metadata: t.Optional[dict[str, t.Any]] = None
+    ) -> str:
+        started = time.perf_counter()
+        location = self._write(name, data, metadata)
+        self.stats.write_seconds += time.perf_counter() - started
+        self.stats.writes += 1
+        self.stats.bytes_written += len(data)
+        return location
+
+    def read(self, location: str) -> bytes:
+        started = time.perf_counter()
+        data = self._read(location)
+        self.stats.read_seconds += time.perf_counter() - started
+        self.stats.reads += 1
+        self.stats.bytes_read += len(data)
+        return data
+
+    def location(self, name: str) -> str:
+        return name
+
+    def _write(
+        self, name: str, data: bytes, metadata: t.Optional[dict[str, t.Any]]
+    ) -> str:
+        raise NotImplementedError
+
+    def _read(self, location: str) -> bytes:
+        raise NotImplementedError
+
+    def exists(self, location: str) -> bool:
+        raise NotImplementedError
+
+    def delete(self, location: str):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class DirectorySpool(SpoolBackend):
+    """
+    Keep frames as files within a directory. When no directory is given,
+    a temporary one is created within `base`, and removed on `close`.
+    """
+
+    name = "disk"
+    files = True
+
+    def __init__(self, path: t.Optional[str] = None, base: t.Optional[str] = None):
+        super().__init__()
+        self.persistent = path is not None
+        if path is not None:
+            os.makedirs(path, exist_ok=True)
+            self.path = str(path)
+        else:
+            self.path = tempfile.mkdtemp(dir=base)
+
+    def location(self, name: str) -> str:
+        assert self.path is not None  # noqa: S101
+        return os.path.join(self.path, os.path.basename(name))
+
+    def _write(
+        self,
+        name: str,
+        data: bytes,
+        metadata: t.Optional[dict[str, t.Any]],  # noqa: ARG002
+    ) -> str:
+        # Write to temporary file first, so that
+        # an interrupted run will not leave truncated images behind.
+        location = self.location(name)
+        partfile = location + ".part"
+        with open(partfile, "wb") as f:
+            f.write(data)
+        os.replace(partfile, location)
+        return location
+
+    def _read(self, location: str) -> bytes:
+        with open(self.location(location), "rb") as f:
+            return f.read()
+
+    def exists(self, location: str) -> bool:
+        return os.path.exists(self.location(location))
+
+    def delete(self, location: str):
+        try:
+            os.unlink(self.location(location))
+        except FileNotFoundError:
+            pass
+
+    def close(self):
+        if not self.persistent and self.path is not None:
+            shutil.rmtree(self.path, ignore_errors=True)
+
+
+class TmpfsSpool(DirectorySpool):
+    """
+    Keep frames as files within a memory-backed filesystem, like `/dev/shm`.
+    """
+
+    name = "tmpfs"
+
+    def __init__(self, path: t.Optional[str] = None, base: str = TMPFS_PATH):
+        if path is None and not os.path.isdir(base):
+            logger.warning(f"{base} is not available, spooling to disk instead")
+            base = tempfile.gettempdir()
+        super().__init__(path=path, base=base)
+
+
+class MemorySpool(SpoolBackend):
+    """
+    Keep frames in memory, bounded by `max_bytes`. All frames are needed
+    for encoding, so exceeding the budget is an error instead of evicting
+    older frames.
+    """
+
+    name = "memory"
+
+    def __init__(self, max_bytes: int = 512 * MEGABYTE):
+        super().__init__()
+        self.max_bytes = max_bytes
+        self.frames: dict[str, bytes] = {}
+        self.size = 0
+        self.lock = threading.Lock()
+
+    def _write(
+        self,
+        name: str,
+        data: bytes,
+        metadata: t.Optional[dict[str, t.Any]],  # noqa: ARG002
+    ) -> str:
+        with self.lock:
+            size = self.size - len(self.frames.get(name, b"")) + len(data)
+            if size > self.max_bytes:
+                raise SpoolFullError(
+                    f"Memory spool exceeds its budget of {self.max_bytes / MEGABYTE:.0f} MB, "
+                    f"please increase --spool-size, or use another --spool-backend"
+                )
+            self.frames[name] = data
+            self.size = size
+        return name
+
+    def _read(self, location: str) -> bytes:
+        return self.frames[location]
+
+    def exists(self, location: str) -> bool:
+        return location in self.frames
+
+    def delete(self, location: str):
+        with self.lock:
+            data = self.frames.pop(location, None)
+            if data is not None:
+                self.size -= len(data)
+
+    def close(self):
+        self.frames.clear()
+        self.size = 0
+
+
+class ArchiveSpool(SpoolBackend):
+    """
+    Keep frames within a single append-only archive file, see `FrameArchive`.
+    When no directory is given, a temporary one is created, and removed on `close`.
+    """
+
+    name = "archive"
+    filename = "frames.archive"
+
+    def __init__(self, path: t.Optional[str] = None):
+        super().__init__()
+        self.persistent = path is not None
+        if path is not None:
+            os.makedirs(path, exist_ok=True)
+            self.path = str(path)
+        else:
+            self.path = tempfile.mkdtemp()
+        self.archive = FrameArchive(os.path.join(self.path, self.filename))
+
+    def _write(
+        self, name: str, data: bytes, metadata: t.Optional[dict[str, t.Any]]
+    ) -> str:
+        self.archive.append(name, data, metadata)
+        return name
+
+    def _read(self, location: str) -> bytes:
+        return self.archive.read(location)
+
+    def exists(self, location: str) -> bool:
+        return location in self.archive
+
+    def delete(self, location: str):
+        self.archive.delete(location)
+
+    def close(self):
+        self.archive.close()
+        if not self.persistent and self.path is not None:
+            shutil.rmtree(self.path, ignore_errors=True)
+
+
+SPOOL_BACKENDS: dict[str, type[SpoolBackend]] = {
+    "disk": DirectorySpool,
+    "tmpfs": TmpfsSpool,
+    "memory": MemorySpool,
+    "archive": ArchiveSpool,
+}
+
+
+def make_spool_backend(
+    name: str = "disk", path: t.Optional[str] = None, max_bytes: t.Optional[int] = None
+) -> SpoolBackend:
+    """
+    Create spool backend by name. A `path` makes file-based spools persistent.
+    """
+    if name not in SPOOL_BACKENDS:
+        raise ValueError(
+            f"Unknown spool backend: {name}, use one of {', '.join(SPOOL_BACKENDS)}"
+        )
+    if name == "memory":
+        if path is not None:
+            raise ValueError("Memory spool backend can not be persistent")
+        return MemorySpool(max_bytes=max_bytes or 512 * MEGABYTE)
+    if name == "tmpfs":
+        return TmpfsSpool(path=path)
+    if name == "archive":
+        return ArchiveSpool(path=path)
+    return DirectorySpool(path=path)
@@ -0,0 +1,224 @@
+import base64
+import threading
+from datetime import datetime
+
+from marionette_driver.marionette import Marionette, WebElement
+from marionette_driver.timeout import Timeouts
+from munch import Munch
+
+from grafanimate.animations import ParallelAnimation
+from grafanimate.grafana import GrafanaWrapper
+from grafanimate.marionette import CountingMarionette
+from grafanimate.model import AnimationSequence
+
+
+class FakeGrafana:
+    """
+    Stand-in for `GrafanaWrapper`, recording which frames it has been asked to render.
+    """
+
+    use_panel_events = False
+    capture_format = "png"
+
+    def __init__(self, name):
+        self.name = name
+        self.frames = []
+        self.threads = set()
+        self.rpc_count = 0
+
+    def open_dashboard(self, uid, options=None):
+        pass
+
+    def console_info(self, message):
+        pass
+
+    def prepare_frame(self, frame, **kwargs):
+        self.frames.append(frame)
+        self.threads.add(threading.get_ident())
+        self.rpc_count += 1
+        return {"ready": True, "waited": 0.0}
+
+    def render_image(self):
+        self.rpc_count += 1
+        return f"{self.name}:{len(self.frames)}".encode()
+
+
+def make_options():
+    return Munch(
+        {
+            "scenario": "test",
+            "exposure-time": 0,
+            "panel-id": None,
+        }
+    )
+
+
+def test_parallel_animation_order():
+    sequence = AnimationSequence(
+        start=datetime(2021, 11, 14, 2, 0, 0),
+        stop=datetime(2021, 11, 14, 2, 59, 59),
+        every="5min",
+    )
+    grafanas = [FakeGrafana("a"), FakeGrafana("b"), FakeGrafana("c")]
+    animation = ParallelAnimation(
+        grafanas=grafanas,
+        dashboard_uid="foo",
+        options=make_options(),
+    )
+    animation.start()
+    items = list(animation.run(sequence))
+
+    # All frames are yielded in their original order.
+    assert [item.start for item in items] == [
+        frame.timerange.start for frame in sequence.get_frames()
+    ]
+    assert len(items) == 12
+
+    # Frames have been dealt round-robin, each browser driven by a single thread.
+    assert [item.grafana.name for item in items[:4]] == ["a", "b", "c", "a"]
+    for grafana in grafanas:
+        assert len(grafana.frames) == 4
+        assert len(grafana.threads) == 1
+
+    # Each frame needs a single round trip for preparing, and one for the screenshot.
+    assert [worker.rpcs_spent for worker in animation.workers] == [8, 8, 8]
+
+
+def test_parallel_animation_skip():
+    sequence = AnimationSequence(
+        start=datetime(2021, 11, 14, 2, 0, 0),
+        stop=datetime(2021, 11, 14, 2, 59, 59),
+        every="5min",
+    )
+    sequence.index = 0
+    grafanas = [FakeGrafana("a"), FakeGrafana("b")]
+    animation = ParallelAnimation(
+        grafanas=grafanas,
+        dashboard_uid="foo",
+        options=make_options(),
+    )
+    animation.start()
+    items = list(
+        animation.run(sequence, skip=lambda frame: frame.timerange.start.minute < 30)
+    )
+
+    # Skipped frames are still yielded in order, but not captured.
+    assert len(items) == 12
+    assert [item.skipped for item in items] == [True] * 6 + [False] * 6
+    assert items[0].image is None
+    assert sum(len(grafana.frames) for grafana in grafanas) == 6
+
+
+def make_grafana(monkeypatch, outcome=None, result=None) -> GrafanaWrapper:
+    """
+    `GrafanaWrapper` talking to a stand-in for the Marionette server, which
+    records the messages sent to it. Asynchronous scripts resolve to `outcome`,
+    synchronous ones return `result`.
+    """
+    messages = []
+    screenshots = []
+    if outcome is None:
+        outcome = {"value": {"ready": True, "waited": 0.0}}
+
+    def send_message(self, name, params=None, key=None):
+        messages.append(name)
+        if name == "WebDriver:ExecuteAsyncScript":
+            return outcome
+        if name == "WebDriver:ExecuteScript":
+            return self._from_json(result)
+        if name == "WebDriver:GetElementRect":
+            return {"x": 10, "y": 20, "width": 300, "height": 200}
+        if name == "WebDriver:TakeScreenshot":
+            screenshots.append(params["id"])
+            return base64.b64encode(b"image").decode()
+        return None
+
+    monkeypatch.setattr(Marionette, "_send_message", send_message)
+    marionette = CountingMarionette.__new__(CountingMarionette)
+    marionette.timeout = Timeouts(marionette)
+    marionette.cleanup_ran = True
+    grafana = GrafanaWrapper.__new__(GrafanaWrapper)
+    grafana.marionette = marionette
+    grafana.messages = messages
+    grafana.screenshots = screenshots
+    grafana.data_timeout = 20.0
+    grafana.script_timeout = 20.0
+    grafana.capture_format = "png"
+    grafana.capture_panel_id = None
+    grafana.panel_element = None
+    grafana.panel_rect = None
+    return grafana
+
+
+def test_prepare_frame_round_trips(monkeypatch):
+    grafana = make_grafana(monkeypatch)
+    sequence = AnimationSequence(
+        start=datetime(2021, 11, 14, 2, 0, 0),
+        stop=datetime(2021, 11, 14, 2, 14, 59),
+        every="5min",
+    )
+    for frame in sequence.get_frames():
+        grafana.prepare_frame(frame, wait=True, exposure=0.5)
+        assert grafana.render_image() == b"image"
+
+    # The script timeout is raised once, then each frame needs two round trips.
+    assert grafana.rpc_count == 7
+    assert (
+        grafana.messages
+        == ["WebDriver:SetTimeouts"]
+        + [
+            "WebDriver:ExecuteAsyncScript",
+            "WebDriver:TakeScreenshot",
+        ]
+        * 3
+    )
+    assert grafana.script_timeout == 25.5
+
+
+def test_prepare_frame_script_error(monkeypatch, caplog):
+    grafana = make_grafana(
+        monkeypatch,
+        outcome={"error": "TypeError: window.__grafanaSceneContext is undefined"},
+    )
+    frame = next(
+        AnimationSequence(
+            start=datetime(2021, 11, 14), stop=datetime(2021, 11, 15), every="1d"
+        ).get_frames()
+    )
+
+    # Rejected promises are reported right away, instead of timing out.
+    assert grafana.prepare_frame(frame, wait=True) == {"ready": False, "waited": 0.0}
+    assert "Failed preparing frame: TypeError" in caplog.text
+    assert grafana.wait_all_data_received() is False
+    assert "Failed waiting for data: TypeError" in caplog.text
+    assert grafana.messages.count("WebDriver:ExecuteAsyncScript") == 2
+
+
+def test_capture_panel(monkeypatch):
+    element = {WebElement.identifiers[0]: "panel-6"}
+    grafana = make_grafana(monkeypatch, result=element)
+    grafana.capture_panel_id = "6"
+    for _ in range(3):
+        assert grafana.render_image() == b"image"
+
+    # The panel element is looked up once, and captured for each frame.
+    assert grafana.messages.count("WebDriver:ExecuteScript") == 1
+    assert grafana.screenshots == ["panel-6"] * 3
+
+    # Other image formats are drawn on a canvas, clipped to the panel.
+    assert grafana.get_panel_rect() == [10, 20, 300, 200]
+    assert grafana.get_panel_rect() == [10, 20, 300, 200]
+    assert grafana.messages.count("WebDriver:GetElementRect") == 1
+
+
+def test_capture_panel_missing(monkeypatch, caplog):
+    grafana = make_grafana(monkeypatch, result=None)
+    grafana.capture_panel_id = "6"
+    for _ in range(3):
+        assert grafana.render_image() == b"image"
+
+    # A missing panel is looked up and reported once, capturing the whole viewport.
+    assert grafana.messages.count("WebDriver:ExecuteScript") == 1
+    assert caplog.text.count("Unable to find element of panel 6") == 1
+    assert grafana.screenshots == [None] * 3
+    assert grafana.get_panel_rect() is None
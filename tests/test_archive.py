@@ -0,0 +1,139 @@
+import os
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import pytest
+
+from grafanimate.archive import ArchiveError, FrameArchive
+from grafanimate.model import AnimationFrame, FrameRecord
+from grafanimate.spool import TemporaryStorage
+from grafanimate.spoolbackend import ArchiveSpool
+from grafanimate.timeutil import Timerange
+
+
+def make_archive(path, count=3) -> FrameArchive:
+    archive = FrameArchive(str(path))
+    for number in range(count):
+        archive.append(
+            f"frame-{number}.png",
+            f"image-{number}".encode(),
+            {"start": datetime(2021, 11, 14 + number).isoformat()},
+        )
+    return archive
+
+
+def test_archive_append_read(tmp_path):
+    archive = make_archive(tmp_path / "frames.archive")
+    assert len(archive) == 3
+    assert archive.read("frame-1.png") == b"image-1"
+    assert archive[2] == b"image-2"
+    assert "frame-0.png" in archive
+    archive.close()
+
+    # Reopen read-only, using the index file.
+    archive = FrameArchive(str(tmp_path / "frames.archive"), writable=False)
+    assert [bytes(archive[number]) for number in range(3)] == [
+        b"image-0",
+        b"image-1",
+        b"image-2",
+    ]
+
+
+def test_archive_rebuild_index(tmp_path):
+    path = tmp_path / "frames.archive"
+    make_archive(path).close()
+
+    # A copy of the archive file alone can be read on another host.
+    os.unlink(str(path) + ".index")
+    archive = FrameArchive(str(path))
+    assert archive.read("frame-2.png") == b"image-2"
+    assert os.path.exists(str(path) + ".index")
+
+
+def test_archive_truncated_record(tmp_path):
+    path = tmp_path / "frames.archive"
+    make_archive(path).close()
+    size = path.stat().st_size
+    with open(path, "r+b") as f:
+        f.truncate(size - 3)
+
+    archive = FrameArchive(str(path))
+    assert len(archive) == 2
+    archive.append("frame-3.png", b"image-3")
+    assert archive.read("frame-3.png") == b"image-3"
+    assert archive.read("frame-1.png") == b"image-1"
+
+
+def test_archive_find(tmp_path):
+    archive = make_archive(tmp_path / "frames.archive")
+    assert archive.find(datetime(2021, 11, 15)) == 1
+    assert archive.find(datetime(2021, 11, 15, 12)) == 1
+    assert archive.find(datetime(2021, 12, 1)) == 2
+    with pytest.raises(KeyError):
+        archive.find(datetime(2021, 11, 1))
+
+
+def test_archive_delete(tmp_path):
+    path = tmp_path / "frames.archive"
+    archive = make_archive(path)
+    archive.delete("frame-1.png")
+    assert "frame-1.png" not in archive
+    assert len(archive) == 2
+    archive.close()
+
+    os.unlink(str(path) + ".index")
+    archive = FrameArchive(str(path))
+    assert "frame-1.png" not in archive
+    assert len(archive) == 2
+
+
+def test_archive_invalid(tmp_path):
+    path = tmp_path / "frames.archive"
+    path.write_bytes(b"foo")
+    with pytest.raises(ArchiveError):
+        FrameArchive(str(path))
+
+
+def test_storage_archive_backend(tmp_path):
+    def make_item(number: int, image: bytes):
+        start = datetime(2021, 11, 14) + timedelta(days=number)
+        stop = start + timedelta(hours=23, minutes=59, seconds=59)
+        frame = AnimationFrame(
+            sequence=SimpleNamespace(index=0),
+            timerange=Timerange(start=start, stop=stop, recurrence=None),
+        )
+        return FrameRecord(frame=frame, image=image, dashboard="foo")
+
+    storage = TemporaryStorage(
+        dedup=True, backend=ArchiveSpool(path=str(tmp_path / "spool"))
+    )
+    for number, image in enumerate([b"a", b"a", b"b"]):
+        storage.save_item(make_item(number, image))
+    assert [bytes(image) for image in storage.iter_images()] == [b"a", b"a", b"b"]
+    assert sorted(os.listdir(tmp_path / "spool")) == [
+        "frames.archive",
+        "frames.archive.index",
+    ]
+
+    archive = storage.backend.archive
+    assert archive.entries[1].metadata["start"] == "2021-11-16T00:00:00"
+    assert archive.find(datetime(2021, 11, 16, 12)) == 1
+
+
+def test_archive_find_replaced(tmp_path):
+    archive = make_archive(tmp_path / "frames.archive")
+
+    # Replacing a frame moves it to the end, and updates its timestamp.
+    archive.append(
+        "frame-0.png", b"new", metadata={"start": datetime(2022, 1, 1).isoformat()}
+    )
+    assert archive.find(datetime(2021, 11, 15)) == 0
+    assert archive.find(datetime(2022, 1, 1)) == 2
+    assert bytes(archive[2]) == b"new"
+
+    # Deleted frames are no longer found, the remaining ones move up.
+    archive.delete("frame-1.png")
+    assert archive.find(datetime(2021, 11, 16)) == 0
+    assert archive.find(datetime(2022, 1, 1)) == 1
+    with pytest.raises(KeyError):
+        archive.find(datetime(2021, 11, 15))
@@ -0,0 +1,75 @@
+import os
+
+from grafanimate.benchmark import benchmark_encode, format_results, sample_frames
+from grafanimate.encoder import EncoderError, EncoderJobManager
+from grafanimate.model import ENCODER_PROFILES
+
+
+def test_format_results():
+    results = [
+        {"method": "screenshot-png", "frames": 10, "bytes_per_frame": 123456},
+        {"method": "canvas-webp", "frames": 10, "bytes_per_frame": 2345},
+    ]
+    assert format_results(results).splitlines() == [
+        "method          frames  bytes_per_frame",
+        "--------------  ------  ---------------",
+        "screenshot-png  10      123456",
+        "canvas-webp     10      2345",
+    ]
+    assert format_results([]) == ""
+
+
+class FakeManager(EncoderJobManager):
+    """
+    Stand-in for running FFmpeg, writing a dummy output file.
+    """
+
+    def run(self, job, timeout=None):
+        if "libaom-av1" in job.command:
+            raise EncoderError("Unknown encoder 'libaom-av1'")
+        with open(job.command[-2], "wb") as f:
+            f.write(b"x" * len(job.command))
+        job.progress.frame = 25
+        return job
+
+
+def test_encoder_profiles():
+    assert ENCODER_PROFILES["default"].arguments() == ["-c:v", "libx264"]
+    assert ENCODER_PROFILES["fast-preview"].arguments() == [
+        "-c:v",
+        "libx264",
+        "-preset",
+        "ultrafast",
+        "-crf",
+        "28",
+    ]
+    assert ENCODER_PROFILES["web-small"].extension == "webm"
+
+
+def test_sample_frames(tmp_path):
+    for number in range(10):
+        (tmp_path / f"frame-{number}.png").write_bytes(b"")
+    (tmp_path / "manifest.jsonl").write_text("")
+    assert [os.path.basename(file) for file in sample_frames(str(tmp_path), 3)] == [
+        "frame-0.png",
+        "frame-3.png",
+        "frame-6.png",
+    ]
+
+
+def test_benchmark_encode(tmp_path):
+    files = [str(tmp_path / "frame.png")]
+    results = benchmark_encode(
+        files,
+        list(ENCODER_PROFILES.values()),
+        str(tmp_path),
+        manager=FakeManager(cpu_budget=2),
+    )
+    assert [result["profile"] for result in results] == list(ENCODER_PROFILES)
+    assert results[0]["frames"] == 25
+    assert results[0]["bytes"] > 0
+    assert (tmp_path / "web-small.webm").exists()
+
+    # Unavailable encoders are reported without results.
+    assert results[-1]["profile"] == "av1"
+    assert results[-1]["bytes"] == "-"
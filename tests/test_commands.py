@@ -0,0 +1,23 @@
+from munch import Munch
+
+from grafanimate.commands import gif_palette_file
+from grafanimate.model import AnimationScenario, RenderingOptions
+
+
+def test_gif_palette_file(tmp_path):
+    scenario = AnimationScenario(
+        grafana_url="http://localhost:3000", dashboard_uid="foo", sequences=[]
+    )
+    options = Munch({"frame-cache-path": str(tmp_path), "window-size": "1920x1080"})
+
+    def palette(version: int = 1, gif_width: int = 480) -> str:
+        return gif_palette_file(
+            scenario, options, RenderingOptions(gif_width=gif_width), version
+        )
+
+    assert palette().startswith(str(tmp_path / "palettes"))
+    assert palette() == palette()
+
+    # Changes to the dashboard invalidate its palette.
+    assert palette(version=2) != palette()
+    assert palette(gif_width=320) != palette()
@@ -0,0 +1,87 @@
+import io
+
+import pytest
+
+from grafanimate.delta import DeltaEncoder
+
+numpy = pytest.importorskip("numpy")
+Image = pytest.importorskip("PIL.Image")
+
+
+def make_frames(count: int = 5) -> list:
+    """
+    Frames with a moving square, and a label changing its color.
+    """
+    frames = []
+    for number in range(count):
+        pixels = numpy.full((40, 60, 3), 200, dtype=numpy.uint8)
+        pixels[5:10, number * 5 : number * 5 + 5] = (255, 0, 0)
+        pixels[30:35, 2:8] = (0, 0, number * 40)
+        buffer = io.BytesIO()
+        Image.fromarray(pixels).save(buffer, format="PNG")
+        frames.append((buffer.getvalue(), pixels))
+    return frames
+
+
+def read_frames(path: str) -> list:
+    image = Image.open(path)
+    frames = []
+    for number in range(image.n_frames):
+        image.seek(number)
+        frames.append((numpy.asarray(image.convert("RGB")), image.info["duration"]))
+    return frames
+
+
+@pytest.mark.parametrize("format", ["gif", "apng"])
+def test_delta_encoder(tmp_path, format):
+    frames = make_frames()
+    steps = [(image, 1) for image, _ in frames]
+    # Unchanged frames extend the duration of the previous one.
+    steps.insert(2, steps[1])
+    target = str(tmp_path / f"animation.{format}")
+    encoder = DeltaEncoder(target, format=format, framerate=4)
+    encoder.encode(steps, palette_stride=1)
+    assert encoder.frames == 5
+
+    decoded = read_frames(target)
+    assert [duration for _, duration in decoded] == [250, 500, 250, 250, 250]
+    for (pixels, _), (_, expected) in zip(decoded, frames):
+        assert numpy.array_equal(pixels, expected)
+
+
+def test_delta_encoder_regions(tmp_path):
+    frames = make_frames()
+    target = str(tmp_path / "animation.gif")
+    DeltaEncoder(target, framerate=4).encode(
+        [(image, 1) for image, _ in frames], palette_stride=1
+    )
+
+    # Only the bounding box of changed pixels is written.
+    image = Image.open(target)
+    image.seek(1)
+    assert image.dispose_extent == (0, 5, 10, 35)
+
+
+def test_delta_encoder_width(tmp_path):
+    target = str(tmp_path / "animation.apng")
+    encoder = DeltaEncoder(target, format="apng", width=30)
+    encoder.encode([(image, 1) for image, _ in make_frames()])
+    assert Image.open(target).size == (30, 20)
+
+
+def test_delta_encoder_palette(tmp_path):
+    palette = tmp_path / "palette.png"
+    colors = numpy.zeros((16, 16, 3), dtype=numpy.uint8)
+    colors.reshape(-1, 3)[:3] = [(200, 200, 200), (255, 0, 0), (0, 0, 0)]
+    Image.fromarray(colors).save(palette)
+
+    encoder = DeltaEncoder(str(tmp_path / "animation.gif"))
+    encoder.load_palette(str(palette))
+    encoder.encode([(image, 1) for image, _ in make_frames(count=1)])
+    pixels, _ = read_frames(str(tmp_path / "animation.gif"))[0]
+    assert pixels[5, 0].tolist() == [255, 0, 0]
+
+
+def test_delta_encoder_unknown_format(tmp_path):
+    with pytest.raises(ValueError, match="Unknown format: webp"):
+        DeltaEncoder(str(tmp_path / "animation.webp"), format="webp")
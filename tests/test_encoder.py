@@ -0,0 +1,88 @@
+import sys
+import threading
+import time
+
+import pytest
+
+from grafanimate.encoder import (
+    EncoderError,
+    EncoderJob,
+    EncoderJobManager,
+    EncoderProgress,
+)
+
+
+def python_job(code: str, **kwargs) -> EncoderJob:
+    return EncoderJob([sys.executable, "-c", code], **kwargs)
+
+
+def test_encoder_progress():
+    progress = EncoderProgress(duration=10)
+    for line in ["frame=50", "fps=N/A", "out_time_us=4000000", "speed=2.0x"]:
+        progress.update(*line.split("="))
+    assert progress.frame == 50
+    assert progress.fps == 0.0
+    assert progress.time == 4.0
+    assert progress.eta == 3.0
+    assert not progress.done
+    progress.update("progress", "end")
+    assert progress.done
+
+
+def test_encoder_job_progress():
+    job = python_job(
+        "print('frame=25'); print('fps=12.5'); print('out_time_us=2000000'); print('progress=end')",
+        name="video.mp4",
+    )
+    EncoderJobManager(cpu_budget=2).run(job)
+    assert job.progress.frame == 25
+    assert job.progress.fps == 12.5
+    assert job.progress.done
+
+
+def test_encoder_job_failure():
+    job = python_job("import sys; print('kaputt', file=sys.stderr); sys.exit(1)")
+    with pytest.raises(EncoderError, match="exit code 1.*\n.*kaputt"):
+        EncoderJobManager().run(job)
+
+
+def test_encoder_job_timeout():
+    job = python_job("import time; time.sleep(10)")
+    with pytest.raises(EncoderError, match="timed out"):
+        EncoderJobManager().run(job, timeout=0.2)
+
+
+def test_encoder_manager_budget():
+    manager = EncoderJobManager(cpu_budget=4)
+    assert manager.threads() == 4
+    assert manager.threads(jobs=3) == 1
+
+    # Jobs using two threads each, only two of them fit into the budget.
+    running = []
+    lock = threading.Lock()
+    original = manager.acquire
+
+    def acquire(threads):
+        threads = original(threads)
+        with lock:
+            running.append(manager.cpu_budget - manager.available)
+        return threads
+
+    manager.acquire = acquire  # type: ignore[method-assign]
+    jobs = [python_job("import time; time.sleep(0.2)", threads=2) for _ in range(4)]
+    started = time.monotonic()
+    manager.run_all(jobs)
+    assert max(running) == 4
+    assert time.monotonic() - started >= 0.4
+    assert manager.available == 4
+
+
+def test_encoder_manager_fail_fast():
+    manager = EncoderJobManager(cpu_budget=2)
+    slow = python_job("import time; time.sleep(10)")
+    failing = python_job("import sys; sys.exit(2)")
+    started = time.monotonic()
+    with pytest.raises(EncoderError, match="exit code 2"):
+        manager.run_all([slow, failing])
+    assert time.monotonic() - started < 5
+    assert manager.available == 2
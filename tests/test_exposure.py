@@ -0,0 +1,79 @@
+import json
+import os
+
+import pytest
+
+from grafanimate.exposure import AdaptiveExposure, percentile
+
+
+def test_percentile():
+    assert percentile([3, 1, 2], 50) == 2
+    assert percentile(range(1, 101), 95) == 95
+    assert percentile([0.7], 99) == 0.7
+    with pytest.raises(ValueError):
+        percentile([], 50)
+
+
+def test_adaptive_exposure_budget():
+    exposure = AdaptiveExposure(
+        key="foo/*", initial=0.5, rank=50, headroom=2, minimum=0.1
+    )
+    assert exposure.budget() == 0.5
+
+    # Fast frames shrink the budget, but not below the minimum.
+    for _ in range(10):
+        exposure.record(0.02)
+    assert exposure.budget() == 0.1
+
+    # Frames not settling within their budget let it grow.
+    for _ in range(20):
+        exposure.record(1.0, settled=False)
+    assert exposure.budget() == 4.0
+
+
+def test_adaptive_exposure_persistence(tmp_path):
+    path = tmp_path / "exposure.json"
+    exposure = AdaptiveExposure.load(key="foo/6", path=path, rank=50, headroom=1)
+    exposure.record(0.3)
+    exposure.record(0.4)
+    exposure.record(0.5)
+    exposure.save()
+
+    exposure = AdaptiveExposure.load(key="foo/6", path=path, rank=50, headroom=1)
+    assert exposure.budget() == 0.4
+
+    exposure = AdaptiveExposure.load(key="bar/*", path=path, initial=0.25)
+    assert exposure.budget() == 0.25
+
+
+def test_adaptive_exposure_concurrent_save(tmp_path):
+    path = tmp_path / "exposure.json"
+    foo = AdaptiveExposure.load(key="foo/6", path=path)
+    bar = AdaptiveExposure.load(key="bar/*", path=path)
+    foo.record(0.3)
+    foo.save()
+    bar.record(0.4)
+    bar.save()
+
+    # Runs for different dashboards retain each other's statistics.
+    assert json.loads(path.read_text()) == {"foo/6": [0.3], "bar/*": [0.4]}
+    assert os.listdir(tmp_path) == ["exposure.json"]
+
+
+def test_adaptive_exposure_interrupted_save(tmp_path, monkeypatch):
+    path = tmp_path / "exposure.json"
+    exposure = AdaptiveExposure.load(key="foo/6", path=path)
+    exposure.record(0.3)
+    exposure.save()
+
+    # An interrupted save leaves the previous statistics intact.
+    def fail(*args, **kwargs):
+        raise KeyboardInterrupt
+
+    monkeypatch.setattr(os, "replace", fail)
+    exposure.record(0.4)
+    with pytest.raises(KeyboardInterrupt):
+        exposure.save()
+    monkeypatch.undo()
+    assert json.loads(path.read_text()) == {"foo/6": [0.3]}
+    assert os.listdir(tmp_path) == ["exposure.json"]
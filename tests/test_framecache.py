@@ -0,0 +1,50 @@
+from datetime import datetime, timedelta, timezone
+
+from grafanimate.framecache import (
+    FrameCache,
+    frame_cache_key,
+    is_historical,
+    palette_file,
+)
+
+
+def test_frame_cache_key():
+    start = datetime(2021, 11, 14)
+    stop = start + timedelta(days=1)
+    assert frame_cache_key("a", start, stop) == frame_cache_key("a", start, stop)
+    assert frame_cache_key("a", start, stop) != frame_cache_key("b", start, stop)
+    assert frame_cache_key("a", start, stop) != frame_cache_key("a", start, start)
+
+
+def test_is_historical():
+    now = datetime(2021, 11, 14, tzinfo=timezone.utc)
+    assert is_historical(datetime(2021, 11, 13, tzinfo=timezone.utc), now=now)
+    assert not is_historical(datetime(2021, 11, 15, tzinfo=timezone.utc), now=now)
+    assert is_historical(datetime(2021, 11, 13), now=now)
+
+
+def test_frame_cache_lru(tmp_path):
+    cache = FrameCache(path=tmp_path, max_bytes=250)
+    cache.put("a", b"a" * 100)
+    cache.put("b", b"b" * 100)
+    assert cache.get("a") == b"a" * 100
+    cache.put("c", b"c" * 100)
+
+    # "b" was least recently used.
+    assert cache.get("b") is None
+    assert cache.size == 200
+    assert cache.hits == 1
+    assert cache.misses == 1
+
+    # The cache inventory is persisted.
+    assert sorted(FrameCache(path=tmp_path).entries) == ["a", "c"]
+
+    # Oversized frames are not cached.
+    cache.put("d", b"d" * 300)
+    assert cache.get("d") is None
+
+
+def test_palette_file(tmp_path):
+    path = palette_file("abc", path=tmp_path / "frames")
+    assert path == tmp_path / "frames" / "palettes" / "abc.png"
+    assert path.parent.is_dir()
@@ -0,0 +1,45 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from grafanimate.incremental import AppendState
+from grafanimate.model import AnimationScenario, AnimationSequence
+
+
+def make_scenario(stop: datetime) -> AnimationScenario:
+    sequence = AnimationSequence(start=stop - timedelta(days=3), stop=stop, every="1d")
+    sequence.index = 0  # type: ignore[assignment]
+    return AnimationScenario(sequences=[sequence])
+
+
+def test_append_state(tmp_path):
+    target = str(tmp_path / "video.mp4")
+    stop = datetime(2021, 11, 14, tzinfo=timezone.utc)
+
+    # Without previous video, all frames are rendered.
+    assert AppendState.load(target, "abc") is None
+
+    # Record the last frame of the first run.
+    state = AppendState.create(target, "abc")
+    state.update(make_scenario(stop))
+    state.save()
+    (tmp_path / "video.mp4").write_bytes(b"")
+
+    # The next run, one day later, only needs to capture the new frame.
+    state = AppendState.load(target, "abc")
+    frames = list(make_scenario(stop + timedelta(days=1)).sequences[0].get_frames())
+    assert [state.is_covered(frame) for frame in frames] == [True, True, True, False]
+
+    # Changed settings require rendering all frames.
+    assert AppendState.load(target, "def") is None
+
+
+def test_append_state_multiple_sequences():
+    stop = datetime(2021, 11, 14, tzinfo=timezone.utc)
+    AppendState.check(make_scenario(stop))
+
+    # New frames of the first sequence can not be appended after the second one.
+    scenario = make_scenario(stop)
+    scenario.sequences.append(make_scenario(stop).sequences[0])
+    with pytest.raises(ValueError, match="multiple sequences"):
+        AppendState.check(scenario)
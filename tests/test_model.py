@@ -7,7 +7,13 @@ from dateutil.rrule import DAILY, MINUTELY
 from dateutil.tz import tzutc
 from freezegun import freeze_time
 
-from grafanimate.model import AnimationScenario, AnimationSequence, SequencingMode
+from grafanimate.model import (
+    AnimationScenario,
+    AnimationSequence,
+    FrameRecord,
+    Rendition,
+    SequencingMode,
+)
 from grafanimate.timeutil import RecurrenceInfo
 
 
@@ -251,3 +257,44 @@ def test_scenario_basic():
     )
 
     assert len(scenario.sequences) == 2
+
+
+def test_frame_record():
+    seq = AnimationSequence(
+        start=datetime(2021, 11, 14, 2, 0, 0),
+        stop=datetime(2021, 11, 14, 2, 16, 36),
+        every="5min",
+    )
+    frame = next(seq.get_frames())
+    image = b"\x89PNG" + b"\x00" * 1000
+    record = FrameRecord(frame=frame, image=image, dashboard="foo")
+
+    # The image is referenced, not copied.
+    assert isinstance(record.image, memoryview)
+    assert record.image.obj is image
+    assert record.size == 1004
+    assert record.start == datetime(2021, 11, 14, 2, 0, 0)
+
+    # The representation does not include the image.
+    assert "PNG" not in repr(record)
+    assert "size=1004" in repr(record)
+
+    # Records are slotted.
+    with pytest.raises(AttributeError):
+        record.foo = "bar"
+
+
+def test_rendition():
+    assert Rendition.parse("720p") == Rendition(format="mp4", size=720)
+    assert Rendition.parse(" 320PX") == Rendition(format="gif", size=320)
+    assert Rendition.parse("720p").filename("var/video.mp4") == "var/video.720p.mp4"
+    assert (
+        Rendition.parse("720p").filename("var/video.webm", video_extension="webm")
+        == "var/video.720p.webm"
+    )
+    assert (
+        Rendition.parse("320px").filename("var/video.webm", video_extension="webm")
+        == "var/video.320px.gif"
+    )
+    with pytest.raises(ValueError, match="Invalid rendition: 720x"):
+        Rendition.parse("720x")
@@ -0,0 +1,73 @@
+import io
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import pytest
+
+from grafanimate.model import AnimationFrame, FrameRecord
+from grafanimate.pipeline import FramePipeline
+from grafanimate.timeutil import Timerange
+
+Image = pytest.importorskip("PIL.Image")
+ImageDraw = pytest.importorskip("PIL.ImageDraw")
+
+
+def make_png(lines: int = 50) -> bytes:
+    picture = Image.new("RGBA", (400, 300), "white")
+    draw = ImageDraw.Draw(picture)
+    for number in range(lines):
+        draw.line((0, number * 5, 400, 300 - number * 3), fill=(number * 5, 100, 200))
+    buffer = io.BytesIO()
+    picture.save(buffer, format="PNG", compress_level=1)
+    return buffer.getvalue()
+
+
+def pixels(image: bytes) -> bytes:
+    return Image.open(io.BytesIO(image)).convert("RGBA").tobytes()
+
+
+def test_optimize_png():
+    from grafanimate.imaging import optimize_png
+
+    image = make_png()
+    optimized = optimize_png(image)
+    assert len(optimized) < len(image)
+    assert pixels(optimized) == pixels(image)
+    assert Image.open(io.BytesIO(optimized)).mode == "P"
+
+    # Without palette conversion, the image is only recompressed.
+    optimized = optimize_png(image, palette=False)
+    assert pixels(optimized) == pixels(image)
+    assert Image.open(io.BytesIO(optimized)).mode == "RGB"
+
+
+def test_png_optimizer():
+    from grafanimate.optimizer import PngOptimizer
+
+    start = datetime(2021, 11, 14)
+    frame = AnimationFrame(
+        sequence=SimpleNamespace(index=0),
+        timerange=Timerange(
+            start=start, stop=start + timedelta(days=1), recurrence=None
+        ),
+    )
+    images = [make_png(lines) for lines in range(10, 50, 5)]
+    records = [FrameRecord(frame=frame, image=image) for image in images]
+    records.append(FrameRecord(frame=frame, image=b"jpeg", format="jpeg"))
+
+    optimizer = PngOptimizer(workers=2).start()
+    try:
+        with FramePipeline(stages=optimizer.stages) as pipeline:
+            for record in records:
+                pipeline.submit(record)
+    finally:
+        optimizer.stop()
+
+    # Frames keep their order, and are optimized losslessly.
+    results = pipeline.results
+    assert [pixels(result.image) for result in results[:-1]] == [
+        pixels(image) for image in images
+    ]
+    assert results[-1].image == b"jpeg"
+    assert optimizer.frames == len(images)
+    assert optimizer.bytes_after < optimizer.bytes_before
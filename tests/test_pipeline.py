@@ -0,0 +1,45 @@
+import gc
+import weakref
+
+import pytest
+
+from grafanimate.pipeline import FramePipeline
+
+
+def test_pipeline_stages():
+    with FramePipeline(
+        stages=[lambda x: x * 2, lambda x: x + 1], maxsize=2
+    ) as pipeline:
+        for number in range(10):
+            pipeline.submit(number)
+    assert pipeline.results == [number * 2 + 1 for number in range(10)]
+
+
+def test_pipeline_error():
+    def stage(item):
+        if item == 3:
+            raise ValueError("Failed on purpose")
+        return item
+
+    pipeline = FramePipeline(stages=[stage], maxsize=1).start()
+    with pytest.raises(ValueError, match="Failed on purpose"):
+        for number in range(100):
+            pipeline.submit(number)
+        pipeline.close()
+
+
+class Image:
+    pass
+
+
+def test_pipeline_no_collect():
+    images = [Image() for _ in range(10)]
+    references = [weakref.ref(image) for image in images]
+    with FramePipeline(stages=[lambda x: x], collect=False) as pipeline:
+        while images:
+            pipeline.submit(images.pop())
+    assert pipeline.results == []
+
+    # Items are released after passing the last stage.
+    gc.collect()
+    assert all(reference() is None for reference in references)
@@ -0,0 +1,458 @@
+import io
+import logging
+import os
+import sys
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import pytest
+
+from grafanimate.encoder import EncoderJobManager
+from grafanimate.model import (
+    ENCODER_PROFILES,
+    AnimationFrame,
+    FrameRecord,
+    RenderingOptions,
+    Rendition,
+)
+from grafanimate.postprocessing import MediaProducer, StreamingEncoder
+from grafanimate.spool import TemporaryStorage
+from grafanimate.spoolbackend import make_spool_backend
+from grafanimate.timeutil import Timerange
+
+
+class CopyingEncoder(StreamingEncoder):
+    """
+    Stand-in for FFmpeg, copying the stream of frames into the target file.
+    """
+
+    def command(self):
+        return [
+            sys.executable,
+            "-c",
+            "import shutil, sys; shutil.copyfileobj(sys.stdin.buffer, open(sys.argv[1], 'wb'))",
+            self.target,
+        ]
+
+
+class FailingEncoder(StreamingEncoder):
+    def command(self):
+        return [
+            sys.executable,
+            "-c",
+            "import sys; print('kaputt', file=sys.stderr); sys.exit(1)",
+        ]
+
+
+def test_streaming_encoder(tmp_path):
+    target = str(tmp_path / "video.mp4")
+    encoder = CopyingEncoder(target=target, options=RenderingOptions()).start()
+    for image in [b"a", b"b", b"c"]:
+        encoder.write_item(FrameRecord(frame=None, image=image))
+    encoder.write_item(FrameRecord(frame=None, skipped=True))
+    encoder.close()
+    assert encoder.frames == 3
+    assert (tmp_path / "video.mp4").read_bytes() == b"abc"
+
+
+def test_streaming_encoder_failure(tmp_path):
+    encoder = FailingEncoder(
+        target=str(tmp_path / "video.mp4"), options=RenderingOptions()
+    )
+    encoder.start()
+    with pytest.raises(RuntimeError, match="kaputt"):
+        encoder.close()
+
+
+def test_streaming_encoder_command():
+    encoder = StreamingEncoder(
+        target="video.mp4", options=RenderingOptions(video_framerate=4)
+    )
+    command = encoder.command()
+    assert command[:7] == ["ffmpeg", "-f", "image2pipe", "-framerate", "4", "-i", "-"]
+
+
+def test_media_outputs():
+    producer = MediaProducer(
+        options=RenderingOptions(
+            renditions=[Rendition.parse("720p"), Rendition.parse("320px")]
+        )
+    )
+    outputs = producer.outputs("var/video.mp4")
+    assert [output.path for output in outputs] == [
+        "var/video.mp4",
+        "var/video.gif",
+        "var/video.720p.mp4",
+        "var/video.320px.gif",
+    ]
+    assert outputs[2].filter.startswith("scale=-2:720:flags=lanczos,pad=")
+    assert "scale=320:-1" in outputs[3].filter
+
+    # Video renditions use the container of the encoder profile.
+    producer = MediaProducer(
+        options=RenderingOptions(
+            renditions=[Rendition.parse("720p")],
+            profile=ENCODER_PROFILES["web-small"],
+        )
+    )
+    outputs = producer.outputs("var/video.webm")
+    assert [output.path for output in outputs] == [
+        "var/video.webm",
+        "var/video.gif",
+        "var/video.720p.webm",
+    ]
+
+
+def test_filter_graph():
+    producer = MediaProducer(options=RenderingOptions(gif_width=200))
+    arguments = producer.output_arguments(producer.outputs("video.mp4"))
+    graph = arguments[1]
+
+    # The frames are decoded once, and split into one branch per output.
+    assert graph.startswith("[0:v]split=2[in0][in1];[in0]pad=")
+    assert "[in1]fps=10,scale=200:-1:flags=lanczos,split[gifa][gifb];" in graph
+    assert graph.endswith("[gifb][gifp]paletteuse[out1]")
+    assert arguments[2:] == [
+        "-map",
+        "[out0]",
+        "-c:v",
+        "libx264",
+        "video.mp4",
+        "-map",
+        "[out1]",
+        "video.gif",
+        "-y",
+    ]
+
+    # A single output needs no split.
+    outputs = producer.outputs("video.mp4")[:1]
+    assert MediaProducer.filter_graph(outputs).startswith("[0:v]pad=")
+
+
+class RecordingManager(EncoderJobManager):
+    """
+    Stand-in for running FFmpeg, recording the commands of encoder jobs.
+    """
+
+    def __init__(self):
+        super().__init__(cpu_budget=4)
+        self.commands = []
+
+    def run(self, job, timeout=None):
+        self.commands.append(job.command)
+        with open(job.command[-2], "wb"):
+            pass
+        return job
+
+    def run_all(self, jobs, timeout=None):
+        self.commands += [job.command for job in jobs]
+        return jobs
+
+
+def test_split_steps():
+    producer = MediaProducer(
+        options=RenderingOptions(video_framerate=2, chunk_seconds=2)
+    )
+    timeline = [
+        SimpleNamespace(file="a.png", count=3),
+        SimpleNamespace(file="b.png", count=2),
+        SimpleNamespace(file="c.png", count=4),
+    ]
+    assert producer.split_steps(None, timeline) == [
+        [("a.png", 3), ("b.png", 1)],
+        [("b.png", 1), ("c.png", 3)],
+        [("c.png", 1)],
+    ]
+
+
+def test_encode_chunked(tmp_path):
+    for number in range(5):
+        (tmp_path / f"frame-{number}.png").write_bytes(b"")
+    manager = RecordingManager()
+    producer = MediaProducer(
+        options=RenderingOptions(video_framerate=2, chunk_seconds=1), manager=manager
+    )
+    target = str(tmp_path / "video.mp4")
+    producer.encode(str(tmp_path / "*.png"), producer.outputs(target))
+
+    # Three chunks of the video, one job for the GIF, and joining the chunks.
+    chunks, gif, concat = manager.commands[:3], manager.commands[3], manager.commands[4]
+    assert len(manager.commands) == 5
+    for command in chunks:
+        assert command[command.index("-g") + 1] == "25"
+        assert command[command.index("-threads") + 1] == "1"
+        assert command[-2].endswith(".mp4")
+    assert gif[-2] == str(tmp_path / "video.gif")
+    assert concat[concat.index("-c") + 1] == "copy"
+    assert concat[-2] == target
+
+    # Chunks are removed after joining them.
+    assert not [name for name in os.listdir(tmp_path) if name.startswith(".chunks-")]
+
+
+def test_filter_graph_palette():
+    producer = MediaProducer(
+        options=RenderingOptions(renditions=[Rendition.parse("320px")]),
+        palette="palette.png",
+    )
+    outputs = producer.outputs("video.mp4")
+    assert producer.palette_arguments(outputs) == ["-i", "palette.png"]
+    assert producer.palette_arguments(outputs[:1]) == []
+
+    # The palette file is split up for both GIF outputs, no palette is generated.
+    graph = producer.filter_graph(outputs)
+    assert graph.startswith("[1:v]split=2[gifp][gif320p];[0:v]split=3")
+    assert "[gifs][gifp]paletteuse[out1]" in graph
+    assert "palettegen" not in graph
+
+
+def test_palette(tmp_path, caplog):
+    for number in range(25):
+        (tmp_path / f"frame-{number:02d}.png").write_bytes(b"")
+    manager = RecordingManager()
+    producer = MediaProducer(
+        options=RenderingOptions(palette_stride=10), manager=manager
+    )
+    palette = str(tmp_path / "cache" / "palette.png")
+    with caplog.at_level(logging.INFO):
+        producer.prepare_palette(str(tmp_path / "*.png"), None, palette)
+    assert producer.palette == palette
+    assert os.path.exists(palette)
+    assert os.listdir(tmp_path / "cache") == ["palette.png"]
+
+    # The palette is generated from every 10th frame.
+    assert "Generating GIF palette from 3 of 25 frames" in caplog.messages
+    command = manager.commands[0]
+    assert "palettegen=stats_mode=full" in command[command.index("-vf") + 1]
+
+    # Subsequent renders reuse the palette.
+    producer = MediaProducer(options=RenderingOptions(), manager=manager)
+    producer.prepare_palette(str(tmp_path / "*.png"), None, palette)
+    assert producer.palette == palette
+    assert len(manager.commands) == 1
+
+
+class SampleRecordingManager(RecordingManager):
+    """
+    Also record the images of the palette sample, before they are removed.
+    """
+
+    def run(self, job, timeout=None):
+        command = job.command
+        with open(command[command.index("-i") + 1]) as f:
+            lines = f.read().splitlines()
+        # The last entry is repeated, to respect its duration.
+        files = [line[6:-1] for line in lines if line.startswith("file")][:-1]
+        self.samples = []
+        for file in files:
+            with open(file, "rb") as f:
+                self.samples.append(f.read())
+        return super().run(job, timeout=timeout)
+
+
+def spool_frames(storage: TemporaryStorage, images: list[bytes]):
+    for number, image in enumerate(images):
+        start = datetime(2021, 11, 14) + timedelta(days=number)
+        frame = AnimationFrame(
+            sequence=SimpleNamespace(index=0),
+            timerange=Timerange(
+                start=start, stop=start + timedelta(days=1), recurrence=None
+            ),
+        )
+        storage.save_item(FrameRecord(frame=frame, image=image, dashboard="foo"))
+
+
+@pytest.mark.parametrize("backend", ["memory", "archive"])
+def test_palette_frames(tmp_path, backend):
+    spool = make_spool_backend(
+        backend, path=str(tmp_path / "spool") if backend == "archive" else None
+    )
+    storage = TemporaryStorage(dedup=True, backend=spool)
+    spool_frames(storage, [b"a", b"a", b"b", b"c"])
+    assert storage.has_duplicates
+
+    # Frames not stored as files are sampled from the piped frames.
+    manager = SampleRecordingManager()
+    producer = MediaProducer(
+        options=RenderingOptions(palette_stride=2), manager=manager
+    )
+    palette = str(tmp_path / "palette.png")
+    source = os.path.join(storage.workdir, "*.png") if storage.workdir else None
+    producer.prepare_palette(
+        source, storage.timeline, palette, frames=list(storage.iter_images())
+    )
+    assert producer.palette == palette
+    assert manager.samples == [b"a", b"c"]
+    # Sampled frames are written to a temporary directory, which is removed.
+    assert sorted(os.listdir(tmp_path)) == ["palette.png"] + (
+        ["spool"] if backend == "archive" else []
+    )
+
+
+def test_render_delta(tmp_path):
+    Image = pytest.importorskip("PIL.Image")
+    for number in range(3):
+        Image.new("RGB", (40, 20), (number * 100, 0, 0)).save(
+            tmp_path / f"frame-{number}.png"
+        )
+    manager = RecordingManager()
+    producer = MediaProducer(
+        options=RenderingOptions(
+            gif_encoder="delta", gif_width=20, palette_stride=1, apng=True
+        ),
+        manager=manager,
+    )
+    target = str(tmp_path / "video.mp4")
+    paths = producer.render(str(tmp_path / "*.png"), target)
+    assert paths == [target, str(tmp_path / "video.gif"), str(tmp_path / "video.apng")]
+
+    # FFmpeg only encodes the video, the other outputs are delta-encoded.
+    assert len(manager.commands) == 1
+    assert manager.commands[0][-2] == target
+    for path in paths[1:]:
+        image = Image.open(path)
+        assert image.n_frames == 3
+        assert image.size == (20, 10)
+
+
+@pytest.mark.parametrize("backend", ["memory", "archive"])
+def test_render_delta_frames(tmp_path, backend):
+    Image = pytest.importorskip("PIL.Image")
+    images = []
+    for color in [(255, 0, 0), (255, 0, 0), (0, 255, 0), (0, 0, 255)]:
+        buffer = io.BytesIO()
+        Image.new("RGB", (40, 20), color).save(buffer, format="PNG")
+        images.append(buffer.getvalue())
+    spool = make_spool_backend(
+        backend, path=str(tmp_path / "spool") if backend == "archive" else None
+    )
+    storage = TemporaryStorage(dedup=True, backend=spool)
+    spool_frames(storage, images)
+
+    # Piped frames are delta-encoded, displaying duplicates for their steps.
+    producer = MediaProducer(
+        options=RenderingOptions(
+            gif_encoder="delta",
+            gif_width=20,
+            video_framerate=2,
+            palette_stride=1,
+            apng=True,
+        ),
+        manager=RecordingManager(),
+    )
+    deltas = producer.outputs(str(tmp_path / "video.mp4"))[1:]
+    producer.encode_delta(
+        None, deltas, timeline=storage.timeline, frames=storage.iter_images()
+    )
+    for output in deltas:
+        image = Image.open(output.path)
+        assert image.n_frames == 3
+        assert image.info["duration"] == 1000
+
+
+def test_hls_output():
+    producer = MediaProducer(
+        options=RenderingOptions(
+            hls_seconds=4, profile=ENCODER_PROFILES["fast-preview"]
+        )
+    )
+    output = producer.hls_output("var/video.mp4")
+    assert output.path == "var/video.m3u8"
+    arguments = output.arguments
+    assert arguments[:4] == ["-c:v", "libx264", "-preset", "ultrafast"]
+    # Each segment starts with a keyframe.
+    assert arguments[arguments.index("-g") + 1] == "100"
+    assert arguments[arguments.index("-hls_time") + 1] == "4"
+    assert arguments[arguments.index("-hls_playlist_type") + 1] == "event"
+    assert arguments[-1] == "var/video-%05d.ts"
+
+    # Codecs not supported by HLS players fall back to H.264.
+    producer = MediaProducer(
+        options=RenderingOptions(profile=ENCODER_PROFILES["web-small"])
+    )
+    assert producer.hls_output("video.webm").arguments[:2] == ["-c:v", "libx264"]
+
+
+def test_streaming_encoder_release(tmp_path):
+    encoder = CopyingEncoder(
+        target=str(tmp_path / "video.m3u8"), options=RenderingOptions()
+    ).start()
+    encoder.release = True
+    item = encoder.write_item(FrameRecord(frame=None, image=b"a"))
+    encoder.close()
+    assert item.image is None
+    assert (tmp_path / "video.m3u8").read_bytes() == b"a"
+
+
+class ConcatRecordingManager(RecordingManager):
+    """
+    Also record the concat files read by the encoder jobs, before they are removed.
+    """
+
+    def run_all(self, jobs, timeout=None):
+        self.concats = []
+        for job in jobs:
+            command = job.command
+            with open(command[command.index("-i") + 1]) as f:
+                self.concats.append(f.read().splitlines())
+        return super().run_all(jobs, timeout=timeout)
+
+
+def concat_duration(lines: list[str]) -> float:
+    return sum(float(line.split()[1]) for line in lines if line.startswith("duration"))
+
+
+def test_encode_chunked_duration(tmp_path):
+    timeline = [
+        SimpleNamespace(file=str(tmp_path / "a.png"), count=3),
+        SimpleNamespace(file=str(tmp_path / "b.png"), count=2),
+        SimpleNamespace(file=str(tmp_path / "c.png"), count=4),
+    ]
+    manager = ConcatRecordingManager()
+    options = RenderingOptions(video_framerate=2, chunk_seconds=2)
+    producer = MediaProducer(options=options, manager=manager)
+    target = str(tmp_path / "video.mp4")
+    producer.encode(None, producer.outputs(target)[:1], timeline=timeline)
+
+    # All chunks but the last one are trimmed to their duration, cutting off
+    # the repeated last image of their concat file.
+    chunks = manager.commands[:-1]
+    trims = [command[command.index("-t") + 1] for command in chunks[:-1]]
+    assert trims == ["2", "2"]
+    assert "-t" not in chunks[-1]
+    assert [concat_duration(lines) for lines in manager.concats] == [2.0, 2.0, 0.5]
+
+    # Step counts and durations add up to the ones of single-pass encoding, which
+    # also ends with the repeated last image.
+    single = producer.write_concat(timeline, str(tmp_path / "single.ffconcat"))
+    with open(single) as f:
+        lines = f.read().splitlines()
+    assert concat_duration(lines) == sum(map(concat_duration, manager.concats))
+    assert sum(
+        count for chunk in producer.split_steps(None, timeline) for _, count in chunk
+    ) == sum(frame.count for frame in timeline)
+    assert lines[-1] == manager.concats[-1][-1]
+
+
+def test_append_video_webm(tmp_path):
+    target = tmp_path / "video.webm"
+    tail = tmp_path / "video.tail.webm"
+    target.write_bytes(b"")
+    tail.write_bytes(b"")
+    manager = RecordingManager()
+    producer = MediaProducer(
+        options=RenderingOptions(profile=ENCODER_PROFILES["web-small"]),
+        manager=manager,
+    )
+    producer.append_video(str(tail), str(target))
+
+    # The videos are joined into a WebM container, without MP4 muxer options.
+    command = manager.commands[0]
+    assert command[-2] == str(tmp_path / "video.joined.webm")
+    assert "-movflags" not in command
+    assert os.listdir(tmp_path) == ["video.webm"]
+
+    # MP4 videos get their index moved to the front.
+    producer.concat_videos([str(target)], str(tmp_path / "video.mp4"))
+    command = manager.commands[1]
+    assert command[command.index("-movflags") + 1] == "+faststart"
@@ -0,0 +1,178 @@
+import json
+import threading
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from grafanimate.proxy import CachedResponse, CachingProxy, QueryCache, cache_key
+
+
+@pytest.fixture
+def upstream():
+    """
+    Minimal stand-in for Grafana, counting the requests it receives.
+    """
+    requests = []
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers["Content-Length"]))
+            requests.append((self.path, self.headers["Origin"], body))
+            payload = json.dumps({"results": {"A": {"frames": len(requests)}}}).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Set-Cookie", f"grafana_session={len(requests)}")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(("localhost", 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://localhost:{server.server_address[1]}/grafana", requests
+    server.shutdown()
+    server.server_close()
+
+
+def post(url, data, origin, headers=None, response_headers=None):
+    request = urllib.request.Request(  # noqa: S310
+        url,
+        data=json.dumps(data).encode(),
+        headers={
+            "Content-Type": "application/json",
+            "Origin": origin,
+            **(headers or {}),
+        },
+        method="POST",
+    )
+    with urllib.request.urlopen(request) as response:  # noqa: S310
+        if response_headers is not None:
+            response_headers.update(response.headers)
+        return json.loads(response.read())
+
+
+def test_cache_key_normalization():
+    body1 = json.dumps(
+        {"from": "1", "to": "2", "queries": [{"refId": "A", "requestId": "Q1"}]}
+    )
+    body2 = json.dumps(
+        {"queries": [{"requestId": "Q2", "refId": "A"}], "to": "2", "from": "1"}
+    )
+    body3 = json.dumps({"queries": [{"refId": "A"}], "to": "3", "from": "1"})
+    path = "/api/ds/query?ds_type=influxdb"
+    assert cache_key("POST", path, body1.encode()) == cache_key(
+        "POST", path, body2.encode()
+    )
+    assert cache_key("POST", path, body1.encode()) != cache_key(
+        "POST", path, body3.encode()
+    )
+
+
+def test_cache_key_identity():
+    body = b'{"queries": [{"refId": "A"}]}'
+    path = "/api/ds/query"
+    keys = {
+        cache_key("POST", path, body, headers)
+        for headers in [
+            None,
+            {"X-Grafana-Org-Id": "2"},
+            {"Authorization": "Basic YWRtaW46YWRtaW4="},
+            {"Authorization": "Basic YWRtaW46YWRtaW4=", "X-Grafana-Org-Id": "2"},
+        ]
+    }
+    assert len(keys) == 4
+
+    # Session cookies are rotated by Grafana, they must not invalidate the cache.
+    assert cache_key(
+        "POST", path, body, {"Cookie": "grafana_session=a", "X-Grafana-Org-Id": "2"}
+    ) == cache_key(
+        "POST", path, body, {"Cookie": "grafana_session=b", "X-Grafana-Org-Id": "2"}
+    )
+
+
+def test_query_cache_session_headers(tmp_path):
+    cache = QueryCache(path=tmp_path)
+    cache.put(
+        "a",
+        CachedResponse(
+            status=200,
+            headers=[
+                ("Content-Type", "text/plain"),
+                ("Set-Cookie", "grafana_session=a"),
+            ],
+            body=b"",
+        ),
+    )
+    assert cache.get("a").headers == [("Content-Type", "text/plain")]
+
+
+def test_query_cache_lru(tmp_path):
+    response = CachedResponse(
+        status=200, headers=[("Content-Type", "text/plain")], body=b"x" * 100
+    )
+
+    # Make room for two entries.
+    probe = QueryCache(path=tmp_path / "probe")
+    probe.put("probe", response)
+    cache = QueryCache(path=tmp_path / "cache", max_bytes=int(probe.size * 2.5))
+
+    cache.put("a", response)
+    cache.put("b", response)
+    assert cache.get("a") is not None
+    cache.put("c", response)
+
+    # "b" was least recently used.
+    assert cache.get("b") is None
+    assert cache.get("a").body == b"x" * 100
+    assert cache.size <= cache.max_bytes
+
+    # The cache inventory is persisted.
+    assert sorted(QueryCache(path=tmp_path / "cache").entries) == ["a", "c"]
+
+
+def test_query_cache_ttl(tmp_path):
+    cache = QueryCache(path=tmp_path, ttl=-1)
+    cache.put("a", CachedResponse(status=200, headers=[], body=b""))
+    assert cache.get("a") is None
+
+
+def test_caching_proxy(upstream, tmp_path):
+    upstream_url, requests = upstream
+    proxy = CachingProxy(upstream=upstream_url, cache=QueryCache(path=tmp_path)).start()
+    try:
+        url = proxy.url_for(upstream_url) + "/api/ds/query"
+        origin = f"http://localhost:{proxy.port}"
+        query = {"from": "1637", "to": "1638", "queries": [{"refId": "A"}]}
+
+        assert post(url, {**query, "requestId": "1"}, origin) == {
+            "results": {"A": {"frames": 1}}
+        }
+        assert post(url, {**query, "requestId": "2"}, origin) == {
+            "results": {"A": {"frames": 1}}
+        }
+        assert post(url, {**query, "to": "1639"}, origin) == {
+            "results": {"A": {"frames": 2}}
+        }
+
+        # Only two requests reached upstream, with the origin rewritten.
+        assert len(requests) == 2
+        assert requests[0][0] == "/grafana/api/ds/query"
+        assert requests[0][1] == upstream_url.replace("/grafana", "")
+        assert proxy.cache.hits == 1
+
+        # Cached responses don't replay the session cookie of another response.
+        headers = {}
+        post(url, {**query, "to": "1639"}, origin, response_headers=headers)
+        assert "Set-Cookie" not in headers
+        assert proxy.cache.hits == 2
+
+        # Responses are not shared between organizations.
+        result = post(url, query, origin, headers={"X-Grafana-Org-Id": "2"})
+        assert result == {"results": {"A": {"frames": 3}}}
+        assert len(requests) == 3
+    finally:
+        proxy.stop()
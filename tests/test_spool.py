@@ -0,0 +1,176 @@
+import io
+from datetime import datetime, timedelta
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+
+from grafanimate.framecache import FrameCache
+from grafanimate.imaging import image_digest, read_region
+from grafanimate.model import AnimationFrame, FrameRecord, RenderingOptions
+from grafanimate.postprocessing import MediaProducer
+from grafanimate.spool import TemporaryStorage
+from grafanimate.spoolbackend import MemorySpool
+from grafanimate.timeutil import Timerange
+
+
+def make_item(number: int, image: bytes):
+    start = datetime(2021, 11, 14) + timedelta(days=number)
+    stop = start + timedelta(hours=23, minutes=59, seconds=59)
+    sequence = SimpleNamespace(index=0)
+    frame = AnimationFrame(
+        sequence=sequence, timerange=Timerange(start=start, stop=stop, recurrence=None)
+    )
+    return FrameRecord(frame=frame, image=image, dashboard="foo")
+
+
+def test_storage_resume_damaged(tmp_path, caplog):
+    spool = str(tmp_path / "spool")
+    storage = TemporaryStorage(workdir=spool, settings={"zoom": 1})
+    files = [
+        storage.save_item(make_item(number, image))
+        for number, image in enumerate([b"a", b"b", b"c"])
+    ]
+    del storage
+
+    # One frame file gets truncated, another one replaced.
+    Path(files[1]).write_bytes(b"")
+    Path(files[2]).write_bytes(b"x")
+
+    # Only the intact frame is reused, the others will be captured again.
+    storage = TemporaryStorage(workdir=spool, settings={"zoom": 1}, resume=True)
+    items = [make_item(number, b"") for number in range(3)]
+    assert [storage.has_frame(item.frame) for item in items] == [True, False, False]
+    assert "Ignoring 2 frames with truncated or modified image files" in caplog.text
+
+
+def test_storage_dedup(tmp_path):
+    storage = TemporaryStorage(dedup=True)
+    images = [b"a", b"a", b"a", b"b", b"c", b"c"]
+    for number, image in enumerate(images):
+        storage.save_item(make_item(number, image))
+
+    assert [frame.count for frame in storage.timeline] == [3, 1, 2]
+    assert storage.has_duplicates
+    assert len(list(Path(storage.workdir).glob("*.png"))) == 3
+
+    # The concat file displays each image for as many steps as it has been captured.
+    producer = MediaProducer(options=RenderingOptions(video_framerate=2))
+    concat = producer.write_concat(storage.timeline, str(tmp_path / "frames.ffconcat"))
+    lines = Path(concat).read_text().splitlines()
+    assert lines[0] == "ffconcat version 1.0"
+    assert [line for line in lines if line.startswith("duration")] == [
+        "duration 1.5",
+        "duration 0.5",
+        "duration 1.0",
+    ]
+    assert lines[-1] == lines[-3]
+
+
+def test_storage_no_dedup():
+    storage = TemporaryStorage()
+    for number, image in enumerate([b"a", b"a"]):
+        storage.save_item(make_item(number, image))
+    assert [frame.count for frame in storage.timeline] == [1, 1]
+    assert not storage.has_duplicates
+
+
+def test_storage_memory_backend():
+    storage = TemporaryStorage(dedup=True, backend=MemorySpool())
+    for number, image in enumerate([b"a", b"a", b"b"]):
+        storage.save_item(make_item(number, image))
+    assert storage.workdir is None
+    assert list(storage.iter_images()) == [b"a", b"a", b"b"]
+    assert storage.backend.stats.writes == 2
+
+
+def test_storage_resume(tmp_path):
+    spool = str(tmp_path / "spool")
+    images = [b"a", b"a", b"b", b"c"]
+
+    # First run gets interrupted after three frames.
+    storage = TemporaryStorage(dedup=True, workdir=spool, settings={"zoom": 1})
+    for number, image in enumerate(images[:3]):
+        storage.save_item(make_item(number, image))
+    del storage
+    assert len(list(Path(spool).glob("*.png"))) == 2
+
+    # Second run skips frames already captured.
+    storage = TemporaryStorage(
+        dedup=True, workdir=spool, settings={"zoom": 1}, resume=True
+    )
+    items = [make_item(number, image) for number, image in enumerate(images)]
+    assert [storage.has_frame(item.frame) for item in items] == [
+        True,
+        True,
+        True,
+        False,
+    ]
+    for item in items:
+        if storage.has_frame(item.frame):
+            item.skipped = True
+            item.set_image(None)
+        storage.save_item(item)
+    assert [frame.count for frame in storage.timeline] == [2, 1, 1]
+    assert storage.needs_timeline
+
+    # When handing frames over to a live encoder, frames of the previous run
+    # are read back from the spool.
+    storage = TemporaryStorage(workdir=spool, settings={"zoom": 1}, resume=True)
+    item = make_item(1, b"")
+    item.skipped = True
+    item.set_image(None)
+    assert bytes(storage.spool_item(item).image) == b"a"
+
+    # Frames captured using different settings are not reused.
+    storage = TemporaryStorage(
+        dedup=True, workdir=spool, settings={"zoom": 2}, resume=True
+    )
+    assert not storage.completed
+
+    # Without resuming, frames of the previous run are discarded.
+    TemporaryStorage(workdir=spool)
+    assert list(Path(spool).iterdir()) == []
+
+
+def test_storage_frame_cache(tmp_path):
+    cache = FrameCache(path=tmp_path / "cache")
+    storage = TemporaryStorage(cache=cache, cache_settings={"dashboard-version": 1})
+    for number, image in enumerate([b"a", b"b"]):
+        storage.save_item(make_item(number, image))
+    assert len(cache.entries) == 2
+
+    # Another run, using the same dashboard version, takes frames from the cache.
+    storage = TemporaryStorage(cache=cache, cache_settings={"dashboard-version": 1})
+    item = make_item(1, None)
+    assert storage.has_frame(item.frame)
+    item.skipped = True
+    imagefile = storage.save_item(item)
+    assert Path(imagefile).read_bytes() == b"b"
+
+    # A different dashboard version does not match.
+    storage = TemporaryStorage(cache=cache, cache_settings={"dashboard-version": 2})
+    assert not storage.has_frame(make_item(1, None).frame)
+
+
+def test_image_digest_mask():
+    Image = pytest.importorskip("PIL.Image")
+
+    def make_png(color):
+        picture = Image.new("RGB", (20, 10), "white")
+        picture.putpixel((15, 5), color)
+        buffer = io.BytesIO()
+        picture.save(buffer, format="PNG")
+        return buffer.getvalue()
+
+    red, blue = make_png((255, 0, 0)), make_png((0, 0, 255))
+    assert image_digest(red) != image_digest(blue)
+    mask = read_region("10, 0, 10, 10")
+    assert image_digest(red, mask=mask) == image_digest(blue, mask=mask)
+
+
+def test_read_region():
+    assert read_region(None) is None
+    assert read_region("1,2,3,4") == (1, 2, 3, 4)
+    with pytest.raises(ValueError):
+        read_region("1,2,3")
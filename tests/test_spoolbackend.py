@@ -0,0 +1,57 @@
+import os
+
+import pytest
+
+from grafanimate.spoolbackend import (
+    DirectorySpool,
+    MemorySpool,
+    SpoolFullError,
+    TmpfsSpool,
+    make_spool_backend,
+)
+
+
+def test_memory_spool():
+    spool = MemorySpool(max_bytes=10)
+    location = spool.write("a.png", b"12345")
+    assert spool.read(location) == b"12345"
+    spool.write("b.png", b"12345")
+    with pytest.raises(SpoolFullError):
+        spool.write("c.png", b"1")
+    spool.delete("b.png")
+    spool.write("c.png", b"1")
+    assert spool.size == 6
+    assert spool.stats.writes == 3
+    assert spool.stats.bytes_written == 11
+    assert spool.stats.reads == 1
+    assert spool.path is None
+
+
+def test_directory_spool(tmp_path):
+    spool = DirectorySpool(base=str(tmp_path))
+    location = spool.write("a.png", b"abc")
+    assert os.path.dirname(location) == spool.path
+    assert spool.read("a.png") == b"abc"
+    assert spool.exists(location)
+    spool.close()
+    assert not os.path.exists(spool.path)
+
+    # Persistent directories are retained.
+    spool = DirectorySpool(path=str(tmp_path / "spool"))
+    spool.write("a.png", b"abc")
+    spool.close()
+    assert (tmp_path / "spool" / "a.png").read_bytes() == b"abc"
+
+
+def test_tmpfs_spool_fallback(tmp_path):
+    spool = TmpfsSpool(base=str(tmp_path / "missing"))
+    assert os.path.isdir(spool.path)
+    spool.close()
+
+
+def test_make_spool_backend():
+    assert isinstance(make_spool_backend("memory", max_bytes=1), MemorySpool)
+    with pytest.raises(ValueError):
+        make_spool_backend("memory", path="/tmp/foo")  # noqa: S108
+    with pytest.raises(ValueError):
+        make_spool_backend("floppy")